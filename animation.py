@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming animation output: every frame is encoded and written when it is rendered,
+so the memory use does not grow with the number of iterations.
+"""
+
+import io
+import struct
+
+import imageio
+import numpy
+from PIL import Image
+
+
+def skip_sub_blocks(data, position):
+    """
+    :param data: GIF bytes
+    :param position: start of a sub-block sequence
+    :return: position after the terminating empty sub-block
+    """
+    while data[position] != 0:
+        position += data[position] + 1
+
+    return position + 1
+
+
+def gif_image_block(data):
+    """
+    Extracts the image of a single-frame GIF with its color table as a local one
+
+    :param data: bytes of a single-frame GIF
+    :return: (width, height, image descriptor + local color table + image data)
+    """
+    (width, height, flags) = struct.unpack('<HHB', data[6:11])
+    position = 13
+
+    table = b''
+    table_bits = 0
+    if flags & 0x80:
+        table_bits = flags & 0x07
+        table = data[position:position + 3 * 2 ** (table_bits + 1)]
+        position += len(table)
+
+    while data[position] == 0x21:
+        # Extensions of the single frame are dropped
+        position = skip_sub_blocks(data, position + 2)
+
+    if data[position] != 0x2C:
+        raise ValueError('Unexpected GIF block: %i' % data[position])
+
+    descriptor = bytearray(data[position:position + 10])
+    position += 10
+
+    if descriptor[9] & 0x80:
+        table_bits = descriptor[9] & 0x07
+        table = data[position:position + 3 * 2 ** (table_bits + 1)]
+        position += len(table)
+
+    # Local color table, the interlace flag is kept
+    descriptor[9] = 0x80 | (descriptor[9] & 0x40) | table_bits
+
+    end = skip_sub_blocks(data, position + 1)
+
+    return width, height, bytes(descriptor) + table + data[position:end]
+
+
+class GifWriter(object):
+    def __init__(self, path, duration=0.33):
+        """
+        Looping GIF written frame by frame, each frame with its own color table. imageio's GIF writer keeps
+        every frame in memory until it is closed.
+
+        :param path: target file, created by the first frame
+        :param duration: seconds per frame
+        """
+        self.path = path
+        self.delay = int(round(duration * 100))
+        self.size = None
+        self.frames = 0
+
+        self._file = None
+
+    def append_data(self, image):
+        """
+        :param image: [H x W x 3] uint8 array
+        :return: None
+        """
+        encoded = io.BytesIO()
+        Image.fromarray(numpy.ascontiguousarray(image)).quantize(256).save(encoded, format='GIF')
+        (width, height, block) = gif_image_block(encoded.getvalue())
+
+        if self.size is None:
+            self.size = (width, height)
+            self._file = open(self.path, 'wb')
+            self._file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+            # Infinite loop
+            self._file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+        elif (width, height) != self.size:
+            raise ValueError('Frame size changed from %s to %s' % (str(self.size), str((width, height))))
+
+        # Graphic control extension: frame delay, the frame is kept for the next one
+        self._file.write(b'\x21\xf9\x04\x04' + struct.pack('<H', self.delay) + b'\x00\x00')
+        self._file.write(block)
+        self.frames += 1
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.write(b'\x3b')
+            self._file.close()
+
+
+class AnimationWriter(object):
+    def __init__(self, path, duration=0.33):
+        """
+        Frame sink appending rendered figures to an animation
+
+        :param path: *.gif is written by GifWriter, other formats (like *.mp4) by imageio's video writers,
+                     which need the imageio-ffmpeg or the av package
+        :param duration: seconds per frame
+        """
+        self.path = path
+
+        if path.lower().endswith('.gif'):
+            self.writer = GifWriter(path, duration)
+        else:
+            self.writer = imageio.get_writer(path, fps=1.0 / duration)
+
+        self.frames = 0
+
+    def append(self, fig):
+        """
+        Appends the current content of a figure
+
+        :param fig: matplotlib figure with an Agg based canvas
+        :return: None
+        """
+        fig.canvas.draw()
+        image = numpy.asarray(fig.canvas.buffer_rgba())[:, :, :3]
+        self.writer.append_data(image)
+        self.frames += 1
+
+    def close(self):
+        self.writer.close()
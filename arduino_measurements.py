@@ -9,6 +9,7 @@ Copyright MIT, Máté Szedlák 2016-2018.
 import random
 
 from base_objects import Loads
+from load_source import LoadFile, LoadSeries
 
 
 def convert_node_id_to_dof_id(node_list):
@@ -30,8 +31,22 @@ def convert_node_id_to_dof_id(node_list):
 
 
 class ArduinoMeasurements(object):
-    def __init__(self, node_list):
+    def __init__(self, node_list, stream=None, load_series=''):
+        """
+        Sensor input
+
+        :param node_list: list of measured degree of freedoms, like ['12X', '15Z']
+        :param stream: started SensorStream with one channel per measured DOF, or None to use the mocked input
+        :param load_series: load file replayed record by record, '' to read ./loads/<title>.txt
+        """
         self.id_list = convert_node_id_to_dof_id(node_list)
+        self.stream = stream
+
+        if load_series:
+            self.load_source = LoadSeries(load_series)
+        else:
+            # Created on the first update, when the title is known
+            self.load_source = None
 
         self.displacements = []
         self.loads = []
@@ -53,7 +68,18 @@ class ArduinoMeasurements(object):
         else:
             return [fake]
 
+    @property
+    def finished(self):
+        """
+        :return: True if a replayed load series has no more records
+        """
+        return self.load_source is not None and self.load_source.finished
+
     def calibrate(self):
+        if self.stream is not None:
+            # The first frame is the unloaded reference
+            return list(self.stream.wait_snapshot().values)
+
         return [0]
 
     def update(self, loads, title=''):
@@ -65,20 +91,26 @@ class ArduinoMeasurements(object):
         Other radial displacement shall be divided into X/Y/Z directional components.
         """
 
-        # TODO: write function for:
-        try:
-            with open("./loads/%s.txt" % title, "r") as sourcefile:
-                load_input = sourcefile.readline().strip().split(' ')
+        if not isinstance(self.load_source, LoadSeries):
+            if self.load_source is None or self.load_source.path != "./loads/%s.txt" % title:
+                # Parsed again only if the file changes
+                self.load_source = LoadFile("./loads/%s.txt" % title)
 
-            load = Loads({'forces': [[int(load_input[0]), float(load_input[1])]]})
+        try:
+            load = Loads({'forces': self.load_source.forces()})
             loads.forces = load.forces
+            self.loads = load.forces
 
-        except IOError:
-            print("The following file could not be opened: ./loads/%s" % title)
+        except (IOError, OSError):
+            print("The following file could not be opened: %s" % self.load_source.path)
             print("Please make sure that the load data is available for the program")
             raise IOError
 
-        measurements = self.read_raw_input(5, 0)
+        if self.stream is not None:
+            # Latest complete frame, never waits for the sensors
+            measurements = self.stream.snapshot().values
+        else:
+            measurements = self.read_raw_input(5, 0)
 
         self.displacements = [[self.id_list[i], self.initial_measurements[i] - measurements[i]]
                               for i in range(len(self.id_list))]
@@ -7,6 +7,7 @@ Copyright MIT, Máté Szedlák 2016-2018.
 """
 
 import math
+import numpy
 import os
 
 
@@ -29,12 +30,39 @@ def element_length(structure, index):
     :param index: the index of the target element
     :return: the length of the index-th element
     """
+    (start, end) = structure.connectivity[index]
     return math.sqrt(sum([(j - k) ** 2 for j, k
-                          in zip(structure.node[structure.element[index].connection[1]],
-                                 structure.node[structure.element[index].connection[0]])]))
+                          in zip(structure.coordinates[end].tolist(), structure.coordinates[start].tolist())]))
+
+
+def read_only(array):
+    """
+    :param array: numpy array
+    :return: read-only view of the array
+    """
+    view = array.view()
+    view.flags.writeable = False
+
+    return view
+
+
+class FrozenList(list):
+    """
+    List copy of structure data. The changes would be lost, so they raise TypeError.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Copy of the structure data, assign StructuralData.node or change the elements instead')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (list(self), )
 
 
 class Element(object):
+    __slots__ = ['connection', 'material', 'section']
+
     def __init__(self, connection, material, section):
         """
         Element model
@@ -61,11 +89,80 @@ class Element(object):
             raise TypeError('section data should be float but got:\n%s %s' % (section, type(section)))
 
 
+class ElementView(object):
+    __slots__ = ['structure', 'index']
+
+    def __init__(self, structure, index):
+        """
+        Element of a StructuralData, reads and writes the arrays of the structure
+
+        :param structure: StructuralData object
+        :param index: element ID
+        """
+        self.structure = structure
+        self.index = index
+
+    @property
+    def connection(self):
+        return FrozenList(self.structure.connectivity[self.index].tolist())
+
+    @property
+    def material(self):
+        return float(self.structure.material[self.index])
+
+    @material.setter
+    def material(self, value):
+        self.structure.set_material(self.index, value)
+
+    @property
+    def section(self):
+        return float(self.structure.section[self.index])
+
+    @section.setter
+    def section(self, value):
+        self.structure.set_section(self.index, value)
+
+
+class ElementSequence(object):
+    __slots__ = ['structure']
+
+    def __init__(self, structure):
+        """
+        List-like access to the elements of a StructuralData
+
+        :param structure: StructuralData object
+        """
+        self.structure = structure
+
+    def __len__(self):
+        return len(self.structure.connectivity)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('element index out of range: %i' % index)
+
+        return ElementView(self.structure, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield ElementView(self.structure, index)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('The elements of a StructuralData are fixed, create a new structure to change the topology')
+
+    __setitem__ = __delitem__ = append = extend = insert = pop = remove = _read_only
+
+
 class StructuralData(object):
     def __init__(self, node_list, element_list, label=''):
         """
         Data model for structures
 
+        The data is stored in arrays: the topology (coordinates, connectivity) is read-only and shared between
+        copies, the parameter vectors (material, section) are copied on the first write after copying.
+
         :param node_list: list of nodal coordinates [ 1.[X, Y, Z], 2.[X, Y, Z], ... ]
         :param element_list: list of elements
         - connection [i, j]
@@ -76,18 +173,150 @@ class StructuralData(object):
         self.error = 0
         self.label = label
 
-        # Build node list
-        self.node = []
+        # Check node list
         for node in node_list:
-            if type(node) is list and len(node) == 3:
-                self.node.append(node)
-            else:
+            if not (type(node) is list and len(node) == 3):
                 raise TypeError('Nodal data is corrupt.\nType should be [float, float, float] but found:\n%s as %s'
                                 % (str([type(x) for x in node]), str(node)))
-        # Build element list
-        self.element = []
-        for element in element_list:
-            self.element.append(Element(element[0], element[1], element[2]))
+
+        # Check element list
+        elements = [Element(element[0], element[1], element[2]) for element in element_list]
+
+        self.coordinates = read_only(numpy.array(node_list, dtype=float).reshape(-1, 3))
+        self.connectivity = read_only(numpy.array([x.connection for x in elements], dtype=int).reshape(-1, 2))
+        self._material = numpy.array([x.material for x in elements], dtype=float)
+        self._section = numpy.array([x.section for x in elements], dtype=float)
+        self._shared = False
+
+    @classmethod
+    def from_arrays(cls, coordinates, connectivity, material, section, label='', copy_parameters=True):
+        """
+        Creates a structure from arrays without building element objects
+
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param material: [E] array of Young's moduli
+        :param section: [E] array of cross-sectional areas
+        :param label: title of the structure
+        :param copy_parameters: copy material and section now, otherwise on the first write (like memory-mapped data)
+        :return: StructuralData object
+        """
+        coordinates = numpy.asarray(coordinates, dtype=float)
+        connectivity = numpy.asarray(connectivity)
+
+        if coordinates.ndim != 2 or coordinates.shape[1] != 3:
+            raise TypeError('Nodal data is corrupt. Shape should be [N x 3] but found: %s' % str(coordinates.shape))
+
+        if connectivity.ndim != 2 or connectivity.shape[1] != 2 or connectivity.dtype.kind not in 'iu':
+            raise TypeError('connection data is corrupt. Type should be [E x 2] integers but found: %s %s'
+                            % (str(connectivity.shape), connectivity.dtype))
+
+        if numpy.any(connectivity[:, 0] == connectivity[:, 1]):
+            raise ValueError('Connection start-end should not match: %s'
+                             % str(connectivity[connectivity[:, 0] == connectivity[:, 1]][0].tolist()))
+
+        if len(material) != len(connectivity) or len(section) != len(connectivity):
+            raise TypeError('material and section data should be given for all %i elements' % len(connectivity))
+
+        structure = cls.__new__(cls)
+        structure.error = 0
+        structure.label = label
+        structure.coordinates = read_only(coordinates)
+        structure.connectivity = read_only(connectivity)
+        if copy_parameters:
+            structure._material = numpy.array(material, dtype=float)
+            structure._section = numpy.array(section, dtype=float)
+            structure._shared = False
+        else:
+            structure._material = numpy.asarray(material, dtype=float)
+            structure._section = numpy.asarray(section, dtype=float)
+            structure._shared = True
+
+        return structure
+
+    def copy(self, label=None):
+        """
+        Cheap copy: the topology is shared, the parameter vectors are copied on the first write
+
+        :param label: title of the copy, the original's one by default
+        :return: StructuralData object
+        """
+        structure = self.__class__.__new__(self.__class__)
+        structure.__dict__.update(self.__dict__)
+        if label is not None:
+            structure.label = label
+
+        self._shared = True
+        structure._shared = True
+
+        return structure
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def _own_parameters(self):
+        """
+        Copies the shared parameter vectors before writing
+
+        :return: None
+        """
+        if self._shared:
+            self._material = self._material.copy()
+            self._section = self._section.copy()
+            self._shared = False
+
+    @property
+    def node(self):
+        """
+        :return: read-only list of nodal coordinates [ 1.[X, Y, Z], 2.[X, Y, Z], ... ], see FrozenList
+        """
+        return FrozenList(FrozenList(x) for x in self.coordinates.tolist())
+
+    @node.setter
+    def node(self, node_list):
+        self.coordinates = read_only(numpy.array(node_list, dtype=float).reshape(-1, 3))
+
+    @property
+    def element(self):
+        """
+        :return: list-like sequence of the elements
+        """
+        return ElementSequence(self)
+
+    @property
+    def material(self):
+        """
+        :return: read-only [E] array of Young's moduli
+        """
+        return read_only(self._material)
+
+    @property
+    def section(self):
+        """
+        :return: read-only [E] array of cross-sectional areas
+        """
+        return read_only(self._section)
+
+    def set_material(self, index, value):
+        """
+        :param index: element ID(s), anything accepted by numpy indexing
+        :param value: new Young's modulus (or moduli)
+        :return: None
+        """
+        self._own_parameters()
+        self._material[index] = value
+
+    def set_section(self, index, value):
+        """
+        :param index: element ID(s), anything accepted by numpy indexing
+        :param value: new cross-sectional area(s)
+        :return: None
+        """
+        self._own_parameters()
+        self._section[index] = value
 
     def generate_coordinate_list(self):
         """
@@ -95,7 +324,32 @@ class StructuralData(object):
 
         :return: [1. connection [1. node [X, Y, Z], 2. node [X, Y, Z]], 2. connection [[], []], ...]
         """
-        return [[self.node[x.connection[0]], self.node[x.connection[1]]] for x in self.element]
+        return self.coordinates[self.connectivity].tolist()
+
+
+class DofPartition(object):
+    def __init__(self, supports, node_number):
+        """
+        Free and constrained DOF sets of a structure
+
+        :param supports: [[DOF ID, displacement], ...]
+        :param node_number: number of nodes of the structure
+        """
+        self.dof_number = node_number * 3
+
+        self.constrained = read_only(numpy.unique(numpy.array([x[0] for x in supports], dtype=int)))
+        self.free = read_only(numpy.setdiff1d(numpy.arange(self.dof_number), self.constrained))
+
+        # Position of each DOF in the reduced system, -1 if constrained
+        reduced_index = numpy.full(self.dof_number, -1, dtype=int)
+        reduced_index[self.free] = numpy.arange(len(self.free))
+        self.reduced_index = read_only(reduced_index)
+
+        # Plane structures have every Z DOF supported
+        if node_number > 0 and numpy.count_nonzero(self.constrained % 3 == 2) == node_number:
+            self.dimension = 2
+        else:
+            self.dimension = 3
 
 
 class Boundaries(object):
@@ -106,11 +360,37 @@ class Boundaries(object):
         :param support_list: [DOF ID, displacement] - Only rigid supports (displacement = 0 by default)
         """
         self.supports = support_list
+
+    @property
+    def supports(self):
+        """
+        :return: copy of the supports, changes take effect by assigning them back
+        """
+        return [list(x) for x in self._supports]
+
+    @supports.setter
+    def supports(self, support_list):
         for support in support_list:
             if not(type(support) is list and len(support) == 2 and
                    type(support[0]) is int and type(support[1]) is float):
                 raise TypeError('support data is corrupt. Type should be [int, float] but found:\n%s' % str(support))
 
+        # Copied, so the cached partitions cannot go stale by changing the list of the caller
+        self._supports = [list(x) for x in support_list]
+        self._partitions = {}
+
+    def partition(self, node_number):
+        """
+        DOF partition, computed once and dropped when the supports are replaced
+
+        :param node_number: number of nodes of the structure
+        :return: DofPartition object
+        """
+        if node_number not in self._partitions:
+            self._partitions[node_number] = DofPartition(self._supports, node_number)
+
+        return self._partitions[node_number]
+
 
 class Loads(object):
     def __init__(self, loads):
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Batch model updating: independent jobs on a bounded process pool, each writing into its own output folder.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from parameters import Parameterization
+from updating import Convergence
+
+# Options of a job passed to Truss as they are
+_job_options = ['solver', 'method', 'stats', 'load_series', 'graphics', 'log', 'render_every', 'animation',
+                'save_frames']
+
+# Options of a job building the parameterization and the convergence criteria of its updating
+_updating_options = ['parameters', 'material_bounds', 'section_bounds', 'tolerance', 'parameter_tolerance',
+                     'stall_limit']
+
+
+def job_title(structure):
+    """
+    :param structure: structure file name
+    :return: default title of the job
+    """
+    return os.path.basename(structure).replace('.str', '').replace('.trb', '')
+
+
+def read_manifest(path, measurements=None, iterations=10, defaults=None):
+    """
+    Reads the jobs of a batch
+
+    :param path: JSON file with a list of jobs, like
+                 [{"structure": "bridge.str", "measurements": ["13Y"], "iterations": 10, "solver": "sparse",
+                   "method": "adaptive", "parameters": "EA", "section_bounds": [0.5, 2], "tolerance": 1e-3}, ...]
+                 or a folder like ./structures: every *.str and *.trb file in it is a job with the given
+                 measurements and iterations
+    :param measurements: measured nodes of the jobs without their own, like ['12X', '14Z']
+    :param iterations: iteration number of the jobs without their own
+    :param defaults: options of the jobs without their own, see truss_options()
+    :return: [{'structure', 'title', 'measurements', 'iterations', ...}, ...]
+    """
+    if os.path.isdir(path):
+        # Structure files are read relative to ./structures
+        jobs = [{'structure': os.path.relpath(os.path.join(path, x), './structures')}
+                for x in sorted(os.listdir(path)) if x.endswith('.str') or x.endswith('.trb')]
+    else:
+        with open(path) as source:
+            jobs = json.load(source)
+
+        if not isinstance(jobs, list):
+            raise ValueError('The batch manifest should be a list of jobs: %s' % path)
+
+    for (index, job) in enumerate(jobs):
+        if not isinstance(job, dict) or not job.get('structure'):
+            raise ValueError('Job %i has no structure: %s' % (index, str(job)))
+
+        if not job['structure'].endswith('.trb') and not job['structure'].endswith('.str'):
+            job['structure'] += '.str'
+
+        job.setdefault('title', job_title(job['structure']))
+        job.setdefault('measurements', measurements)
+        job.setdefault('iterations', iterations)
+        for (option, value) in (defaults or {}).items():
+            job.setdefault(option, value)
+
+        if not job['measurements']:
+            raise ValueError('Job %i has no measurements: %s' % (index, job['structure']))
+
+    return jobs
+
+
+def unique_outputs(jobs, output_dir):
+    """
+    Assigns an own output folder to each job, repeated titles get a numbered suffix
+
+    :param jobs: see read_manifest()
+    :param output_dir: root folder of the batch
+    :return: None
+    """
+    used = set()
+    for job in jobs:
+        name = job['title']
+        suffix = 1
+        while name in used:
+            suffix += 1
+            name = '%s-%i' % (job['title'], suffix)
+        used.add(name)
+        job['output_dir'] = os.path.join(output_dir, name)
+
+
+def truss_options(job):
+    """
+    :param job: see read_manifest(), with the options of _job_options and _updating_options, like the command line
+                flags of update_truss.py: 'tolerance' and 'parameter_tolerance' default to 1e-4 with the adaptive
+                method and are off otherwise
+    :return: keyword arguments of the Truss object of the job
+    """
+    options = {x: job[x] for x in _job_options if x in job}
+    # The jobs share the processor cores and the screen: one process and offscreen rendering per job
+    options['headless'] = True
+
+    options['parameterization'] = Parameterization(job.get('parameters', 'E'),
+                                                   job.get('material_bounds', (0.0, float('inf'))),
+                                                   job.get('section_bounds', (0.0, float('inf'))))
+
+    if job.get('method') == 'adaptive' or job.get('tolerance') is not None or \
+            job.get('parameter_tolerance') is not None:
+        options['convergence'] = Convergence(
+            error_tolerance=1e-4 if job.get('tolerance') is None else job['tolerance'],
+            parameter_tolerance=1e-4 if job.get('parameter_tolerance') is None else job['parameter_tolerance'],
+            stall_limit=job.get('stall_limit', 3))
+
+    return options
+
+
+def run_job(job):
+    """
+    Runs one job in a worker process of the batch. Failures are reported in the summary instead of raised.
+
+    :param job: see read_manifest(), with its 'output_dir'
+    :return: {'title', 'structure', 'status', 'error', 'iterations', 'original_error', 'updated_error',
+              'seconds', 'output_dir'}
+    """
+    from truss_objects import Truss
+
+    summary = {'title': job['title'], 'structure': job['structure'], 'status': 'failed', 'error': '',
+               'iterations': 0, 'original_error': None, 'updated_error': None, 'seconds': 0.0,
+               'output_dir': job['output_dir']}
+    start = time.time()
+
+    try:
+        truss = Truss(input_file=job['structure'], title=job['title'], measurements=job['measurements'],
+                      output_dir=job['output_dir'], **truss_options(job))
+        summary['iterations'] = truss.start_model_updating(job['iterations'], pause=0)
+        summary['original_error'] = float(truss.original.error)
+        summary['updated_error'] = float(truss.updated.error)
+        summary['status'] = 'ok'
+    except Exception as exception:
+        summary['error'] = '%s: %s' % (type(exception).__name__, str(exception))
+        with open(os.path.join(job['output_dir'], 'error.txt'), 'w') as target:
+            target.write(traceback.format_exc())
+
+    summary['seconds'] = time.time() - start
+
+    return summary
+
+
+def run_batch(jobs, workers=1, output_dir='./batch', logger=None):
+    """
+    Runs the jobs on at most `workers` processes, each job in a fresh process
+
+    :param jobs: see read_manifest()
+    :param workers: number of parallel jobs
+    :param output_dir: root folder of the batch, every job writes into its own subfolder and
+                       the summary of the jobs is saved as summary.json
+    :param logger: logger of the progress, None for silence
+    :return: [summary of each job in the order of the jobs, ...], see run_job()
+    """
+    unique_outputs(jobs, output_dir)
+    for job in jobs:
+        if not os.path.exists(job['output_dir']):
+            os.makedirs(job['output_dir'])
+
+    summaries = {}
+    start = time.time()
+    pool = multiprocessing.Pool(max(1, min(workers, len(jobs))), maxtasksperchild=1)
+    try:
+        for summary in pool.imap_unordered(run_job, jobs):
+            summaries[summary['output_dir']] = summary
+            if logger is not None:
+                logger.info('[%i/%i] %s: %s (%.1f s)' % (len(summaries), len(jobs), summary['title'],
+                                                         summary['status'], summary['seconds']))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = [summaries[job['output_dir']] for job in jobs]
+    write_summary(results, output_dir, workers, time.time() - start, logger)
+
+    return results
+
+
+def write_summary(summaries, output_dir, workers, seconds, logger=None):
+    """
+    Saves the summary of a batch as summary.json
+
+    :param summaries: summary of each job, see run_job()
+    :param output_dir: root folder of the batch
+    :param workers: number of parallel jobs
+    :param seconds: duration of the batch
+    :param logger: logger of the summary table, None for silence
+    :return: None
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as target:
+        json.dump({'seconds': seconds, 'workers': workers, 'jobs': summaries}, target, indent=2)
+
+    if logger is not None:
+        logger.info(summary_table(summaries))
+
+
+def summary_table(summaries):
+    """
+    :param summaries: see run_batch()
+    :return: text table of the jobs
+    """
+    lines = ['%-24s %-8s %10s %12s %12s %9s' % ('title', 'status', 'iterations', 'original', 'updated', 'seconds')]
+    for summary in summaries:
+        if summary['status'] == 'ok':
+            lines.append('%-24s %-8s %10i %12.4g %12.4g %9.1f' % (summary['title'], summary['status'],
+                                                                  summary['iterations'], summary['original_error'],
+                                                                  summary['updated_error'], summary['seconds']))
+        else:
+            lines.append('%-24s %-8s %s' % (summary['title'], summary['status'], summary['error']))
+
+    return '\n'.join(lines)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Binary checkpoint of the model updating state, so an interrupted run continues from its last saved iteration.
+
+Layout: a 128 byte header followed by little-endian float64 arrays:
+    header: magic b'TRUSSCKP', format version (uint32), flags (uint32, bit 0: the structure before the last update
+            is stored), total and reset-relative loop counters, number of used load records, elements and history
+            rows, stalled updates (uint64), original error, updated error, damping, adaptive step size, error of
+            the structure before the last update (float64), SHA-1 digest of the topology (20 bytes)
+    material [E], section [E], error history [K x 2] (original error, updated error),
+    material [E] and section [E] of the structure before the last update (if stored)
+"""
+
+import hashlib
+import os
+import struct
+
+import numpy
+
+_magic = b'TRUSSCKP'
+_version = 3
+_header = struct.Struct('<8sIIQQQQQQddddd20s')
+_previous_flag = 1
+_header_size = 128
+
+
+def structure_digest(coordinates, connectivity):
+    """
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :return: SHA-1 digest of the topology (bytes)
+    """
+    digest = hashlib.sha1()
+    digest.update(numpy.ascontiguousarray(coordinates, dtype='<f8').tobytes())
+    digest.update(numpy.ascontiguousarray(connectivity, dtype='<i8').tobytes())
+
+    return digest.digest()
+
+
+def write_checkpoint(path, state):
+    """
+    :param path: target file, replaced atomically
+    :param state: {'total', 'loop', 'records', 'stalls', 'original_error', 'error', 'damping', 'step', 'digest',
+                   'material': [E], 'section': [E], 'history': [K x 2],
+                   'previous': None or {'material': [E], 'section': [E], 'error'} of the structure before the last
+                   update, restored by the back-offs of the adaptive method}
+    :return: None
+    """
+    material = numpy.ascontiguousarray(state['material'], dtype='<f8')
+    section = numpy.ascontiguousarray(state['section'], dtype='<f8')
+    history = numpy.ascontiguousarray(state['history'], dtype='<f8').reshape(-1, 2)
+    previous = state.get('previous')
+
+    header = _header.pack(_magic, _version, _previous_flag if previous is not None else 0, state['total'],
+                          state['loop'], state['records'], len(material), len(history), state['stalls'],
+                          state['original_error'], state['error'], state['damping'], state['step'],
+                          previous['error'] if previous is not None else 0.0, state['digest'])
+
+    # Written under a temporary name, an interruption while saving keeps the previous checkpoint
+    temporary = path + '.%i.tmp' % os.getpid()
+    with open(temporary, 'wb') as target:
+        target.write(header.ljust(_header_size, b'\0'))
+        target.write(material.tobytes())
+        target.write(section.tobytes())
+        target.write(history.tobytes())
+        if previous is not None:
+            target.write(numpy.ascontiguousarray(previous['material'], dtype='<f8').tobytes())
+            target.write(numpy.ascontiguousarray(previous['section'], dtype='<f8').tobytes())
+    os.replace(temporary, path)
+
+
+def read_checkpoint(path):
+    """
+    :param path: checkpoint file
+    :return: state, see write_checkpoint()
+    """
+    with open(path, 'rb') as source:
+        data = source.read()
+
+    if len(data) < _header_size or data[:len(_magic)] != _magic:
+        raise ValueError('Not a checkpoint file: %s' % path)
+
+    (_, version, flags, total, loop, records, element_number, history_length, stalls, original_error, error,
+     damping, step, previous_error, digest) = _header.unpack(data[:_header.size])
+    if version != _version:
+        raise ValueError('Unsupported checkpoint version %i in %s' % (version, path))
+
+    arrays = numpy.frombuffer(data, dtype='<f8', offset=_header_size)
+    end = 2 * element_number + 2 * history_length
+    if len(arrays) != end + (2 * element_number if flags & _previous_flag else 0):
+        raise ValueError('Truncated checkpoint file: %s' % path)
+
+    if flags & _previous_flag:
+        previous = {'material': arrays[end:end + element_number].copy(),
+                    'section': arrays[end + element_number:].copy(),
+                    'error': previous_error}
+    else:
+        previous = None
+
+    return {'total': total, 'loop': loop, 'records': records, 'stalls': stalls, 'original_error': original_error,
+            'error': error, 'damping': damping, 'step': step, 'digest': digest,
+            'material': arrays[:element_number].copy(),
+            'section': arrays[element_number:2 * element_number].copy(),
+            'history': arrays[2 * element_number:end].reshape(-1, 2).copy(),
+            'previous': previous}
@@ -60,3 +60,20 @@ def bridge_displacement():
             0.9965277777786364, -20.6748591535301, 0.0, 1.3465277777788993, -14.504915492119697, 0.0,
             -0.11180555555562562, -5.184971830706875, 0.0, 1.5652777777790776, 0.0, 0.0, 1.5215277777790392,
             -5.184971830706875, 0.0]
+
+
+@pytest.fixture()
+def make_bridge(tmpdir):
+    """Bridge models writing their outputs into a folder of the temporary directory"""
+    def make(folder='', measurements=('11Y', ), **options):
+        return Truss('bridge.str', 'bridge', list(measurements), output_dir=str(tmpdir.join(folder)), **options)
+    return make
+
+
+@pytest.fixture()
+def load_series(tmpdir):
+    """Six load samples cycling through three forces"""
+    path = str(tmpdir.join('loads.txt'))
+    with open(path, 'w') as target:
+        target.write(''.join('25 %.1f\n' % (-9.8 * (1 + i % 3)) for i in range(6)))
+    return path
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Distributed model updating: a coordinator hands out the jobs of a batch (see batch) to workers connected over
+TCP or Unix sockets. A worker keeps its parsed structures and their cached factorizations between jobs.
+
+Every message is a JSON object prefixed by its length (4 bytes, big-endian):
+    worker -> coordinator: {"type": "ready", "worker": name}
+    coordinator -> worker: {"type": "job", "id": job ID, "job": {...}} or {"type": "stop"}
+    worker -> coordinator: {"type": "result", "id": job ID, "result": {...}}, see Worker.run_job()
+The connection of a worker is closed after the stop message. The job of a lost worker is handed out again.
+"""
+
+import collections
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import traceback
+
+from batch import _job_options, _updating_options, truss_options, unique_outputs
+
+_length = struct.Struct('>I')
+
+# Largest accepted message, bigger lengths mean a corrupt stream
+_max_message = 256 * 1024 * 1024
+
+
+def parse_address(address):
+    """
+    :param address: 'tcp://host:port' or 'unix:///path/to/socket'
+    :return: (socket family, address of the socket module)
+    """
+    if address.startswith('tcp://'):
+        (host, port) = address[len('tcp://'):].rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+
+    raise ValueError('Address should be tcp://host:port or unix:///path but got: %s' % address)
+
+
+def send_message(stream, message):
+    """
+    :param stream: writable binary file of a socket
+    :param message: JSON serializable dict
+    :return: None
+    """
+    data = json.dumps(message).encode()
+    stream.write(_length.pack(len(data)) + data)
+    stream.flush()
+
+
+def receive_message(stream):
+    """
+    :param stream: readable binary file of a socket
+    :return: dict, None if the connection was closed between two messages
+    """
+    header = stream.read(_length.size)
+    if not header:
+        return None
+    if len(header) < _length.size:
+        raise ConnectionError('Connection closed within a message')
+
+    (size, ) = _length.unpack(header)
+    if size > _max_message:
+        raise ValueError('Message too long: %i bytes' % size)
+
+    data = stream.read(size)
+    if len(data) < size:
+        raise ConnectionError('Connection closed within a message')
+
+    return json.loads(data.decode())
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        """
+        Serves one worker connection until every job is done or the worker is lost
+
+        :return: None
+        """
+        coordinator = self.server.coordinator
+
+        try:
+            hello = receive_message(self.rfile)
+        except (OSError, ValueError):
+            return
+        if hello is None or hello.get('type') != 'ready':
+            return
+
+        while True:
+            index = coordinator.next_job()
+            if index is None:
+                try:
+                    send_message(self.wfile, {'type': 'stop'})
+                except OSError:
+                    pass
+                return
+
+            try:
+                send_message(self.wfile, {'type': 'job', 'id': index, 'job': coordinator.jobs[index]})
+                reply = receive_message(self.rfile)
+                if reply is None or reply.get('type') != 'result' or reply.get('id') != index:
+                    raise ConnectionError('No result from worker %s' % hello.get('worker'))
+            except (OSError, ValueError) as exception:
+                coordinator.abandon(index, '%s: %s' % (type(exception).__name__, str(exception)))
+                return
+
+            coordinator.complete(index, reply['result'])
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class Coordinator(object):
+    def __init__(self, address, jobs, retries=2):
+        """
+        Socket server handing out jobs to the connecting workers, one job at a time per worker
+
+        :param address: listening address, 'tcp://host:port' (port 0 picks a free one) or 'unix:///path'
+        :param jobs: see batch.read_manifest()
+        :param retries: number of times the job of a lost worker is handed out again
+        """
+        self.jobs = jobs
+        self.retries = retries
+
+        # Folder of each job relative to the output folder of the worker running it
+        unique_outputs(jobs, '')
+        self.results = [None] * len(jobs)
+        self.attempts = [0] * len(jobs)
+
+        self._pending = collections.deque(range(len(jobs)))
+        self._running = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+        (family, target) = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                os.remove(target)
+            self.server = ThreadingUnixServer(target, CoordinatorHandler)
+            self.address = address
+        else:
+            self.server = ThreadingTCPServer(target, CoordinatorHandler)
+            self.address = 'tcp://%s:%i' % self.server.server_address[:2]
+        self.server.coordinator = self
+
+    def start(self):
+        """
+        Accepts the workers in a background thread
+
+        :return: self
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name='coordinator', daemon=True)
+        self._thread.start()
+
+        return self
+
+    @property
+    def finished(self):
+        """
+        :return: True if every job has a result
+        """
+        return all(x is not None for x in self.results)
+
+    def next_job(self):
+        """
+        Waits for a job while others are running, since their workers can be lost
+
+        :return: job ID, None if every job is done
+        """
+        with self._condition:
+            while not self._pending and self._running:
+                self._condition.wait()
+
+            if not self._pending:
+                return None
+
+            index = self._pending.popleft()
+            self._running.add(index)
+            self.attempts[index] += 1
+
+            return index
+
+    def complete(self, index, result):
+        """
+        :param index: job ID
+        :param result: summary of the job, see Worker.run_job()
+        :return: None
+        """
+        with self._condition:
+            self._running.discard(index)
+            self.results[index] = result
+            self._condition.notify_all()
+
+    def abandon(self, index, reason):
+        """
+        Hands out the job of a lost worker again, or fails it after too many attempts
+
+        :param index: job ID
+        :param reason: description of the lost connection
+        :return: None
+        """
+        with self._condition:
+            self._running.discard(index)
+            if self.attempts[index] <= self.retries:
+                self._pending.append(index)
+            else:
+                job = self.jobs[index]
+                self.results[index] = {'title': job['title'], 'structure': job['structure'], 'status': 'failed',
+                                       'error': 'Worker lost %i times: %s' % (self.attempts[index], reason),
+                                       'iterations': 0, 'original_error': None, 'updated_error': None,
+                                       'seconds': 0.0, 'output_dir': '', 'worker': ''}
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait, None to wait for every job
+        :return: results of the jobs in the order of the jobs, None for the unfinished ones
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.finished, timeout)
+
+            return list(self.results)
+
+    def close(self):
+        """
+        Stops accepting workers
+
+        :return: None
+        """
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+
+        (family, target) = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+class Worker(object):
+    def __init__(self, name='', output_dir='./worker', cache_size=4):
+        """
+        Runs the jobs of a coordinator, keeping the models of the latest structures
+
+        :param name: name of the worker in the results, '<host>-<process ID>' by default
+        :param output_dir: root folder of the jobs, every job writes into its own subfolder
+        :param cache_size: number of structures kept with their cached factorizations
+        """
+        self.name = name or '%s-%i' % (socket.gethostname(), os.getpid())
+        self.output_dir = output_dir
+        self.cache_size = cache_size
+        self.models = collections.OrderedDict()
+        self.jobs = 0
+
+    @staticmethod
+    def model_key(job):
+        """
+        :param job: see batch.read_manifest()
+        :return: key of the kept model of the job
+        """
+        # The load series is read by the restart, the other options need their own model
+        return job['structure'], json.dumps({x: job[x] for x in _job_options + _updating_options
+                                             if x in job and x != 'load_series'}, sort_keys=True)
+
+    def model(self, job, output_dir):
+        """
+        :param job: see batch.read_manifest()
+        :param output_dir: output folder of the job
+        :return: (Truss object restarted for the job, True if the structure was already loaded)
+        """
+        from truss_objects import Truss
+
+        key = self.model_key(job)
+
+        if key in self.models:
+            self.models.move_to_end(key)
+            truss = self.models[key]
+            truss.restart(job['measurements'], load_series=job.get('load_series', ''), title=job['title'],
+                          output_dir=output_dir)
+            return truss, True
+
+        truss = Truss(input_file=job['structure'], title=job['title'], measurements=job['measurements'],
+                      output_dir=output_dir, **truss_options(job))
+        self.models[key] = truss
+
+        while len(self.models) > self.cache_size:
+            self.models.popitem(last=False)[1].finish()
+
+        return truss, False
+
+    def run_job(self, job):
+        """
+        Runs one job. Failures are reported in the result instead of raised.
+
+        :param job: see batch.read_manifest(), its 'output_dir' is relative to the output folder of the worker
+        :return: {'title', 'structure', 'status', 'error', 'iterations', 'original_error', 'updated_error',
+                  'seconds', 'output_dir', 'worker', 'warm', 'material': [E], 'section': [E],
+                  'history': [[original error, error], ...]}
+        """
+        output_dir = os.path.join(self.output_dir, job.get('output_dir', job['title']))
+        summary = {'title': job['title'], 'structure': job['structure'], 'status': 'failed', 'error': '',
+                   'iterations': 0, 'original_error': None, 'updated_error': None, 'seconds': 0.0,
+                   'output_dir': output_dir, 'worker': self.name, 'warm': False, 'material': [], 'section': [],
+                   'history': []}
+        start = time.time()
+
+        try:
+            (truss, summary['warm']) = self.model(job, output_dir)
+
+            summary['iterations'] = truss.start_model_updating(job['iterations'], pause=0)
+            summary['original_error'] = float(truss.original.error)
+            summary['updated_error'] = float(truss.updated.error)
+            summary['material'] = truss.updated.material.tolist()
+            summary['section'] = truss.updated.section.tolist()
+            summary['history'] = [[float(x) for x in row] for row in truss.history]
+            summary['status'] = 'ok'
+        except Exception as exception:
+            summary['error'] = '%s: %s' % (type(exception).__name__, str(exception))
+            summary['traceback'] = traceback.format_exc()
+
+            # The model may be half updated or half restarted, the next job with the same key starts a new one
+            truss = self.models.pop(self.model_key(job), None)
+            if truss is not None:
+                truss.finish()
+
+        summary['seconds'] = time.time() - start
+        self.jobs += 1
+
+        return summary
+
+    def serve(self, address, connect_timeout=10.0):
+        """
+        Runs jobs of a coordinator until it sends the stop message or closes the connection
+
+        :param address: address of the coordinator, see Coordinator
+        :param connect_timeout: seconds to wait for the coordinator to start listening
+        :return: number of jobs run
+        """
+        (family, target) = parse_address(address)
+        deadline = time.time() + connect_timeout
+
+        while True:
+            connection = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                connection.connect(target)
+                break
+            except OSError:
+                connection.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        jobs = 0
+        with connection, connection.makefile('rb') as reader, connection.makefile('wb') as writer:
+            send_message(writer, {'type': 'ready', 'worker': self.name})
+
+            while True:
+                message = receive_message(reader)
+                if message is None or message.get('type') != 'job':
+                    break
+
+                send_message(writer, {'type': 'result', 'id': message['id'], 'result': self.run_job(message['job'])})
+                jobs += 1
+
+        return jobs
+
+    def close(self):
+        """
+        Releases the kept models
+
+        :return: None
+        """
+        while self.models:
+            self.models.popitem()[1].finish()
+
+
+def serve(address, name='', output_dir='./worker', connect_timeout=10.0):
+    """
+    Worker process main function
+
+    :param address: address of the coordinator, see Coordinator
+    :param name: see Worker
+    :param output_dir: see Worker
+    :param connect_timeout: see Worker.serve()
+    :return: number of jobs run
+    """
+    worker = Worker(name, output_dir)
+    try:
+        return worker.serve(address, connect_timeout)
+    finally:
+        worker.close()
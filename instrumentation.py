@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Per-iteration timers and counters, exported as JSON lines and Prometheus text.
+"""
+
+import json
+import os
+import time
+
+
+class NullTimer(object):
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+# Shared no-op timer of disabled instrumentation
+NULL_TIMER = NullTimer()
+
+
+class PhaseTimer(object):
+    __slots__ = ['instrumentation', 'name', 'start']
+
+    def __init__(self, instrumentation, name):
+        """
+        Context manager adding its wall-clock time to a phase
+
+        :param instrumentation: Instrumentation object
+        :param name: phase name
+        """
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation(object):
+    def __init__(self, enabled=False, label='', jsonl_file='', prometheus_file=''):
+        """
+        Timers and counters of the model updating loop
+
+        :param enabled: switch, disabled instrumentation only costs a method call per measured block
+        :param label: structure label, used in the Prometheus labels
+        :param jsonl_file: file receiving one JSON line of statistics per iteration ('' to skip)
+        :param prometheus_file: Prometheus text exposition file rewritten after every iteration ('' to skip)
+        """
+        self.enabled = enabled
+        self.label = label
+        self.jsonl_file = jsonl_file
+        self.prometheus_file = prometheus_file
+
+        # Cumulative values
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+        self.iterations = 0
+
+        # Values of the latest iteration record, exported as Prometheus gauges
+        self.gauges = {}
+
+        # Values of the current iteration
+        self.iteration_times = {}
+        self.iteration_calls = {}
+        self.iteration_counters = {}
+        self.iteration_start = time.perf_counter()
+
+    def timer(self, name):
+        """
+        :param name: phase name, like 'solve'
+        :return: context manager measuring the phase
+        """
+        if self.enabled:
+            return PhaseTimer(self, name)
+        else:
+            return NULL_TIMER
+
+    def add_time(self, name, seconds):
+        """
+        :param name: phase name
+        :param seconds: elapsed time
+        :return: None
+        """
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.iteration_times[name] = self.iteration_times.get(name, 0.0) + seconds
+        self.iteration_calls[name] = self.iteration_calls.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        """
+        :param name: counter name, like 'factorizations'
+        :param value: increment
+        :return: None
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.iteration_counters[name] = self.iteration_counters.get(name, 0) + value
+
+    def end_iteration(self, **values):
+        """
+        Closes the statistics of an iteration and exports them
+
+        :param values: additional values of the iteration record, like errors
+        :return: the iteration record or None if disabled
+        """
+        if not self.enabled:
+            return None
+
+        self.iterations += 1
+        self.gauges = values
+
+        return self.export(values)
+
+    def flush(self):
+        """
+        Exports the phases measured after the last iteration, like closing the animation or the last checkpoint
+
+        :return: the record of the phases, None if disabled or nothing was measured
+        """
+        if not self.enabled or not (self.iteration_calls or self.iteration_counters):
+            return None
+
+        return self.export({'final': True})
+
+    def export(self, values):
+        """
+        Writes the record of the phases measured since the previous export and rewrites the Prometheus file
+
+        :param values: additional values of the record
+        :return: the record
+        """
+        now = time.perf_counter()
+
+        record = {'iteration': self.iterations,
+                  'timestamp': time.time(),
+                  'wall': now - self.iteration_start,
+                  'times': self.iteration_times,
+                  'calls': self.iteration_calls,
+                  'counters': self.iteration_counters}
+        record.update(values)
+
+        if self.jsonl_file:
+            with open(self.jsonl_file, 'a') as target:
+                target.write(json.dumps(record) + '\n')
+
+        if self.prometheus_file:
+            self.write_prometheus(self.gauges)
+
+        self.iteration_times = {}
+        self.iteration_calls = {}
+        self.iteration_counters = {}
+        self.iteration_start = now
+
+        return record
+
+    def prometheus_text(self, gauges=None):
+        """
+        Cumulative statistics in the Prometheus text exposition format
+
+        :param gauges: {name: value} of the latest iteration, exported as truss_<name>
+        :return: str
+        """
+        label = 'structure="%s"' % self.label.replace('\\', '\\\\').replace('"', '\\"')
+        lines = ['# HELP truss_iterations_total Model updating iterations',
+                 '# TYPE truss_iterations_total counter',
+                 'truss_iterations_total{%s} %i' % (label, self.iterations),
+                 '# HELP truss_phase_seconds_total Time spent in the phases of the model updating loop',
+                 '# TYPE truss_phase_seconds_total counter']
+        lines += ['truss_phase_seconds_total{%s,phase="%s"} %.9f' % (label, name, self.times[name])
+                  for name in sorted(self.times)]
+        lines += ['# HELP truss_phase_calls_total Number of measured phase runs',
+                  '# TYPE truss_phase_calls_total counter']
+        lines += ['truss_phase_calls_total{%s,phase="%s"} %i' % (label, name, self.calls[name])
+                  for name in sorted(self.calls)]
+        lines += ['# HELP truss_events_total Solver events',
+                  '# TYPE truss_events_total counter']
+        lines += ['truss_events_total{%s,event="%s"} %i' % (label, name, self.counters[name])
+                  for name in sorted(self.counters)]
+
+        for name in sorted(gauges or {}):
+            if isinstance(gauges[name], (int, float)):
+                lines += ['# TYPE truss_%s gauge' % name, 'truss_%s{%s} %r' % (name, label, float(gauges[name]))]
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, gauges=None):
+        """
+        Rewrites the Prometheus file atomically, so a scraper never sees a partial file
+
+        :param gauges: {name: value} of the latest iteration
+        :return: None
+        """
+        temporary = self.prometheus_file + '.tmp'
+        with open(temporary, 'w') as target:
+            target.write(self.prometheus_text(gauges))
+        os.replace(temporary, self.prometheus_file)
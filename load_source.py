@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Load input files. A record is a list of DOF ID and force pairs on one line, optionally led by a timestamp:
+    25 -9.8
+    1539782400.0 25 -9.8 31 -4.9
+Empty lines and lines starting with '#' are skipped.
+"""
+
+import os
+
+
+def parse_load_record(line):
+    """
+    :param line: one line of a load file
+    :return: (timestamp or None, [[DOF ID, force], ...]) or None for empty and comment lines
+    """
+    fields = line.split()
+    if not fields or fields[0].startswith('#'):
+        return None
+
+    # An odd number of fields starts with a timestamp
+    timestamp = None
+    if len(fields) % 2 == 1:
+        timestamp = float(fields[0])
+        fields = fields[1:]
+
+    return timestamp, [[int(fields[i]), float(fields[i + 1])] for i in range(0, len(fields), 2)]
+
+
+def read_load_records(path):
+    """
+    Reads a load file record by record, only the current line is held in memory
+
+    :param path: load file
+    :return: generator of (timestamp or None, [[DOF ID, force], ...])
+    """
+    with open(path, 'r') as source:
+        for line in source:
+            record = parse_load_record(line)
+            if record is not None:
+                yield record
+
+
+class LoadFile(object):
+    def __init__(self, path):
+        """
+        First record of a load file, parsed again only if the file changes
+
+        :param path: load file
+        """
+        self.path = path
+        self.parses = 0
+        self.finished = False
+
+        self._version = None
+        self._forces = None
+
+    def forces(self):
+        """
+        :return: [[DOF ID, force], ...]
+        """
+        status = os.stat(self.path)
+        version = (status.st_mtime_ns, status.st_size)
+
+        if version != self._version:
+            record = next(read_load_records(self.path), None)
+            if record is None:
+                raise IOError('No load record in %s' % self.path)
+
+            self._forces = record[1]
+            self._version = version
+            self.parses += 1
+
+        return self._forces
+
+
+class LoadSeries(object):
+    def __init__(self, path, repeat=False):
+        """
+        Time series of loads, every call of forces() returns the next record of the file
+
+        :param path: load file with one record per line
+        :param repeat: start over at the end of the file, otherwise the last record is kept
+        """
+        self.path = path
+        self.repeat = repeat
+        self.records = 0
+        self.timestamp = None
+
+        self._records = read_load_records(path)
+        self._next = next(self._records, None)
+        if self._next is None:
+            raise IOError('No load record in %s' % path)
+
+        self._forces = None
+
+    @property
+    def finished(self):
+        """
+        :return: True if the last record has been returned
+        """
+        return self._next is None
+
+    def forces(self):
+        """
+        :return: [[DOF ID, force], ...]
+        """
+        if self._next is None and self.repeat:
+            self._records = read_load_records(self.path)
+            self._next = next(self._records, None)
+
+        if self._next is not None:
+            (self.timestamp, self._forces) = self._next
+            self._next = next(self._records, None)
+            self.records += 1
+
+        return self._forces
+
+    def skip(self, records):
+        """
+        Passes records without using them, like the ones used before resuming an interrupted run
+
+        :param records: number of records to pass
+        :return: None
+        """
+        for _ in range(records):
+            self.forces()
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
 
 
-def start_logging(file=False, label=''):
+def start_logging(file=False, label='', directory='./logs'):
     # create logger with 'spam_application'
     logger = logging.getLogger(label)
     logger.setLevel(logging.DEBUG)
@@ -18,7 +19,7 @@ def start_logging(file=False, label=''):
     logger.addHandler(ch)
     if file:
         # create file handler which logs even debug messages
-        fh = logging.FileHandler('./logs/%s.log' % label)
+        fh = logging.FileHandler(os.path.join(directory, '%s.log' % label))
         fh.setLevel(logging.DEBUG)
         file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', "%Y-%m-%d %H:%M:%S")
         fh.setFormatter(file_formatter)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Binary structure format (*.trb), memory-mapped without parsing or copying.
+
+Layout: a 64 byte header followed by little-endian arrays, each starting at a multiple of 64 bytes:
+    header: magic b'TRUSSMDL', format version (uint32), reserved (uint32),
+            number of nodes, elements and supports (uint64)
+    coordinates [N x 3] float64, connectivity [E x 2] int64, material [E] float64, section [E] float64,
+    supports [S x 2] float64 (DOF ID, prescribed displacement)
+"""
+
+import os
+import struct
+
+import numpy
+
+_magic = b'TRUSSMDL'
+_version = 1
+_header = struct.Struct('<8sIIQQQ')
+_alignment = 64
+
+
+def array_layout(node_number, element_number, support_number):
+    """
+    :param node_number: number of nodes
+    :param element_number: number of elements
+    :param support_number: number of supported DOFs
+    :return: ([(name, dtype, shape, offset), ...], file size)
+    """
+    arrays = [('coordinates', '<f8', (node_number, 3)),
+              ('connectivity', '<i8', (element_number, 2)),
+              ('material', '<f8', (element_number,)),
+              ('section', '<f8', (element_number,)),
+              ('supports', '<f8', (support_number, 2))]
+
+    layout = []
+    offset = _alignment
+    for (name, dtype, shape) in arrays:
+        layout.append((name, dtype, shape, offset))
+        size = numpy.dtype(dtype).itemsize * int(numpy.prod(shape))
+        offset += -(-size // _alignment) * _alignment
+
+    return layout, offset
+
+
+def write_model_file(path, arrays):
+    """
+    :param path: target file
+    :param arrays: {'coordinates', 'connectivity', 'material', 'section', 'supports'} arrays,
+                   see read_input_file.load_structure
+    :return: None
+    """
+    (layout, size) = array_layout(len(arrays['coordinates']), len(arrays['connectivity']), len(arrays['supports']))
+
+    # Written under a temporary name, so a running reader never maps a partial file
+    temporary = path + '.%i.tmp' % os.getpid()
+    with open(temporary, 'wb') as target:
+        target.write(_header.pack(_magic, _version, 0, len(arrays['coordinates']), len(arrays['connectivity']),
+                                  len(arrays['supports'])))
+        for (name, dtype, shape, offset) in layout:
+            target.seek(offset)
+            target.write(numpy.ascontiguousarray(arrays[name], dtype=dtype).reshape(shape).tobytes())
+        target.truncate(size)
+    os.replace(temporary, path)
+
+
+def open_model_file(path):
+    """
+    Maps a binary structure file, the pages are only read when they are used and shared between processes
+
+    :param path: binary structure file
+    :return: {'coordinates', 'connectivity', 'material', 'section', 'supports'} read-only arrays backed by the file
+    """
+    with open(path, 'rb') as source:
+        header = source.read(_header.size)
+
+    if len(header) < _header.size:
+        raise ValueError('Not a binary structure file: %s' % path)
+
+    (magic, version, _, node_number, element_number, support_number) = _header.unpack(header)
+    if magic != _magic:
+        raise ValueError('Not a binary structure file: %s' % path)
+    if version != _version:
+        raise ValueError('Unsupported binary structure version %i in %s' % (version, path))
+
+    (layout, size) = array_layout(node_number, element_number, support_number)
+    if os.path.getsize(path) < size:
+        raise ValueError('Truncated binary structure file: %s' % path)
+
+    buffer = numpy.memmap(path, dtype=numpy.uint8, mode='r', shape=(size,))
+
+    return {name: numpy.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            for (name, dtype, shape, offset) in layout}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Worker pool evaluating the guesses of the elements in parallel.
+"""
+
+import multiprocessing
+import numpy
+
+from model_file import open_model_file
+from solver import factorization_key, factorize, FactorizationCache
+from stiffness import assemble_sparse_stiffness_matrix, assemble_stiffness_matrix, reduce_matrix
+from updating import RankOneEvaluator
+
+# Per-process state of the workers, set by initialize_worker()
+worker = {}
+
+
+def initialize_worker(coordinates, connectivity, free_dofs, solver, model_file=''):
+    """
+    Stores the topology shared by every trial, it is sent once per worker process
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :param free_dofs: list of unconstrained DOF IDs
+    :param solver: 'dense' or 'sparse'
+    :param model_file: binary structure file mapped instead of receiving the topology arrays, see model_file
+    :return: None
+    """
+    if model_file:
+        # Every worker maps the same pages of the file
+        arrays = open_model_file(model_file)
+        (coordinates, connectivity) = (arrays['coordinates'], arrays['connectivity'])
+
+    worker['coordinates'] = coordinates
+    worker['connectivity'] = connectivity
+    worker['free_dofs'] = free_dofs
+    worker['solver'] = solver
+    worker['factorizations'] = FactorizationCache(size=1)
+
+
+def evaluate_chunk(task):
+    """
+    Evaluates the trials of a group of elements in a worker process
+
+    :param task: (element IDs, material, section, forces, measurements, [factors, ...])
+    :return: [errors of the chunk for each factor vector, ...]
+    """
+    (elements, material, section, forces, measurements, factor_sets) = task
+    arrays = (worker['coordinates'], worker['connectivity'], material, section)
+
+    def build():
+        if worker['solver'] == 'sparse':
+            stiffness_matrix = assemble_sparse_stiffness_matrix(*arrays)
+        else:
+            stiffness_matrix = assemble_stiffness_matrix(*arrays)
+        return factorize(reduce_matrix(stiffness_matrix, worker['free_dofs']))
+
+    factorization = worker['factorizations'].get(factorization_key(arrays, worker['free_dofs']), build)
+    evaluator = RankOneEvaluator(factorization, worker['free_dofs'], forces, *arrays, measurements=measurements,
+                                 elements=elements)
+
+    return [evaluator.errors(factors[elements]) for factors in factor_sets]
+
+
+class GuessPool(object):
+    def __init__(self, workers, coordinates, connectivity, free_dofs, solver='dense', model_file=''):
+        """
+        Process pool evaluating element trials in parallel. Tasks carry only the parameter vectors,
+        the topology is sent to the workers once.
+
+        :param workers: number of worker processes
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param free_dofs: list of unconstrained DOF IDs
+        :param solver: 'dense' or 'sparse'
+        :param model_file: binary structure file of the topology, mapped by the workers instead of sending the arrays
+        """
+        self.workers = workers
+        self.element_number = len(connectivity)
+
+        if model_file:
+            (coordinates, connectivity) = (None, None)
+
+        self.pool = multiprocessing.Pool(workers, initializer=initialize_worker,
+                                         initargs=(coordinates, connectivity, free_dofs, solver, model_file))
+
+    def errors(self, material, section, forces, measurements, factor_sets):
+        """
+        Errors of single-element trials
+
+        :param material: [E] array of Young's moduli of the base structure
+        :param section: [E] array of cross-sectional areas of the base structure
+        :param forces: global load vector
+        :param measurements: [[DOF ID, displacement], ...]
+        :param factor_sets: list of [E] arrays of stiffness multipliers, one trial per element in each
+        :return: list of [E] arrays of errors, one for each factor vector
+        """
+        chunks = numpy.array_split(numpy.arange(self.element_number), self.workers)
+        tasks = [(chunk, material, section, forces, measurements, factor_sets) for chunk in chunks if len(chunk)]
+        results = self.pool.map(evaluate_chunk, tasks)
+
+        return [numpy.concatenate([result[i] for result in results]) for i in range(len(factor_sets))]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Updated parameters of the model updating: Young's modulus, cross-sectional area or both, with bounds.
+"""
+
+import numpy
+
+
+class Parameterization(object):
+    def __init__(self, parameters='E', material_bounds=(0.0, numpy.inf), section_bounds=(0.0, numpy.inf)):
+        """
+        Updated parameters of the elements and their bounds
+
+        The stiffness of an element is E * A / L, so scaling E or A by the same factor has the same effect.
+        The updating methods work with stiffness factors, one rank-one trial per element, and the factors are
+        realized here on the Young's modulus, the cross-sectional area or both.
+
+        :param parameters: 'E' (Young's moduli), 'A' (cross-sectional areas) or 'EA' (axial stiffness: the square
+                           root of the factor goes to both, the share blocked by the bounds of one goes to the other)
+        :param material_bounds: (lower, upper) bounds of the Young's moduli relative to the original ones
+        :param section_bounds: (lower, upper) bounds of the cross-sectional areas relative to the original ones
+        """
+        if parameters not in ['E', 'A', 'EA']:
+            raise ValueError('parameters should be \'E\', \'A\' or \'EA\' but got: %s' % str(parameters))
+
+        for bounds in [material_bounds, section_bounds]:
+            if len(bounds) != 2 or not 0 <= bounds[0] <= 1 <= bounds[1]:
+                raise ValueError('bounds should be (lower <= 1, upper >= 1) but got: %s' % str(bounds))
+
+        self.parameters = parameters
+        self.material_bounds = (float(material_bounds[0]), float(material_bounds[1]))
+        self.section_bounds = (float(section_bounds[0]), float(section_bounds[1]))
+
+    def split(self, original, structure, factors, elements=None):
+        """
+        Realizes stiffness factors within the bounds
+
+        :param original: Structure object, the bounds are relative to its parameters
+        :param structure: Structure object to be changed
+        :param factors: [E] or [K x E] array of stiffness multipliers, one per element
+                        (or one per listed element)
+        :param elements: element IDs of the factors, all elements by default
+        :return: (material factors, section factors) with the shape of the factors
+        """
+        if elements is None:
+            elements = slice(None)
+
+        factors = numpy.asarray(factors, dtype=float)
+
+        def scale(name, bounds, requested):
+            current = getattr(structure, name)[elements]
+            reference = getattr(original, name)[elements]
+
+            return numpy.clip(current * requested, bounds[0] * reference, bounds[1] * reference) / current
+
+        if self.parameters == 'E':
+            return scale('material', self.material_bounds, factors), numpy.ones_like(factors)
+
+        if self.parameters == 'A':
+            return numpy.ones_like(factors), scale('section', self.section_bounds, factors)
+
+        material = scale('material', self.material_bounds, numpy.sqrt(factors))
+        section = scale('section', self.section_bounds, factors / material)
+        # The Young's modulus takes the share blocked by the bounds of the cross-sectional area
+        material = scale('material', self.material_bounds, factors / section)
+
+        return material, section
+
+    def stiffness_factors(self, original, structure, factors, elements=None):
+        """
+        :param original: see split()
+        :param structure: see split()
+        :param factors: requested stiffness multipliers, see split()
+        :param elements: see split()
+        :return: stiffness multipliers allowed by the bounds, with the shape of the factors
+        """
+        (material, section) = self.split(original, structure, factors, elements)
+
+        return material * section
+
+    def apply(self, original, structure, factors, elements=None):
+        """
+        Scales the stiffness of elements of a structure within the bounds
+
+        :param original: see split()
+        :param structure: Structure object, changed in place
+        :param factors: [E] array of stiffness multipliers (or one per listed element)
+        :param elements: see split()
+        :return: [E] array of the applied stiffness multipliers
+        """
+        if elements is None:
+            elements = slice(None)
+
+        (material, section) = self.split(original, structure, factors, elements)
+
+        # Clipped again, the rounding of the factors would step over the bounds
+        for (name, parameter, bounds, factor) in [('material', 'E', self.material_bounds, material),
+                                                  ('section', 'A', self.section_bounds, section)]:
+            if parameter in self.parameters:
+                reference = getattr(original, name)[elements]
+                value = numpy.clip(getattr(structure, name)[elements] * factor, bounds[0] * reference,
+                                   bounds[1] * reference)
+                getattr(structure, 'set_' + name)(elements, value)
+
+        return material * section
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded queues joining the threads of the pipelined model updating.
+"""
+
+from collections import deque
+import threading
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class BoundedQueue(object):
+    def __init__(self, size, policy='block'):
+        """
+        Thread-safe bounded FIFO queue between pipeline stages
+
+        :param size: maximum number of waiting items
+        :param policy: backpressure when the queue is full:
+            - 'block': the producer waits for free space
+            - 'drop-oldest': the oldest waiting item is discarded
+        """
+        if policy not in ['block', 'drop-oldest']:
+            raise ValueError('policy should be \'block\' or \'drop-oldest\' but got: %s' % str(policy))
+
+        if size < 1:
+            raise ValueError('size should be at least 1 but got: %s' % str(size))
+
+        self.size = size
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+
+        self._items = deque()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        :param item: anything
+        :return: None
+        """
+        with self._condition:
+            if self.policy == 'block':
+                while len(self._items) >= self.size and not self.closed:
+                    self._condition.wait()
+            elif len(self._items) >= self.size:
+                self._items.popleft()
+                self.dropped += 1
+
+            if self.closed:
+                raise QueueClosed()
+
+            self._items.append(item)
+            self._condition.notify_all()
+
+    def get(self):
+        """
+        Waits for the next item. The items put before closing are still returned.
+
+        :return: the oldest waiting item
+        """
+        with self._condition:
+            while not self._items and not self.closed:
+                self._condition.wait()
+
+            if not self._items:
+                raise QueueClosed()
+
+            item = self._items.popleft()
+            self._condition.notify_all()
+
+            return item
+
+    def close(self):
+        """
+        Wakes up every waiting producer and consumer, later puts raise QueueClosed
+
+        :return: None
+        """
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class Pipeline(object):
+    def __init__(self, queues):
+        """
+        Stages running in separate threads, joined by bounded queues
+
+        :param queues: list of BoundedQueue objects between the stages, closed when the pipeline stops
+        """
+        self.queues = queues
+        self.stop_event = threading.Event()
+        self.errors = []
+        self._threads = []
+
+    def add_stage(self, name, target):
+        """
+        :param name: thread name
+        :param target: callable receiving the stop event, returns when the stage is finished
+        :return: None
+        """
+        def run():
+            try:
+                target(self.stop_event)
+            except QueueClosed:
+                pass
+            except BaseException as exception:
+                self.errors.append(exception)
+                self.stop()
+
+        self._threads.append(threading.Thread(target=run, name=name, daemon=True))
+
+    def stop(self):
+        """
+        Asks every stage to finish
+
+        :return: None
+        """
+        self.stop_event.set()
+        for queue in self.queues:
+            queue.close()
+
+    def run(self):
+        """
+        Runs the stages until all of them are finished, errors of the stages are raised here
+
+        :return: None
+        """
+        for thread in self._threads:
+            thread.start()
+
+        try:
+            for thread in self._threads:
+                while thread.is_alive():
+                    thread.join(0.1)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+
+        if self.errors:
+            raise self.errors[0]
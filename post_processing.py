@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized member strains, forces, stresses and utilizations.
+"""
+
+import numpy
+
+
+def elongations(original, deformed):
+    """
+    Length changes of the elements
+
+    The change is computed from the displacements as (L'^2 - L^2) / (L' + L), which keeps its precision
+    for displacements much smaller than the element lengths.
+
+    :param original: Structure object
+    :param deformed: deformed Structure object with the same elements
+    :return: (lengths [E], elongations [E])
+    """
+    connectivity = original.connectivity
+    delta = original.coordinates[connectivity[:, 1]] - original.coordinates[connectivity[:, 0]]
+    displacement = deformed.coordinates - original.coordinates
+    relative = displacement[connectivity[:, 1]] - displacement[connectivity[:, 0]]
+
+    lengths = numpy.sqrt((delta ** 2).sum(axis=1))
+    deformed_lengths = numpy.sqrt(((delta + relative) ** 2).sum(axis=1))
+
+    return lengths, (2 * (delta * relative).sum(axis=1) + (relative ** 2).sum(axis=1)) / (deformed_lengths + lengths)
+
+
+def element_results(original, deformed, allowable_stress=None):
+    """
+    Internal forces of a solved structure
+
+    :param original: Structure object, its materials and sections are used
+    :param deformed: deformed Structure object with the same elements, see Truss.solve()
+    :param allowable_stress: scalar or [E] array of allowable stresses, None to compare to the largest stress
+    :return: {'strain': [E], 'force': [E], 'stress': [E], 'utilization': [E]}, tension is positive
+    """
+    (lengths, elongation) = elongations(original, deformed)
+
+    strain = elongation / lengths
+    stress = strain * original.material
+    force = stress * original.section
+
+    if allowable_stress is None:
+        largest = numpy.abs(stress).max() if len(stress) else 0.0
+        utilization = numpy.abs(stress) / largest if largest > 0 else numpy.zeros(len(stress))
+    else:
+        utilization = numpy.abs(stress) / allowable_stress
+
+    return {'strain': strain, 'force': force, 'stress': stress, 'utilization': utilization}
+
+
+def relative_ratios(values):
+    """
+    Values scaled into [-1, 1]: positive ones by the largest, negative ones by the smallest value.
+    Without positive values every ratio is 0.
+
+    :param values: [E] array
+    :return: [E] array
+    """
+    values = numpy.asarray(values, dtype=float)
+    ratio = numpy.zeros(len(values))
+
+    if len(values) and values.max() > 0:
+        positive = values > 0
+        ratio[positive] = values[positive] / values.max()
+        if values.min() < 0:
+            ratio[~positive] = -values[~positive] / values.min()
+
+    return ratio
@@ -6,10 +6,93 @@ Truss framework created by Máté Szedlák.
 Copyright MIT, Máté Szedlák 2016-2018.
 """
 
+import ast
+import hashlib
 import itertools
+import operator
+import os
+import sys
 
+import numpy
 
-def read_structure_file(input_file):
+from model_file import open_model_file
+
+# Version of the compiled structure files, older ones are parsed again
+_cache_version = 1
+
+_binary_operators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+                     ast.Div: operator.truediv, ast.Pow: operator.pow}
+
+_unary_operators = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+# Numbers are parsed as ast.Num before Python 3.8
+(_number_node, _number_field) = (ast.Num, 'n') if sys.version_info < (3, 8) else (ast.Constant, 'value')
+
+
+def evaluate_expression(expression):
+    """
+    Safe evaluation of an arithmetic expression like '5.0*(10**(-4))'
+    Only numbers, parentheses and the +, -, *, /, ** operators are accepted.
+
+    :param expression: str
+    :return: float
+    """
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+
+        if isinstance(node, _number_node) and type(getattr(node, _number_field)) in [int, float]:
+            return float(getattr(node, _number_field))
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _binary_operators:
+            return _binary_operators[type(node.op)](evaluate(node.left), evaluate(node.right))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _unary_operators:
+            return _unary_operators[type(node.op)](evaluate(node.operand))
+
+        raise ValueError('Not an arithmetic expression: %s' % expression)
+
+    try:
+        # Float arithmetic: huge powers overflow instead of building huge integers
+        return float(evaluate(ast.parse(expression.strip(), mode='eval')))
+    except (SyntaxError, ZeroDivisionError, OverflowError) as exception:
+        raise ValueError('Invalid expression: %s (%s)' % (expression, str(exception)))
+
+
+def parse_values(source_line):
+    """
+    :param source_line: values separated by ',', ';' or '|', like '36, 5.0*(10**(-4))'
+    :return: [float, ...]
+    """
+    values = []
+    for token in source_line.replace(',', '|').replace(';', '|').split('|'):
+        token = token.strip()
+        if token:
+            try:
+                values.append(float(token))
+            except ValueError:
+                values.append(evaluate_expression(token))
+
+    return values
+
+
+def parse_table(source_line, dtype):
+    """
+    :param source_line: rows separated by '|', values separated by ',' or ';', like '0, 0.0|1, 0.0|'
+    :param dtype: int or float
+    :return: [rows x columns] array, the number of columns is set by the first row
+    """
+    rows = [x for x in source_line.split('|') if x.strip()]
+    if not rows:
+        return numpy.zeros((0, 2), dtype=dtype)
+
+    columns = len([x for x in rows[0].replace(';', ',').split(',') if x.strip()])
+    values = [x for x in source_line.replace('|', ',').replace(';', ',').split(',') if x.strip()]
+
+    return numpy.array(values, dtype=dtype).reshape(-1, columns)
+
+
+def parse_structure_text(text):
     """
       Input file parser
       All commands must be written with uppercase characters
@@ -17,121 +100,153 @@ def read_structure_file(input_file):
       Only lines with the command and nothing more counts.
       Everything else will be neglected. Even hashtags are useless :)
       The order of the commands are indifferent.
-    
+
       Commands and their format (example):
           ELEMENTS - Elements given by end-nodes: 0, 1 | 0, 2 ...
           COORDINATES - Nodal coordinates: 0, 0, 0, | 0, 3., 0. ...
-          CROSS-SECTIONS - This data will be evaluated in Python: 3.0*(10**(-4)), 5.0*(10**(-4)) ...
-          MATERIALS - This data will be evaluated in Python: 70.0*(10**9), 100.0*(10**9) ...
+          CROSS-SECTIONS - Arithmetic expressions: 3.0*(10**(-4)), 5.0*(10**(-4)) ...
+          MATERIALS - Arithmetic expressions: 70.0*(10**9), 100.0*(10**9) ...
           SUPPORTS - Selected dof + Prescribed displacements: 0, 0.0 | 1, 0.0 ...
-    
+
           EOF - For compatibility reasons EOF should be placed after the commands
-      """
-    _read_element_names = ["Elements", "Coordinates",
-                           "Cross-sections", "Materials", "Supports"]
 
-    read_elements = {'elements': False, 'coordinates': False, 'cross-sections': False, 'materials': False,
-                     'supports': False}
+    :param text: content of a structure file
+    :return: {'coordinates': [N x 3], 'connectivity': [E x 2], 'material': [E], 'section': [E], 'supports': [S x 2]}
+    """
+    commands = ['ELEMENTS', 'COORDINATES', 'CROSS-SECTIONS', 'MATERIALS', 'SUPPORTS']
+    data = {}
+
+    lines = iter(text.splitlines())
+    for source_line in lines:
+        command = source_line.strip().upper()
+        if command == 'EOF':
+            break
+
+        if command in commands:
+            data[command] = next(lines, '').strip()
+
+    missing = [x.lower() for x in commands if x not in data]
+    if missing:
+        raise Exception('The following was not found: ' + ' '.join(missing) + ' ')
+
+    connectivity = parse_table(data['ELEMENTS'], int)
+    coordinates = parse_table(data['COORDINATES'], float)
+    supports = parse_table(data['SUPPORTS'], float)
+
+    element_number = len(connectivity)
+    section = parse_values(data['CROSS-SECTIONS'])
+    material = parse_values(data['MATERIALS'])
+    if len(section) < element_number or len(material) < element_number:
+        raise ValueError('Material and cross-section data should be given for all %i elements' % element_number)
+
+    if coordinates.shape[1] == 2:
+        # Planar structure: 2 DOFs per node in the file, the Z displacements are supported
+        dofs = supports[:, 0].astype(int)
+        supports = numpy.column_stack(((dofs // 2) * 3 + dofs % 2, supports[:, 1]))
+        supports = numpy.vstack((supports, numpy.column_stack((numpy.arange(len(coordinates)) * 3 + 2,
+                                                               numpy.zeros(len(coordinates))))))
+        coordinates = numpy.column_stack((coordinates, numpy.zeros(len(coordinates))))
+
+    # Sorted supports without duplicates
+    supports = numpy.array([k for k, _ in itertools.groupby(sorted(supports.tolist()))]).reshape(-1, 2)
+
+    return {'coordinates': coordinates, 'connectivity': connectivity,
+            'material': numpy.array(material[:element_number]), 'section': numpy.array(section[:element_number]),
+            'supports': supports}
+
+
+def cache_file(path, digest):
+    """
+    :param path: structure file
+    :param digest: hash of the content of the structure file
+    :return: path of the compiled structure
+    """
+    return os.path.join(os.path.dirname(path), '.cache', '%s.%s.npz' % (os.path.basename(path), digest))
+
+
+def write_cache(path, digest, arrays):
+    """
+    Stores the parsed arrays, replacing the compiled versions of older contents. Failures are ignored.
+
+    :param path: structure file
+    :param digest: hash of the content of the structure file
+    :param arrays: result of parse_structure_text()
+    :return: None
+    """
+    target = cache_file(path, digest)
+    directory = os.path.dirname(target)
 
     try:
-        with open("./structures/%s" % input_file, "r") as sourcefile:
-            source_line = ""
-            structure = {}
-            dof = 3
-
-            while source_line != "EOF":
-                source_line = sourcefile.readline().strip()
-
-                if source_line.upper() == "ELEMENTS":
-                    source_line = sourcefile.readline().strip()
-                    input_string = [x.split(',') for x in source_line.split('|')]
-                    if len(input_string[0]) == 1:
-                        input_string = [x.split(';') for x in source_line.split('|')]
-                    if [''] in input_string:
-                        input_string.remove([''])
-                    input_number = [[[int(x[0]), int(x[1])], None, None]
-                                    for x in input_string]
-
-                    structure['elements'] = input_number
-                    read_elements['elements'] = True
-
-                if source_line.upper() == "COORDINATES":
-                    source_line = sourcefile.readline().strip()
-                    input_number = []
-                    input_string = [x.split(',') for x in source_line.split('|')]
-                    if len(input_string[0]) == 1:
-                        input_string = [x.split(';') for x in source_line.split('|')]
-                    if [''] in input_string:
-                        input_string.remove([''])
-                    if len(input_string[0]) == 3:
-                        input_number = [[float(x[0]), float(x[1]), float(x[2])] for x in input_string]
-                    elif len(input_string[0]) == 2:
-                        dof = 2
-                        input_number = [[float(x[0]), float(x[1]), 0.0] for x in input_string]
-
-                    structure['coordinates'] = input_number
-                    read_elements['coordinates'] = True
-
-                if source_line.upper() == "CROSS-SECTIONS":
-                    source_line = sourcefile.readline().strip()
-                    input_string = source_line.replace(',', '|').replace(';', '|').split('|')
-                    if '' in input_string:
-                        input_string.remove('')
-                    input_number = [float(eval(x)) for x in input_string]
-
-                    for index in range(len(structure['elements'])):
-                        structure['elements'][index][2] = input_number[index]
-
-                    read_elements['cross-sections'] = True
-
-                if source_line.upper() == "MATERIALS":
-                    source_line = sourcefile.readline().strip()
-                    input_string = source_line.replace(',', '|').replace(';', '|').split('|')
-                    if '' in input_string:
-                        input_string.remove('')
-
-                    input_number = [float(eval(x)) for x in input_string]
-
-                    for index in range(len(structure['elements'])):
-                        structure['elements'][index][1] = input_number[index]
-
-                    read_elements['materials'] = True
-
-                if source_line.upper() == "SUPPORTS":
-                    source_line = sourcefile.readline().strip()
-                    input_string = [x.split(',') for x in source_line.split('|')]
-                    if len(input_string[0]) == 1:
-                        input_string = [x.split(';') for x in source_line.split('|')]
-                    if [''] in input_string:
-                        input_string.remove([''])
-
-                    if dof == 3:
-                        input_number = [[int(x[0]), float(x[1])] for x in input_string]
-                    else:
-                        input_number = [[(int(x[0]) // 2) * 3 + int(x[0]) % 2, float(x[1])] for x in input_string]
-                        extra_supports = [[int(x * 3 + 2), 0.0] for x in range(len(structure['coordinates']))]
-                        input_number.extend(extra_supports)
-
-                    structure['supports'] = list(k for k, _ in itertools.groupby(sorted(input_number)))
-                    read_elements['supports'] = True
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        for name in os.listdir(directory):
+            if name.startswith(os.path.basename(path) + '.') and name.endswith('.npz'):
+                os.remove(os.path.join(directory, name))
 
+        # Written under a temporary name, so a concurrent start never reads a partial file
+        temporary = target + '.%i.tmp' % os.getpid()
+        with open(temporary, 'wb') as output:
+            numpy.savez(output, version=_cache_version, **arrays)
+        os.replace(temporary, target)
+    except OSError:
+        pass
+
+
+def load_structure(input_file, cache=True):
+    """
+    Reads a structure file of ./structures as arrays. The parsed arrays are compiled into
+    ./structures/.cache, keyed by the hash of the file content, so later starts skip the parsing.
+    Binary structure files (*.trb) are memory-mapped, see model_file.
+
+    :param input_file: file name in ./structures
+    :param cache: use and write the compiled structure
+    :return: {'coordinates': [N x 3], 'connectivity': [E x 2], 'material': [E], 'section': [E], 'supports': [S x 2]}
+    """
+    path = "./structures/%s" % input_file
+
+    if input_file.endswith('.trb'):
+        return open_model_file(path)
+
+    try:
+        with open(path, "rb") as sourcefile:
+            content = sourcefile.read()
     except IOError:
         print("The following file could not be opened: " + "./structures/" + input_file)
         print("Please make sure that the structural data is available for the program in the run directory.")
         raise IOError
 
-    terminate = False
-    error_message_template = 'The following was not found: '
-    for element in read_elements:
-        if read_elements[element] is False:
-            error_message_template += element + ' '
-            terminate = True
+    digest = hashlib.sha1(content).hexdigest()
 
-    if terminate:
-        raise Exception(error_message_template)
+    if cache and os.path.exists(cache_file(path, digest)):
+        try:
+            with numpy.load(cache_file(path, digest), allow_pickle=False) as compiled:
+                if int(compiled['version']) == _cache_version:
+                    return {x: compiled[x] for x in ['coordinates', 'connectivity', 'material', 'section', 'supports']}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    arrays = parse_structure_text(content.decode())
+
+    if cache:
+        write_cache(path, digest, arrays)
+
+    return arrays
+
+
+def read_structure_file(input_file, cache=True):
+    """
+    Input file parser, see parse_structure_text() for the format
+
+    :param input_file: file name in ./structures
+    :param cache: use and write the compiled structure, see load_structure()
+    :return: node_list, element_list, boundaries
+    """
+    arrays = load_structure(input_file, cache)
 
-    node_list = structure['coordinates']
-    element_list = structure['elements']
-    boundaries = structure['supports']
+    node_list = arrays['coordinates'].tolist()
+    element_list = [[connection, material, section] for (connection, material, section)
+                    in zip(arrays['connectivity'].tolist(), arrays['material'].tolist(), arrays['section'].tolist())]
+    boundaries = [[int(dof), displacement] for (dof, displacement) in arrays['supports'].tolist()]
 
     return node_list, element_list, boundaries
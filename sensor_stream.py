@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous ingestion of displacement samples from a byte stream (serial device, pipe or socket).
+
+Every line of the stream is one frame: a timestamp followed by one value per channel, separated by spaces:
+    1539782400.125 -0.412 0.031 -1.270
+Incomplete or malformed lines are dropped, so a snapshot always holds the values of one complete frame.
+"""
+
+import asyncio
+import os
+import stat
+import threading
+
+
+class Snapshot(object):
+    __slots__ = ['sequence', 'timestamp', 'values']
+
+    def __init__(self, sequence, timestamp, values):
+        """
+        One consistent frame of sensor values
+
+        :param sequence: number of frames received before this one
+        :param timestamp: timestamp sent by the sensor
+        :param values: tuple of channel values
+        """
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.values = values
+
+
+def parse_frame(line, channels):
+    """
+    :param line: bytes of one line without the line ending
+    :param channels: expected number of channel values
+    :return: (timestamp, values) or None if the line is not a complete frame
+    """
+    fields = line.split()
+    if len(fields) != channels + 1:
+        return None
+
+    try:
+        numbers = [float(x) for x in fields]
+    except ValueError:
+        return None
+
+    return numbers[0], tuple(numbers[1:])
+
+
+async def open_source(source):
+    """
+    Opens a byte stream for reading
+
+    :param source: 'tcp://host:port', 'unix:///path/to/socket' or the path of a character device or FIFO
+    :return: (asyncio.StreamReader, closing callable)
+    """
+    if source.startswith('tcp://'):
+        (host, port) = source[len('tcp://'):].rsplit(':', 1)
+        (reader, writer) = await asyncio.open_connection(host, int(port))
+        return reader, writer.close
+
+    if source.startswith('unix://'):
+        (reader, writer) = await asyncio.open_unix_connection(source[len('unix://'):])
+        return reader, writer.close
+
+    # A FIFO is opened for writing too, so it does not report end of file while no writer is connected
+    if stat.S_ISFIFO(os.stat(source).st_mode):
+        flags = os.O_RDWR
+    else:
+        flags = os.O_RDONLY
+
+    # The running loop, get_running_loop() needs Python 3.7
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    pipe = open(os.open(source, flags | os.O_NONBLOCK), 'rb', buffering=0)
+    (transport, _) = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+
+    return reader, transport.close
+
+
+async def read_frames(reader, channels, consume):
+    """
+    Reads frames until the end of the stream
+
+    :param reader: asyncio.StreamReader
+    :param channels: number of channel values in a frame
+    :param consume: callable receiving (timestamp, values) of every complete frame,
+                    or None for every dropped line
+    :return: None
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+
+        if not line.endswith(b'\n'):
+            # Partial last line of a closed stream
+            consume(None)
+            return
+
+        consume(parse_frame(line, channels))
+
+
+class SensorStream(object):
+    def __init__(self, channels, source):
+        """
+        Background reader keeping the latest complete frame of a sensor stream
+
+        The stream is read by an asyncio event loop in a daemon thread, so the solver never waits for the
+        sensors: snapshot() returns the newest frame immediately.
+
+        :param channels: number of measured values in a frame
+        :param source: see open_source()
+        """
+        self.channels = channels
+        self.source = source
+
+        self.frames = 0
+        self.dropped = 0
+        self.error = None
+
+        self._snapshot = None
+        self._first_frame = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._task = None
+
+    def consume(self, frame):
+        """
+        Stores a parsed frame as the latest snapshot
+
+        :param frame: (timestamp, values) or None for a dropped line
+        :return: None
+        """
+        if frame is None:
+            self.dropped += 1
+            return
+
+        # Replacing the reference is atomic: readers see either the previous or the new frame
+        self._snapshot = Snapshot(self.frames, frame[0], frame[1])
+        self.frames += 1
+        self._first_frame.set()
+
+    async def run(self):
+        """
+        Reads the source until it is closed or the task is cancelled
+
+        :return: None
+        """
+        (reader, close) = await open_source(self.source)
+        try:
+            await read_frames(reader, self.channels, self.consume)
+        finally:
+            close()
+
+    def start(self):
+        """
+        Starts reading in a daemon thread
+
+        :return: self
+        """
+        started = threading.Event()
+
+        def target():
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(self.run())
+            started.set()
+            try:
+                self._loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+            except Exception as exception:
+                self.error = exception
+            finally:
+                self._loop.close()
+                # Wake up waiting readers
+                self._first_frame.set()
+
+        self._thread = threading.Thread(target=target, name='sensor-stream', daemon=True)
+        self._thread.start()
+        started.wait()
+
+        return self
+
+    def stop(self, timeout=1.0):
+        """
+        Stops reading
+
+        :param timeout: seconds to wait for the reader thread
+        :return: None
+        """
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                # The loop has already been closed
+                pass
+            self._thread.join(timeout)
+
+    def snapshot(self):
+        """
+        :return: latest Snapshot or None before the first frame
+        """
+        return self._snapshot
+
+    def wait_snapshot(self, timeout=10.0):
+        """
+        Latest snapshot, waits for the first frame if necessary
+
+        :param timeout: seconds to wait for the first frame
+        :return: Snapshot
+        """
+        if not self._first_frame.wait(timeout):
+            raise IOError('No sensor data received from %s' % self.source)
+
+        if self._snapshot is None:
+            raise IOError('Sensor stream %s closed before the first frame: %s' % (self.source, self.error))
+
+        return self._snapshot
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Dense and sparse linear solvers with a cache of the factorized stiffness matrices.
+"""
+
+from collections import OrderedDict
+import hashlib
+import numpy
+from scipy import linalg, sparse
+from scipy.sparse import linalg as sparse_linalg
+
+
+class DenseFactorization(object):
+    def __init__(self, matrix):
+        """
+        Cholesky factorization of a dense stiffness matrix with LU fallback
+
+        :param matrix: square numpy array
+        """
+        self.size = len(matrix)
+        try:
+            self.factor = linalg.cho_factor(matrix)
+            self.method = 'cholesky'
+        except linalg.LinAlgError:
+            self.factor = linalg.lu_factor(matrix, check_finite=False)
+            self.method = 'lu'
+            if not numpy.all(numpy.diag(self.factor[0])):
+                raise numpy.linalg.LinAlgError('Singular matrix')
+
+    def solve(self, rhs):
+        """
+        :param rhs: right hand side vector (or matrix of vectors)
+        :return: solution array
+        """
+        if self.method == 'cholesky':
+            return linalg.cho_solve(self.factor, rhs)
+        else:
+            return linalg.lu_solve(self.factor, rhs)
+
+
+class SparseFactorization(object):
+    def __init__(self, matrix):
+        """
+        Sparse LU (SuperLU) factorization of a stiffness matrix
+
+        :param matrix: square scipy.sparse matrix
+        """
+        self.size = matrix.shape[0]
+        self.factor = sparse_linalg.splu(sparse.csc_matrix(matrix))
+        self.method = 'splu'
+
+    def solve(self, rhs):
+        """
+        :param rhs: right hand side vector (or matrix of vectors)
+        :return: solution array
+        """
+        return self.factor.solve(numpy.asarray(rhs, dtype=float))
+
+
+def factorize(matrix):
+    """
+    Factorizes a dense or sparse stiffness matrix
+
+    :param matrix: square numpy array or scipy.sparse matrix
+    :return: DenseFactorization or SparseFactorization
+    """
+    if sparse.issparse(matrix):
+        return SparseFactorization(matrix)
+    else:
+        return DenseFactorization(matrix)
+
+
+def factorization_key(arrays, free_dofs):
+    """
+    Fingerprint of a structure version: it changes whenever the geometry, the parameters or the boundaries change
+
+    :param arrays: arrays describing the structure, e.g. (coordinates, connectivity, material, section)
+    :param free_dofs: list of unconstrained DOF IDs
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(numpy.ascontiguousarray(array).tobytes())
+        digest.update(b'|')
+    digest.update(numpy.asarray(free_dofs, dtype=numpy.int64).tobytes())
+
+    return digest.hexdigest()
+
+
+class FactorizationCache(object):
+    def __init__(self, size=8):
+        """
+        Least recently used store of factorized reduced stiffness matrices
+
+        :param size: maximum number of kept factorizations
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._store = OrderedDict()
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def get(self, key, build):
+        """
+        Returns the cached factorization or builds and stores a new one
+
+        :param key: structure fingerprint, see factorization_key()
+        :param build: callable returning a new factorization on cache miss
+        :return: factorization object
+        """
+        if key in self._store:
+            self.hits += 1
+            self._store.move_to_end(key)
+            return self._store[key]
+
+        self.misses += 1
+        factorization = build()
+        self._store[key] = factorization
+        while len(self._store) > self.size:
+            self._store.popitem(last=False)
+
+        return factorization
+
+    def clear(self):
+        self._store.clear()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Array based assembly and incremental updates of the stiffness matrix.
+"""
+
+import numpy
+from scipy import sparse
+
+
+def structure_arrays(structure):
+    """
+    Extracts the array representation of a structure
+
+    :param structure: Structure object
+    :return: (coordinates [N x 3], connectivity [E x 2], material [E], section [E])
+    """
+    return structure.coordinates, structure.connectivity, structure.material, structure.section
+
+
+def element_dofs(connectivity):
+    """
+    Global DOF IDs of the element end-nodes
+
+    :param connectivity: [E x 2] array of end-node IDs
+    :return: [E x 6] array: [3*i, 3*i+1, 3*i+2, 3*j, 3*j+1, 3*j+2] for each element
+    """
+    connectivity = numpy.asarray(connectivity, dtype=int)
+    return (connectivity[:, :, None] * 3 + numpy.arange(3)).reshape(-1, 6)
+
+
+def element_geometry(coordinates, connectivity):
+    """
+    Lengths and direction cosines of every element
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :return: (lengths [E], direction cosines [E x 3])
+    """
+    coordinates = numpy.asarray(coordinates, dtype=float)
+    connectivity = numpy.asarray(connectivity, dtype=int)
+
+    delta = coordinates[connectivity[:, 1]] - coordinates[connectivity[:, 0]]
+    lengths = numpy.sqrt((delta ** 2).sum(axis=1))
+
+    return lengths, delta / lengths[:, None]
+
+
+def unit_stiffness_matrices(coordinates, connectivity):
+    """
+    Local stiffness blocks of the elements with unit E*A/L, in global orientation
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :return: (lengths [E], blocks [E x 6 x 6])
+    """
+    lengths, cosines = element_geometry(coordinates, connectivity)
+
+    outer = cosines[:, :, None] * cosines[:, None, :]
+    blocks = numpy.empty((len(lengths), 6, 6))
+    blocks[:, :3, :3] = outer
+    blocks[:, :3, 3:] = -outer
+    blocks[:, 3:, :3] = -outer
+    blocks[:, 3:, 3:] = outer
+
+    return lengths, blocks
+
+
+def local_stiffness_matrices(coordinates, connectivity, material, section):
+    """
+    Local stiffness matrices of all elements in global orientation
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :param material: [E] array of Young's moduli
+    :param section: [E] array of cross-sectional areas
+    :return: [E x 6 x 6] array
+    """
+    lengths, blocks = unit_stiffness_matrices(coordinates, connectivity)
+    norm_stiff = numpy.asarray(material, dtype=float) / lengths
+
+    return blocks * numpy.asarray(section, dtype=float)[:, None, None] * norm_stiff[:, None, None]
+
+
+def assemble_stiffness_matrix(coordinates, connectivity, material, section):
+    """
+    Dense global stiffness matrix assembled in one vectorized pass
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :param material: [E] array of Young's moduli
+    :param section: [E] array of cross-sectional areas
+    :return: [3N x 3N] numpy array
+    """
+    dof_number = len(coordinates) * 3
+    dofs = element_dofs(connectivity)
+    blocks = local_stiffness_matrices(coordinates, connectivity, material, section)
+
+    # Scatter-add of the 6x6 blocks, summed in element order
+    flat_index = (dofs[:, :, None] * dof_number + dofs[:, None, :]).ravel()
+    stiffness_matrix = numpy.bincount(flat_index, weights=blocks.ravel(), minlength=dof_number ** 2)
+
+    return stiffness_matrix.reshape(dof_number, dof_number)
+
+
+def assemble_sparse_stiffness_matrix(coordinates, connectivity, material, section):
+    """
+    Sparse global stiffness matrix: the element blocks are collected as COO triplets and summed into CSR
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :param material: [E] array of Young's moduli
+    :param section: [E] array of cross-sectional areas
+    :return: [3N x 3N] scipy.sparse.csr_matrix
+    """
+    dof_number = len(coordinates) * 3
+    dofs = element_dofs(connectivity)
+    blocks = local_stiffness_matrices(coordinates, connectivity, material, section)
+
+    rows = numpy.repeat(dofs, 6, axis=1).ravel()
+    cols = numpy.tile(dofs, (1, 6)).ravel()
+
+    return sparse.coo_matrix((blocks.ravel(), (rows, cols)), shape=(dof_number, dof_number)).tocsr()
+
+
+def reduce_matrix(stiffness_matrix, index):
+    """
+    Selects the rows and columns of the given DOFs
+
+    :param stiffness_matrix: dense array or sparse matrix
+    :param index: list of kept DOF IDs
+    :return: reduced matrix of the same kind
+    """
+    if sparse.issparse(stiffness_matrix):
+        return stiffness_matrix[index][:, index]
+    else:
+        return stiffness_matrix[numpy.ix_(index, index)]
+
+
+class StiffnessMatrix(object):
+    def __init__(self, coordinates, connectivity, material, section, free_dofs=None, sparse_format=False,
+                 max_updates=1000):
+        """
+        Stiffness matrix which remembers the contribution of each element, so a parameter change
+        only adds the change of one 6x6 block instead of a full assembly
+
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param material: [E] array of Young's moduli
+        :param section: [E] array of cross-sectional areas
+        :param free_dofs: list of unconstrained DOF IDs, the matrix is reduced to them if given
+        :param sparse_format: keep the matrix as scipy.sparse.csr_matrix instead of a dense array
+        :param max_updates: number of block updates after which the matrix is reassembled to drop round-off
+        """
+        self.coordinates = coordinates
+        self.connectivity = connectivity
+        self.free_dofs = free_dofs
+        self.sparse_format = sparse_format
+        self.max_updates = max_updates
+
+        self.lengths, self.blocks = unit_stiffness_matrices(coordinates, connectivity)
+        self.assemble(material, section)
+
+    def assemble(self, material, section):
+        """
+        Full assembly of the matrix and of the positions of the element blocks in its value array
+
+        :param material: [E] array of Young's moduli
+        :param section: [E] array of cross-sectional areas
+        :return: None
+        """
+        self.material = numpy.array(material, dtype=float)
+        self.section = numpy.array(section, dtype=float)
+        self.updates = 0
+
+        arrays = (self.coordinates, self.connectivity, self.material, self.section)
+        if self.sparse_format:
+            matrix = assemble_sparse_stiffness_matrix(*arrays)
+        else:
+            matrix = assemble_stiffness_matrix(*arrays)
+
+        dofs = element_dofs(self.connectivity)
+        dof_number = len(self.coordinates) * 3
+        if self.free_dofs is not None:
+            matrix = reduce_matrix(matrix, self.free_dofs)
+            index = numpy.full(dof_number, -1, dtype=int)
+            index[numpy.asarray(self.free_dofs, dtype=int)] = numpy.arange(len(self.free_dofs))
+            dofs = index[dofs]
+
+        size = matrix.shape[0]
+        rows = numpy.repeat(dofs, 6, axis=1)
+        cols = numpy.tile(dofs, (1, 6))
+        kept = (rows >= 0) & (cols >= 0)
+        keys = rows * size + cols
+
+        if self.sparse_format:
+            matrix = matrix.tocsr()
+            matrix.sort_indices()
+            matrix_keys = numpy.repeat(numpy.arange(size), numpy.diff(matrix.indptr)) * size + matrix.indices
+            positions = numpy.searchsorted(matrix_keys, numpy.where(kept, keys, 0)).clip(max=len(matrix_keys) - 1)
+            if not numpy.all(matrix_keys[positions][kept] == keys[kept]):
+                raise ValueError('element block entries are missing from the sparsity pattern')
+            self.positions = numpy.where(kept, positions, -1)
+        else:
+            self.positions = numpy.where(kept, keys, -1)
+
+        self.matrix = matrix
+
+    def values(self):
+        """
+        :return: writable flat view of the stored matrix entries
+        """
+        if self.sparse_format:
+            return self.matrix.data
+        else:
+            return self.matrix.reshape(-1)
+
+    def add_block(self, index, factor):
+        """
+        Adds factor * (unit block of the element) to the matrix
+
+        :param index: element ID
+        :param factor: change of E*A/L of the element
+        :return: None
+        """
+        positions = self.positions[index]
+        kept = positions >= 0
+        self.values()[positions[kept]] += factor * self.blocks[index].ravel()[kept]
+        self.updates += 1
+
+    def set_material(self, index, value):
+        """
+        :param index: element ID
+        :param value: new Young's modulus of the element
+        :return: None
+        """
+        self.add_block(index, (value - self.material[index]) * self.section[index] / self.lengths[index])
+        self.material[index] = value
+
+    def set_section(self, index, value):
+        """
+        :param index: element ID
+        :param value: new cross-sectional area of the element
+        :return: None
+        """
+        self.add_block(index, self.material[index] * (value - self.section[index]) / self.lengths[index])
+        self.section[index] = value
+
+    def matches(self, coordinates, connectivity, free_dofs=None):
+        """
+        Checks whether the matrix belongs to the given topology and boundaries
+
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param free_dofs: list of unconstrained DOF IDs or None
+        :return: Boolean
+        """
+        def same(first, second):
+            if first is None or second is None:
+                return first is second
+            return first is second or numpy.array_equal(first, second)
+
+        return same(self.coordinates, coordinates) and same(self.connectivity, connectivity) and \
+            same(self.free_dofs, free_dofs)
+
+    def update(self, material, section):
+        """
+        Applies the block changes of every element whose parameters differ
+
+        :param material: [E] array of Young's moduli
+        :param section: [E] array of cross-sectional areas
+        :return: number of changed elements
+        """
+        changed = numpy.nonzero((material != self.material) | (section != self.section))[0]
+
+        if self.updates + len(changed) > self.max_updates or len(changed) > len(self.material) // 2:
+            self.assemble(material, section)
+        else:
+            for index in changed:
+                self.add_block(index, (material[index] * section[index] -
+                                       self.material[index] * self.section[index]) / self.lengths[index])
+            self.material[changed] = material[changed]
+            self.section[changed] = section[changed]
+
+        return len(changed)
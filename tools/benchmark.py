@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark of the truss updater on generated bridges.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy
+
+from generate_structure import generate_structure, structure_file_text
+from read_input_file import load_structure, read_structure_file
+from stiffness import assemble_sparse_stiffness_matrix, assemble_stiffness_matrix, structure_arrays
+from truss_objects import Truss
+
+# Elements generated per bridge section, see generate_structure()
+_elements_per_section = 9
+
+
+def measure(function, repeat):
+    """
+    Best wall-clock time of a function
+
+    :param function: callable without arguments
+    :param repeat: number of runs
+    :return: seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def write_model(sections, title):
+    """
+    Writes a generated bridge and its load into ./structures and ./loads
+
+    :param sections: number of bridge sections
+    :param title: file name without extension
+    :return: (number of nodes, number of elements, measured node ID like '4Z')
+    """
+    (node_list, element_list, supports) = generate_structure(sections)
+
+    with open('./structures/%s.str' % title, 'w') as target:
+        target.write(structure_file_text(node_list, element_list, supports))
+
+    # Vertical load and measurement on the apex of the middle section
+    apex = (sections // 2) * 3 + 2
+    with open('./loads/%s.txt' % title, 'w') as target:
+        target.write('%i %.1f\n' % (apex * 3 + 2, -1000.0))
+
+    return len(node_list), len(element_list), '%iZ' % apex
+
+
+def benchmark_size(elements, solver, repeat, max_guess_elements, max_dense_dofs):
+    """
+    Times every phase on one model size
+
+    :param elements: approximate number of elements
+    :param solver: 'dense' or 'sparse'
+    :param repeat: number of runs of each phase, the best one is reported
+    :param max_guess_elements: larger models skip guess and the full iteration
+    :param max_dense_dofs: larger models skip the dense phases
+    :return: dict of timings in seconds, None for skipped phases
+    """
+    sections = max(1, int(round(elements / float(_elements_per_section))))
+    title = 'benchmark_%i' % sections
+    (node_number, element_number, measured) = write_model(sections, title)
+    dof_number = node_number * 3
+
+    result = {'sections': sections, 'nodes': node_number, 'elements': element_number, 'dofs': dof_number,
+              'solver': solver, 'parse': None, 'load': None, 'assembly': None, 'solve': None, 'guess': None,
+              'iteration': None}
+
+    result['parse'] = measure(lambda: read_structure_file('%s.str' % title, cache=False), repeat)
+
+    # Compiled structure, written by the first call
+    load_structure('%s.str' % title)
+    result['load'] = measure(lambda: load_structure('%s.str' % title), repeat)
+
+    if solver == 'dense' and dof_number > max_dense_dofs:
+        return result
+
+    truss = Truss('%s.str' % title, title, [measured], solver=solver)
+    truss.logger.disabled = True
+    arrays = structure_arrays(truss.original)
+
+    if solver == 'sparse':
+        result['assembly'] = measure(lambda: assemble_sparse_stiffness_matrix(*arrays), repeat)
+    else:
+        result['assembly'] = measure(lambda: assemble_stiffness_matrix(*arrays), repeat)
+
+    truss.measurement.update(truss.loads, title=title)
+
+    def solve():
+        truss.factorizations.clear()
+        truss.stiffness = None
+        truss.solve(truss.original, truss.boundaries, truss.loads)
+
+    result['solve'] = measure(solve, repeat)
+
+    if element_number <= max_guess_elements:
+        truss.solve(truss.updated, truss.boundaries, truss.loads)
+        result['guess'] = measure(truss.guess, repeat)
+
+        counter = {'total': 0, 'loop': 0}
+        result['iteration'] = measure(lambda: truss.iterate(counter), repeat)
+
+    return result
+
+
+def scaling_exponents(results, phases):
+    """
+    Slope of log(time) against log(elements), fitted over the measured sizes
+
+    :param results: list of benchmark_size() results
+    :param phases: names of the timed phases
+    :return: {phase: exponent or None}
+    """
+    exponents = {}
+    for phase in phases:
+        points = [(x['elements'], x[phase]) for x in results if x[phase]]
+        if len(points) < 2:
+            exponents[phase] = None
+        else:
+            exponents[phase] = float(numpy.polyfit([math.log(x[0]) for x in points],
+                                                   [math.log(x[1]) for x in points], 1)[0])
+
+    return exponents
+
+
+def run_benchmark(sizes, solver='sparse', repeat=3, max_guess_elements=10000, max_dense_dofs=6000):
+    """
+    Runs the benchmark in a temporary working directory
+
+    :param sizes: list of approximate element numbers
+    :param solver: 'dense' or 'sparse'
+    :param repeat: number of runs of each phase
+    :param max_guess_elements: larger models skip guess and the full iteration
+    :param max_dense_dofs: larger models skip the dense phases
+    :return: report dict
+    """
+    phases = ['parse', 'load', 'assembly', 'solve', 'guess', 'iteration']
+    working_directory = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='truss_benchmark_')
+
+    try:
+        os.chdir(directory)
+        os.makedirs('structures')
+        os.makedirs('loads')
+        results = [benchmark_size(size, solver, repeat, max_guess_elements, max_dense_dofs) for size in sizes]
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'solver': solver,
+            'repeat': repeat,
+            'results': results,
+            'scaling': scaling_exponents(results, phases)}
+
+
+# Setup console run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--sizes', metavar='int', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help='Approximate element numbers (default: 10 100 1000 10000 100000)')
+    parser.add_argument('--solver', choices=['dense', 'sparse'], default='sparse',
+                        help='Stiffness matrix format and factorization (default: sparse)')
+    parser.add_argument('-r', '--repeat', metavar='int', type=int, default=3,
+                        help='Runs of each phase, the best is reported (default: 3)')
+    parser.add_argument('--max-guess-elements', metavar='int', type=int, default=10000,
+                        help='Larger models skip guess and the full iteration (default: 10000)')
+    parser.add_argument('--max-dense-dofs', metavar='int', type=int, default=6000,
+                        help='Larger models skip the dense phases (default: 6000)')
+    parser.add_argument('-o', '--output', metavar='str', type=str, default='',
+                        help='JSON report file (default: standard output)')
+
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes, args.solver, args.repeat, args.max_guess_elements, args.max_dense_dofs)
+
+    if args.output:
+        with open(args.output, 'w') as target:
+            json.dump(report, target, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -1,59 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of bridge structures of arbitrary size for the benchmarks.
+"""
 
+import argparse
+import os
+import sys
 
-sections = 2
-width = 2000
-height = 2000
-element_length = 3000
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-coordinates = []
-elements = []
-_girder_per_section = 3
-
-
-index = 0
-for i in range(sections):
-    index = i * _girder_per_section
-    coordinates.append([float(i * element_length), 0., 0.])
-    coordinates.append([float(i * element_length), float(width), 0.])
-    coordinates.append([float((i + 0.5) * element_length), float(width / 2), float(height)])
-    elements.append([index + 0, index + 3])
-    elements.append([index + 1, index + 4])
-
-    elements.append([index + 0, index + 1])
-
-    elements.append([index + 0, index + 2])
-    elements.append([index + 1, index + 2])
-    elements.append([index + 2, index + 3])
-    elements.append([index + 2, index + 4])
-
-    if i > 0:
-        elements.append([index - _girder_per_section + 2, index + 2])
+import numpy
 
-index += _girder_per_section
-coordinates.append([float((i + 1) * element_length), 0., 0.])
-coordinates.append([float((i + 1) * element_length), float(width), 0.])
-elements.append([index + 0, index + 1])
+from model_file import write_model_file
 
-coordinate_print = ""
-for coordinate in coordinates:
-    coordinate_print += "%.1f, %.1f, %.1f |" % (coordinate[0], coordinate[1], coordinate[2])
-
-element_print = ""
-for element in elements:
-    element_print += "%i, %i |" % (element[0], element[1])
-
-print("\nELEMENTS")
-print(element_print)
-
-print("\nCOORDINATES")
-print(coordinate_print)
-
-print("\nCROSS-SECTIONS")
-print([36 for i in range(len(elements))])
+_girder_per_section = 3
 
-print("\nMATERIALS")
-print([1800 for i in range(len(elements))])
 
-print("\nSUPPORTS")
+def generate_structure(sections=2, width=2000., height=2000., element_length=3000., material=1800., section=36.):
+    """
+    Generates a 3D truss bridge built from pyramid-shaped sections
+
+    Every section has two bottom nodes, an apex above its middle and a diagonal in its bottom plane.
+    The bridge is supported on the first two and the last two bottom nodes.
+
+    :param sections: number of sections
+    :param width: distance of the bottom chords (Y)
+    :param height: height of the apexes (Z)
+    :param element_length: length of a section (X)
+    :param material: Young's modulus of every element
+    :param section: cross-sectional area of every element
+    :return: (node_list, element_list, supports) in the format of read_input_file.read_structure_file
+    """
+    if sections < 1:
+        raise ValueError('At least one section is needed but got: %s' % str(sections))
+
+    coordinates = []
+    elements = []
+
+    index = 0
+    for i in range(sections):
+        index = i * _girder_per_section
+        coordinates.append([float(i * element_length), 0., 0.])
+        coordinates.append([float(i * element_length), float(width), 0.])
+        coordinates.append([float((i + 0.5) * element_length), float(width / 2), float(height)])
+        elements.append([index + 0, index + 3])
+        elements.append([index + 1, index + 4])
+
+        elements.append([index + 0, index + 1])
+        elements.append([index + 0, index + 4])
+
+        elements.append([index + 0, index + 2])
+        elements.append([index + 1, index + 2])
+        elements.append([index + 2, index + 3])
+        elements.append([index + 2, index + 4])
+
+        if i > 0:
+            elements.append([index - _girder_per_section + 2, index + 2])
+
+    index += _girder_per_section
+    coordinates.append([float(sections * element_length), 0., 0.])
+    coordinates.append([float(sections * element_length), float(width), 0.])
+    elements.append([index + 0, index + 1])
 
-print("\n\nEOF")
+    # Pinned at the start, sliding along X at the end
+    supports = [[0, 0.0], [1, 0.0], [2, 0.0], [3, 0.0], [5, 0.0],
+                [index * 3 + 2, 0.0], [(index + 1) * 3 + 2, 0.0]]
+
+    element_list = [[element, float(material), float(section)] for element in elements]
+
+    return coordinates, element_list, supports
+
+
+def structure_file_text(node_list, element_list, supports):
+    """
+    Formats structural data as a *.str input file
+
+    :param node_list: [[X, Y, Z], ...]
+    :param element_list: [[[i, j], material, section], ...]
+    :param supports: [[DOF ID, displacement], ...]
+    :return: file content
+    """
+    return '\n'.join(['ELEMENTS',
+                      '|'.join(['%i, %i' % (x[0][0], x[0][1]) for x in element_list]),
+                      '',
+                      'COORDINATES',
+                      '|'.join(['%.1f, %.1f, %.1f' % (x[0], x[1], x[2]) for x in node_list]),
+                      '',
+                      'CROSS-SECTIONS',
+                      ', '.join([repr(x[2]) for x in element_list]),
+                      '',
+                      'MATERIALS',
+                      ', '.join([repr(x[1]) for x in element_list]),
+                      '',
+                      'SUPPORTS',
+                      '|'.join(['%i, %s' % (x[0], repr(x[1])) for x in supports]),
+                      '',
+                      'EOF',
+                      ''])
+
+
+def structure_arrays(node_list, element_list, supports):
+    """
+    Structural data in the array format of read_input_file.load_structure, see model_file.write_model_file
+
+    :param node_list: [[X, Y, Z], ...]
+    :param element_list: [[[i, j], material, section], ...]
+    :param supports: [[DOF ID, displacement], ...]
+    :return: {'coordinates', 'connectivity', 'material', 'section', 'supports'}
+    """
+    return {'coordinates': numpy.array(node_list, dtype=float).reshape(-1, 3),
+            'connectivity': numpy.array([x[0] for x in element_list], dtype=int).reshape(-1, 2),
+            'material': numpy.array([x[1] for x in element_list], dtype=float),
+            'section': numpy.array([x[2] for x in element_list], dtype=float),
+            'supports': numpy.array(sorted(supports), dtype=float).reshape(-1, 2)}
+
+
+# Setup console run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--sections', metavar='int', type=int, default=2,
+                        help='Number of sections (default: 2)')
+    parser.add_argument('--width', metavar='float', type=float, default=2000.,
+                        help='Distance of the bottom chords (default: 2000)')
+    parser.add_argument('--height', metavar='float', type=float, default=2000.,
+                        help='Height of the apexes (default: 2000)')
+    parser.add_argument('--element-length', metavar='float', type=float, default=3000.,
+                        help='Length of a section (default: 3000)')
+
+    parser.add_argument('-o', '--output', metavar='str', type=str, default='',
+                        help='Output file, *.trb is written in the binary format (default: standard output)')
+
+    args = parser.parse_args()
+
+    structure = generate_structure(args.sections, args.width, args.height, args.element_length)
+
+    if args.output.endswith('.trb'):
+        write_model_file(args.output, structure_arrays(*structure))
+    elif args.output:
+        with open(args.output, 'w') as target:
+            target.write(structure_file_text(*structure))
+    else:
+        print(structure_file_text(*structure))
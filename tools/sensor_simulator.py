@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the displacement sensors: streams frames in the format read by sensor_stream.SensorStream
+over TCP or to the standard output (for pipes and FIFOs).
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+
+
+def frame(channels, amplitude, frequency, noise, start):
+    """
+    One frame of simulated displacements
+
+    :param channels: number of channels
+    :param amplitude: amplitude of the oscillation
+    :param frequency: frequency of the oscillation [Hz]
+    :param noise: amplitude of the uniform noise
+    :param start: time of the first frame
+    :return: bytes of one line
+    """
+    now = time.time()
+    phase = 2 * math.pi * frequency * (now - start)
+    values = [amplitude * math.sin(phase + i) + random.uniform(-noise, noise) for i in range(channels)]
+
+    return ('%.6f %s\n' % (now, ' '.join(['%.6f' % x for x in values]))).encode()
+
+
+async def stream_frames(write, drain, args):
+    """
+    Writes frames at the given rate until the receiver disconnects
+
+    :param write: callable writing bytes
+    :param drain: coroutine function flushing the output
+    :param args: parsed command line arguments
+    :return: None
+    """
+    start = time.time()
+    period = 1.0 / args.rate
+
+    while True:
+        write(frame(args.channels, args.amplitude, args.frequency, args.noise, start))
+        await drain()
+        await asyncio.sleep(period)
+
+
+async def serve(args):
+    """
+    Serves the frames over TCP, every client gets its own stream
+
+    :param args: parsed command line arguments
+    :return: listening asyncio server
+    """
+    async def client(reader, writer):
+        try:
+            await stream_frames(writer.write, writer.drain, args)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(client, args.host, args.port)
+
+
+async def print_frames(args):
+    async def flush():
+        sys.stdout.buffer.flush()
+
+    try:
+        await stream_frames(sys.stdout.buffer.write, flush, args)
+    except BrokenPipeError:
+        pass
+
+
+# Setup console run
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--channels', metavar='int', type=int, default=1,
+                        help='Number of measured values in a frame (default: 1)')
+    parser.add_argument('-r', '--rate', metavar='float', type=float, default=1000.,
+                        help='Frames per second (default: 1000)')
+    parser.add_argument('--amplitude', metavar='float', type=float, default=5.,
+                        help='Amplitude of the simulated displacements (default: 5)')
+    parser.add_argument('--frequency', metavar='float', type=float, default=0.1,
+                        help='Frequency of the simulated displacements [Hz] (default: 0.1)')
+    parser.add_argument('--noise', metavar='float', type=float, default=0.01,
+                        help='Amplitude of the noise (default: 0.01)')
+    parser.add_argument('--host', metavar='str', type=str, default='127.0.0.1',
+                        help='Listening address (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', metavar='int', type=int, default=9750,
+                        help='Listening TCP port (default: 9750)')
+    parser.add_argument('--stdout', action='store_true',
+                        help='Write the frames to the standard output instead of serving them over TCP')
+
+    args = parser.parse_args()
+
+    # asyncio.run() and Server.serve_forever() need Python 3.7
+    loop = asyncio.get_event_loop()
+    try:
+        if args.stdout:
+            loop.run_until_complete(print_frames(args))
+        else:
+            server = loop.run_until_complete(serve(args))
+            try:
+                loop.run_forever()
+            finally:
+                server.close()
+                loop.run_until_complete(server.wait_closed())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
@@ -6,33 +6,44 @@ Used sources:
 https://stackoverflow.com/questions/29188612/arrows-in-matplotlib-using-mplot3d
 https://gist.github.com/jpwspicer/ea6d20e4d8c54e9daabbc1daabbdc027
 """
-from copy import deepcopy
 import imageio
 import math
+import multiprocessing
+import numpy
+import os
+import queue
+import time
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
+from animation import AnimationWriter, GifWriter
+from post_processing import element_results, relative_ratios
 
 
 def animate(title, maximum):
     """
-        GIF creator
+        GIF creator from the frames saved by plot_structure()
 
-        :param title:
-        :param maximum:
+        :param title: file name prefix of the frames in ./results
+        :param maximum: number of iterations
         :return: None
         """
-    images = []
+    writer = GifWriter('./results/%s.gif' % title)
 
-    [images.append(imageio.imread('./results/%s - %i.png' % (title, i))) for i in range(maximum)]
+    # Frames dropped by a pipelined run are missing
+    for frame in ['./results/%s - %i.png' % (title, i) for i in range(maximum)]:
+        if os.path.exists(frame):
+            writer.append_data(imageio.imread(frame)[:, :, :3])
 
-    imageio.mimsave('./results/%s.gif' % title, images, duration=0.33)
+    writer.close()
 
 
 def scale_displacement(base, result, scale=1.0):
-    scaled_structure = deepcopy(result)
-
-    for i in range(len(base.node)):
-        scaled_structure.node[i] = [base.node[i][j] + (result.node[i][j] - base.node[i][j]) * scale for j in range(3)]
-
-    return scaled_structure.node
+    return base.coordinates + (result.coordinates - base.coordinates) * scale
 
 
 def element_length(structure, index):
@@ -43,86 +54,362 @@ def element_length(structure, index):
     :param index: the index of the target element
     :return: the length of the index-th element
     """
+    (start, end) = structure.connectivity[index]
     return math.sqrt(sum([(j - k) ** 2 for j, k
-                          in zip(structure.node[structure.element[index].connection[1]],
-                                 structure.node[structure.element[index].connection[0]])]))
+                          in zip(structure.coordinates[end].tolist(), structure.coordinates[start].tolist())]))
 
 
 def post_process(original, deformed):
-    stresses = []
-    stress_ratio = []
+    """
+    Element stresses for coloring, see post_processing.element_results()
+
+    :param original: Structure object
+    :param deformed: deformed Structure object
+    :return: {'stress': list of axial forces, positive in compression, 'ratio': list of relative_ratios()}
+    """
+    stresses = -element_results(original, deformed)['force']
 
-    for i in range(len(original.element)):
-        stress = -(element_length(deformed, i) - element_length(original, i)) /\
-                 element_length(original, i) * original.element[i].material * original.element[i].section
+    return {'stress': stresses.tolist(), 'ratio': relative_ratios(stresses).tolist()}
 
-        stresses.append(stress)
 
-    for stress in stresses:
-        if stress > 0:
-            if max(stresses) > 0:
-                ratio = stress / max(stresses)
+def plot_structure(fig, ax, base, result=None, dof=2,  # supports=True, loads=None, reactions=False, values=False,
+                   save=True, show=False, node_number=False, counter=None, title='test'):
+    """
+    Draws a structure into ./results, see StructureRenderer
+
+    :param fig: matplotlib figure
+    :param ax: axes of the figure, cleared first
+    :param base: Structure object
+    :param result: deformed Structure object, colored by the stresses
+    :param dof: 2 or 3 dimensional plot
+    :param save: save the figure as ./results/<title>.png or ./results/<title> - <iteration>.png
+    :param show: redraw the canvas on the display
+    :param node_number: label the nodes by their IDs
+    :param counter: {'total': iteration number, ...}, numbers the saved figure
+    :param title: file name prefix of the saved figure
+    :return: None
+    """
+    ax.cla()
+
+    renderer = StructureRenderer(fig, ax, dof=dof, title=title, save_frames=save)
+
+    if node_number:
+        structure = base if result is None else result
+        for (i, node) in enumerate(structure.coordinates.tolist()):
+            if dof == 2:
+                ax.text(node[0], node[1], str(i), fontsize=12, horizontalalignment='right')
             else:
-                ratio = 0
-        else:
-            if max(stresses) > 0:
-                ratio = -stress / min(stresses)
+                ax.text(node[0], node[1], node[2], str(i), fontsize=12, horizontalalignment='right')
+
+    renderer.draw(base, result, counter=counter, save=save, show=show)
+
+
+def stress_colors(stresses):
+    """
+    Element colors of plot_structure(): red for positive, blue for negative stresses, scaled by the extreme values
+
+    :param stresses: [E] array
+    :return: [E x 3] array of RGB colors
+    """
+    ratio = relative_ratios(stresses)
+
+    colors = numpy.zeros((len(ratio), 3))
+    colors[:, 1] = 0.3
+    colors[ratio > 0, 0] = ratio[ratio > 0]
+    colors[ratio <= 0, 2] = -ratio[ratio <= 0]
+
+    return colors
+
+
+class StructureRenderer(object):
+    def __init__(self, fig=None, ax=None, dof=2, title='test', every=1, min_interval=0.0, sink=None,
+                 save_frames=True, directory='./results'):
+        """
+        Incremental structure plot: the elements are one line collection, created on the first frame,
+        later frames only replace its segments and colors.
+
+        :param fig: matplotlib figure, None for an offscreen (Agg) figure without a display
+        :param ax: axes of the figure, created if None
+        :param dof: 2 or 3 dimensional plot
+        :param title: file name prefix of the saved frames
+        :param every: draw only every n-th iteration
+        :param min_interval: least seconds between two drawn frames
+        :param sink: animation.AnimationWriter receiving every drawn frame, or None
+        :param save_frames: save every drawn frame as a PNG
+        :param directory: folder of the saved frames
+        """
+        if fig is None:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+
+        if ax is None:
+            if dof == 2:
+                ax = fig.add_subplot(111)
             else:
-                ratio = 0
-        stress_ratio.append(ratio)
+                ax = fig.add_subplot(111, projection='3d')
 
-    return {'stress': stresses, 'ratio': stress_ratio}
+        self.fig = fig
+        self.ax = ax
+        self.dof = dof
+        self.title = title
+        self.every = max(1, every)
+        self.min_interval = min_interval
+        self.sink = sink
+        self.save_frames = save_frames
+        self.directory = directory
 
+        self.collection = None
+        self.frames = 0
+        self.skipped = 0
+        self._last_frame = None
 
-def plot_structure(fig, ax, base, result=None, dof=2,  # supports=True, loads=None, reactions=False, values=False,
-                   save=True, show=False, node_number=False, counter=None, title='test'):
+    def should_draw(self, counter=None):
+        """
+        :param counter: {'total': iteration number, ...} or None
+        :return: True if the frame is not skipped by the throttling
+        """
+        if counter is not None and counter['total'] % self.every != 0:
+            return False
 
-    if result is None:
-        structure = base
-    else:
-        structure = result
-        structure.node = scale_displacement(base, result, 1)
+        if self._last_frame is not None and time.perf_counter() - self._last_frame < self.min_interval:
+            return False
 
-    stresses = None
+        return True
 
-    # Plot structure
-    index = 0
-    rgb_col = 'b'
+    def draw(self, base, result=None, counter=None, save=True, show=False):
+        """
+        Draws the deformed structure colored by its stresses, see draw_frame()
 
-    # Clean previous plot
-    ax.cla()
+        :param base: Structure object
+        :param result: deformed Structure object, colored by the stresses
+        :param counter: {'total': iteration number, ...}, numbers the saved frame
+        :param save: save the frame (if save_frames is set) and append it to the sink
+        :param show: redraw the canvas on the display
+        :return: True if the frame was drawn, False if it was skipped
+        """
+        if not self.should_draw(counter):
+            self.skipped += 1
+            return False
+
+        self._last_frame = time.perf_counter()
+
+        structure = base if result is None else result
+
+        if result is None:
+            colors = 'b'
+        else:
+            colors = stress_colors(-element_results(base, result)['force'])
+
+        self.draw_frame(structure.coordinates, structure.connectivity, colors, counter, save, show)
+
+        return True
+
+    def draw_frame(self, coordinates, connectivity, colors, counter=None, save=True, show=False):
+        """
+        Draws a frame from arrays, without throttling
+
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param colors: [E x 3] array of RGB colors or one color
+        :param counter: {'total': iteration number, ...}, numbers the saved frame
+        :param save: save the frame (if save_frames is set) and append it to the sink
+        :param show: redraw the canvas on the display
+        :return: None
+        """
+        segments = coordinates[connectivity]
+        if self.dof == 2:
+            segments = segments[:, :, :2]
 
-    for coordinate in structure.generate_coordinate_list():
-        if result:
-            if stresses is None:
-                stresses = post_process(base, result)
-            if stresses['ratio'][index] > 0:
-                rgb_col = [stresses['ratio'][index], 0.3, 0]
+        if self.collection is None:
+            if self.dof == 2:
+                self.collection = LineCollection(segments, colors=colors)
+                self.ax.add_collection(self.collection)
             else:
-                rgb_col = [0, 0.3, abs(stresses['ratio'][index])]
-        if dof == 2:
-            ax.plot([x[0] for x in coordinate], [x[1] for x in coordinate], color=rgb_col)
+                self.collection = Line3DCollection(segments, colors=colors)
+                self.ax.add_collection3d(self.collection)
         else:
-            ax.plot([x[0] for x in coordinate], [x[1] for x in coordinate], zs=[x[2] for x in coordinate],
-                    color=rgb_col)
+            self.collection.set_segments(segments)
+            self.collection.set_color(colors)
 
-        index += 1
+        self.set_limits(segments)
+        self.frames += 1
 
-    # Plot node numbers
-    if node_number:
-        i = 0
-        for node in structure.node:
-            ax.text(node[0], node[1], node[2], dict=str(i), fontsize=12, horizontalalignment='right')
-            i += 1
+        if show:
+            self.fig.canvas.draw()
+
+        if save and self.sink is not None:
+            self.sink.append(self.fig)
+
+        if save and self.save_frames:
+            try:
+                if counter is None:
+                    self.fig.savefig(os.path.join(self.directory, '%s.png' % self.title))
+                else:
+                    self.fig.savefig(os.path.join(self.directory, '%s - %i.png' % (self.title, counter['total'])))
+            except FileNotFoundError:
+                print('Known CI error - Saving files makes Travis fail')
+
+    def close(self):
+        """
+        Finishes the animation
+
+        :return: None
+        """
+        if self.sink is not None:
+            self.sink.close()
+
+    def set_limits(self, segments):
+        """
+        :param segments: [E x 2 x dof] array of element end points
+        :return: None
+        """
+        points = segments.reshape(-1, segments.shape[2])
+        if not len(points):
+            return
+
+        lower = points.min(axis=0)
+        upper = points.max(axis=0)
+        margin = numpy.maximum((upper - lower) * 0.05, 1e-9)
 
-    if show:
-        fig.canvas.draw()
+        self.ax.set_xlim(lower[0] - margin[0], upper[0] + margin[0])
+        self.ax.set_ylim(lower[1] - margin[1], upper[1] + margin[1])
+        if self.dof == 3:
+            self.ax.set_zlim(lower[2] - margin[2], upper[2] + margin[2])
+
+
+def render_snapshots(snapshots, connectivity, dof, title, animation, save_frames, directory):
+    """
+    Main function of the render process: draws the newest snapshot, the older waiting ones are dropped
+
+    :param snapshots: multiprocessing queue of (iteration number, [N x 3] coordinates, [E] stresses), None to stop
+    :param connectivity: [E x 2] array of end-node IDs
+    :param dof: 2 or 3 dimensional plot
+    :param title: file name prefix of the saved frames
+    :param animation: animation file or '' for none
+    :param save_frames: save every drawn frame as a PNG
+    :param directory: folder of the saved frames
+    :return: None
+    """
+    sink = AnimationWriter(animation) if animation else None
+    renderer = StructureRenderer(dof=dof, title=title, sink=sink, save_frames=save_frames, directory=directory)
+
+    try:
+        running = True
+        while running:
+            snapshot = snapshots.get()
+            waiting = [snapshot]
+            while waiting[-1] is not None:
+                try:
+                    waiting.append(snapshots.get_nowait())
+                except queue.Empty:
+                    break
+
+            if waiting[-1] is None:
+                running = False
+                waiting.pop()
+
+            if waiting:
+                (total, coordinates, stresses) = waiting[-1]
+                renderer.draw_frame(coordinates, connectivity, stress_colors(stresses), counter={'total': total})
+    finally:
+        renderer.close()
+
+
+class BackgroundRenderer(object):
+    def __init__(self, connectivity, dof=2, title='test', every=1, animation='', save_frames=False, size=2,
+                 directory='./results'):
+        """
+        Offscreen rendering in a separate process. The solver only sends snapshots (deformed coordinates and
+        element stresses), the snapshots are dropped while the renderer is busy, so the solver never waits.
+
+        :param connectivity: [E x 2] array of end-node IDs
+        :param dof: 2 or 3 dimensional plot
+        :param title: file name prefix of the saved frames
+        :param every: send only every n-th iteration
+        :param animation: animation file written by the render process, '' for none
+        :param save_frames: save every drawn frame as a PNG
+        :param size: number of snapshots waiting for the render process
+        :param directory: folder of the saved frames
+        """
+        self.every = max(1, every)
+        self.submitted = 0
+        self.dropped = 0
+        self.skipped = 0
+
+        self._last = None
+        self._snapshots = multiprocessing.Queue(size)
+        self._process = multiprocessing.Process(target=render_snapshots, name='render',
+                                                args=(self._snapshots, numpy.asarray(connectivity), dof, title,
+                                                      animation, save_frames, directory))
+        self._process.daemon = True
+        self._process.start()
+
+    def draw(self, base, result=None, counter=None, save=True, show=False):
+        """
+        Sends a snapshot to the render process, see StructureRenderer.draw()
+
+        :param base: Structure object
+        :param result: deformed Structure object, colored by the stresses
+        :param counter: {'total': iteration number, ...}
+        :param save: ignored, the render process always saves
+        :param show: ignored, the render process has no display
+        :return: True if the snapshot was sent, False if it was skipped or dropped
+        """
+        total = 0 if counter is None else counter['total']
+        if total % self.every != 0:
+            self.skipped += 1
+            return False
+
+        structure = base if result is None else result
+        if result is None:
+            stresses = numpy.zeros(len(structure.connectivity))
+        else:
+            stresses = -element_results(base, result)['force']
+
+        self._last = (total, numpy.array(structure.coordinates), stresses)
 
-    if save:
         try:
-            if counter is None:
-                fig.savefig('./results/%s.png' % title)
-            else:
-                fig.savefig('./results/%s - %i.png' % (title, counter['total']))
-        except FileNotFoundError:
-            print('Known CI error - Saving files makes Travis fail')
+            self._snapshots.put_nowait(self._last)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        self.submitted += 1
+        self._last = None
+
+        return True
+
+    def close(self):
+        """
+        Sends the last dropped snapshot, waits for the render process to finish
+
+        :return: None
+        """
+        if self._last is not None:
+            self.send(self._last)
+            self._last = None
+
+        self.send(None)
+        self._process.join()
+
+        if self._process.exitcode != 0:
+            # Nobody reads the queue any more, its buffered snapshots are dropped at exit
+            self._snapshots.cancel_join_thread()
+            raise RuntimeError('The render process failed with exit code %s' % str(self._process.exitcode))
+
+    def send(self, item, interval=0.1):
+        """
+        Waits for room in the queue while the render process is running
+
+        :param item: snapshot or None to stop the render process
+        :param interval: seconds between two checks of the render process
+        :return: True if the item was sent, False if the render process has stopped
+        """
+        while self._process.is_alive():
+            try:
+                self._snapshots.put(item, timeout=interval)
+                return True
+            except queue.Full:
+                pass
+
+        return False
@@ -6,17 +6,30 @@ Truss framework created by Máté Szedlák.
 Copyright MIT, Máté Szedlák 2016-2018.
 """
 
-from copy import deepcopy
+from copy import copy, deepcopy
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import numpy
 import time
 
+from animation import AnimationWriter
 from arduino_measurements import ArduinoMeasurements
 from base_objects import *
+from checkpoint import read_checkpoint, structure_digest, write_checkpoint
+from instrumentation import Instrumentation
+from load_source import LoadSeries
 from logger import start_logging
-from truss_graphics import animate, plot_structure
-from read_input_file import read_structure_file
+from truss_graphics import BackgroundRenderer, StructureRenderer
+from parallel import GuessPool
+from parameters import Parameterization
+from pipeline import BoundedQueue, Pipeline
+from post_processing import element_results
+from read_input_file import load_structure
+from sensor_stream import SensorStream
+from solver import factorization_key, factorize, FactorizationCache
+from stiffness import assemble_sparse_stiffness_matrix, assemble_stiffness_matrix, reduce_matrix, StiffnessMatrix, \
+    structure_arrays
+from updating import AdjointSensitivity, Convergence, levenberg_marquardt_step, RankOneEvaluator
 
 
 def setup_folder(directory):
@@ -38,9 +51,9 @@ def element_length(structure, index):
     :param index: the index of the target element
     :return: the length of the index-th element
     """
+    (start, end) = structure.connectivity[index]
     return math.sqrt(sum([(j - k) ** 2 for j, k
-                          in zip(structure.node[structure.element[index].connection[1]],
-                                 structure.node[structure.element[index].connection[0]])]))
+                          in zip(structure.coordinates[end].tolist(), structure.coordinates[start].tolist())]))
 
 
 def error(measurements, calculated_displacements):
@@ -62,61 +75,45 @@ def error(measurements, calculated_displacements):
     return math.sqrt(sum_of_errors)
 
 
-def calculate_stiffness_matrix(structure):
+def parameter_change(structure, update):
     """
-    Stiffness matrix compilation
-
-    :param structure: pointer to a structure (original or updated)
-    :return: (stiffness_matrix, known_f_a)
+    :param structure: Structure object
+    :param update: Structure object with the same elements
+    :return: largest relative change of the materials and the sections
     """
+    if not len(structure.material):
+        return 0.0
 
-    stiffness_matrix = [[0] * (len(structure.node) * 3)] * (len(structure.node) * 3)
-
-    for i in range(len(structure.element)):
-        _cx = (structure.node[structure.element[i].connection[1]][0] -
-               structure.node[structure.element[i].connection[0]][0]) / element_length(structure, i)
-
-        _cy = (structure.node[structure.element[i].connection[1]][1] -
-               structure.node[structure.element[i].connection[0]][1]) / element_length(structure, i)
-
-        _cz = (structure.node[structure.element[i].connection[1]][2] -
-               structure.node[structure.element[i].connection[0]][2]) / element_length(structure, i)
+    return float(max(numpy.abs(update.material / structure.material - 1).max(),
+                     numpy.abs(update.section / structure.section - 1).max()))
 
-        _norm_stiff = structure.element[i].material / element_length(structure, i)
 
-        # local stiffness matrix calculation
-        _s_loc = [[_cx ** 2, _cx * _cy, _cx * _cz, -_cx ** 2, -_cx * _cy, -_cx * _cz],
-                  [_cx * _cy, _cy ** 2, _cy * _cz, -_cx * _cy, -_cy ** 2, -_cy * _cz],
-                  [_cx * _cz, _cy * _cz, _cz ** 2, -_cx * _cz, -_cy * _cz, -_cz ** 2],
-                  [-_cx ** 2, -_cx * _cy, -_cx * _cz, _cx ** 2, _cx * _cy, _cx * _cz],
-                  [-_cx * _cy, -_cy ** 2, -_cy * _cz, _cx * _cy, _cy ** 2, _cy * _cz],
-                  [-_cx * _cz, -_cy * _cz, -_cz ** 2, _cx * _cz, _cy * _cz, _cz ** 2]]
-
-        local_stiffness_matrix = [[y * structure.element[i].section * _norm_stiff for y in x] for x in _s_loc]
-
-        # Creating mapping tool for elements
-        element_dof = []
-        for element in structure.element:
-            node = element.connection
-            element_dof.append(
-                [node[0] * 3, node[0] * 3 + 1, node[0] * 3 + 2, node[1] * 3, node[1] * 3 + 1, node[1] * 3 + 2])
-
-        ele_dof_vec = element_dof[i]
+def load_records(measurement):
+    """
+    :param measurement: ArduinoMeasurements object
+    :return: number of records read from its load series, 0 without a load series
+    """
+    if isinstance(measurement.load_source, LoadSeries):
+        return measurement.load_source.records
 
-        stiffness_increment = [0] * (len(structure.node) * 3)
+    return 0
 
-        for j in range(3 * 2):
-            for k in range(3 * 2):
-                stiffness_increment[ele_dof_vec[k]] = local_stiffness_matrix[j][k]
 
-            stiffness_matrix[ele_dof_vec[j]] = \
-                [x + y for x, y in zip(stiffness_matrix[ele_dof_vec[j]], stiffness_increment)]
+def calculate_stiffness_matrix(structure):
+    """
+    Stiffness matrix compilation
 
-    return stiffness_matrix
+    :param structure: pointer to a structure (original or updated)
+    :return: stiffness_matrix as a list of rows
+    """
+    return assemble_stiffness_matrix(*structure_arrays(structure)).tolist()
 
 
 class Truss(object):
-    def __init__(self, input_file, title, measurements, graphics=False, log=False):
+    def __init__(self, input_file, title, measurements, graphics=False, log=False, solver='dense', method='guess',
+                 workers=1, stats=False, sensor='', load_series='', headless=False, render_every=1,
+                 animation='gif', save_frames=False, background_render=False, output_dir='.', checkpoint_every=0,
+                 convergence=None, parameterization=None):
         """
         Main container
 
@@ -125,20 +122,61 @@ class Truss(object):
         :param measurements: list of measured degree of freedoms, like ['12X', '15Z']
         :param graphics: switch for GUI
         :param log: switch for saving logs
+        :param solver: 'dense' or 'sparse' stiffness matrix and factorization
+        :param method: 'guess' (one element per iteration), 'adaptive' (one element per iteration with an adaptive
+                       step size) or 'gradient' (Levenberg-Marquardt on every material)
+        :param workers: number of processes evaluating the guesses, 1 runs them in the main process
+        :param stats: switch for per-iteration timing statistics in ./logs (JSON lines and Prometheus text)
+        :param sensor: sensor stream source, like 'tcp://127.0.0.1:9750' (see sensor_stream), '' for mocked input
+        :param load_series: load file replayed record by record until its end (see load_source),
+                            '' to read ./loads/<title>.txt in every iteration
+        :param headless: render the frames offscreen (Agg) without opening a window
+        :param render_every: draw only every n-th iteration
+        :param animation: format of the animation streamed into ./results during the run: 'gif', 'mp4' or '' (none)
+        :param save_frames: save every drawn frame as a PNG into ./results
+        :param background_render: render offscreen in a separate process, skipping frames while it is busy
+        :param output_dir: folder of the 'results' and 'logs' output folders
+        :param checkpoint_every: save the updating state into ./results/<title>.checkpoint every n-th iteration
+                                 and when the updating stops, 0 to switch off (see resume())
+        :param convergence: Convergence object stopping the updating early, None to run until max_iteration
+                            (the adaptive method uses the default criteria)
+        :param parameterization: Parameterization object of the updated parameters and their bounds,
+                                 None to update the Young's moduli without bounds
         """
-        self.options = {'graphics': graphics, 'log': log}
+        if solver not in ['dense', 'sparse']:
+            raise ValueError('solver should be \'dense\' or \'sparse\' but got: %s' % str(solver))
+
+        if method not in ['guess', 'adaptive', 'gradient']:
+            raise ValueError('method should be \'guess\', \'adaptive\' or \'gradient\' but got: %s' % str(method))
+
+        self.options = {'graphics': graphics, 'log': log, 'solver': solver, 'method': method, 'workers': workers,
+                        'stats': stats, 'sensor': sensor, 'load_series': load_series,
+                        'headless': headless, 'render_every': render_every, 'animation': animation,
+                        'save_frames': save_frames, 'background_render': background_render,
+                        'output_dir': output_dir, 'checkpoint_every': checkpoint_every}
+
+        # Levenberg-Marquardt damping of the gradient method
+        self.damping = 1e-2
+
+        # Relative step size of the adaptive method, changed by the line search and the back-offs
+        self.step = 0.1
+        self.max_step = 0.5
 
-        setup_folder('results')
-        setup_folder('logs')
+        if convergence is None and method == 'adaptive':
+            convergence = Convergence()
+        self.convergence = convergence
+
+        self.parameterization = parameterization if parameterization is not None else Parameterization()
 
         # Labeling object
         if title != '':
             self.title = title
         else:
-            self.title = input_file.replace('.str', '')
+            self.title = input_file.replace('.str', '').replace('.trb', '')
 
-        # Initializing logger
-        self.logger = start_logging(file=self.options['log'], label=self.title)
+        # Output folders, logger, instrumentation and checkpoint file of the title
+        self.logger = None
+        self.open_outputs()
 
         self.logger.info('*******************************************************')
         self.logger.info('              STARTING TRUSS UPDATER')
@@ -148,25 +186,128 @@ class Truss(object):
         self.logger.info('*******************************************************\n')
 
         # Reading structural data, boundaries and loads
-        (node_list, element_list, boundaries) = read_structure_file(input_file)
+        arrays = load_structure(input_file)
+
+        # Memory-mapped structure shared by the worker processes
+        if input_file.endswith('.trb'):
+            self.model_file = './structures/%s' % input_file
+        else:
+            self.model_file = ''
 
-        # Setting up basic structure
-        self.original = StructuralData(node_list, element_list)
+        # Setting up basic structure, the parameters are copied on the first update
+        self.original = StructuralData.from_arrays(arrays['coordinates'], arrays['connectivity'], arrays['material'],
+                                                   arrays['section'], copy_parameters=False)
 
         # Setting up boundaries
-        self.boundaries = Boundaries(boundaries)
+        self.boundaries = Boundaries([[int(dof), displacement] for (dof, displacement) in arrays['supports'].tolist()])
 
         # Setting up loads
         self.loads = Loads({'forces': [[25, -9.8]]})
 
+        # Factorized reduced stiffness matrices, keyed by structure version
+        self.factorizations = FactorizationCache()
+
+        # Incrementally updated reduced stiffness matrix of the last factorized structure
+        self.stiffness = None
+
+        # Worker pool of the guesses, started on demand
+        self.pool = None
+
+        # Strains, forces, stresses and utilizations of the updated structure in the last iteration
+        self.member_results = None
+
+        # [original error, updated error] of every iteration
+        self.history = []
+
+        # Updating state after the last completed iteration, saved by save_checkpoint()
+        self.checkpoint = None
+
+        # Number of load series records read up to the measurement of the last solved iteration
+        self.records = 0
+
         # Setup Input
-        self.measurement = ArduinoMeasurements(measurements)
-        self.logger.debug("Calibration is mocked: set to 0")
+        if self.options['sensor']:
+            self.sensor = SensorStream(len(measurements), self.options['sensor']).start()
+            self.measurement = ArduinoMeasurements(measurements, stream=self.sensor, load_series=load_series)
+            self.logger.debug('Calibrated from %s: %s' %
+                              (self.options['sensor'], str(self.measurement.initial_measurements)))
+        else:
+            self.sensor = None
+            self.measurement = ArduinoMeasurements(measurements, load_series=load_series)
+            self.logger.debug("Calibration is mocked: set to 0")
 
         # Initiating updated structure
         self.updated = deepcopy(self.original)
 
-        if self.options['graphics']:
+        # Updated structure before the last update, restored by the back-offs of the adaptive method
+        self.previous = None
+
+        self.open_renderer()
+
+    def open_outputs(self):
+        """
+        Creates the output folders, the logger, the instrumentation and the checkpoint file name of the title
+
+        :return: None
+        """
+        output_dir = self.options['output_dir']
+        if output_dir == '.':
+            setup_folder('results')
+            setup_folder('logs')
+        else:
+            for directory in ['results', 'logs']:
+                if not os.path.exists(os.path.join(output_dir, directory)):
+                    os.makedirs(os.path.join(output_dir, directory))
+
+        self.results_dir = os.path.join(output_dir, 'results')
+        self.logs_dir = os.path.join(output_dir, 'logs')
+
+        # The handlers of a previous title would keep writing into its log file
+        if self.logger is not None:
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+
+        # Initializing logger
+        self.logger = start_logging(file=self.options['log'], label=self.title, directory=self.logs_dir)
+
+        # Initializing instrumentation
+        self.stats = Instrumentation(enabled=self.options['stats'], label=self.title,
+                                     jsonl_file=os.path.join(self.logs_dir, '%s.stats.jsonl' % self.title),
+                                     prometheus_file=os.path.join(self.logs_dir, '%s.prom' % self.title))
+
+        self.checkpoint_file = os.path.join(self.results_dir, '%s.checkpoint' % self.title)
+
+    def open_renderer(self):
+        """
+        Creates the renderer and the animation of the title if the graphics are enabled
+
+        :return: None
+        """
+        (graphics, animation) = (self.options['graphics'], self.options['animation'])
+        (render_every, save_frames) = (self.options['render_every'], self.options['save_frames'])
+        background_render = self.options['background_render']
+
+        if animation:
+            animation_file = os.path.join(self.results_dir, '%s.%s' % (self.title, animation))
+        else:
+            animation_file = ''
+
+        if graphics and animation_file and not background_render:
+            sink = AnimationWriter(animation_file)
+        else:
+            sink = None
+
+        if graphics and background_render:
+            self.renderer = BackgroundRenderer(self.original.connectivity, dof=self.dof(), title=self.title,
+                                               every=render_every, animation=animation_file, save_frames=save_frames,
+                                               directory=self.results_dir)
+        elif graphics and self.options['headless']:
+            self.renderer = StructureRenderer(dof=self.dof(), title=self.title, every=render_every, sink=sink,
+                                              save_frames=save_frames, directory=self.results_dir)
+            self.fig = self.renderer.fig
+            self.ax = self.renderer.ax
+        elif graphics:
             self.fig = plt.figure()
             if self.dof() == 2:
                 self.ax = self.fig.add_subplot(111)
@@ -178,13 +319,20 @@ class Truss(object):
             self.fig.canvas.draw()
             plt.show(block=False)
 
-    def dof(self):
-        dof = 3
+            self.renderer = StructureRenderer(self.fig, self.ax, dof=self.dof(), title=self.title, every=render_every,
+                                              sink=sink, save_frames=save_frames, directory=self.results_dir)
+        else:
+            self.renderer = None
 
-        if sum([1 if support[0] % 3 == 2 else 0 for support in self.boundaries.supports]) == len(self.original.node):
-            dof = 2
+    def dof(self):
+        return self.boundaries.partition(len(self.original.coordinates)).dimension
 
-        return dof
+    def free_dofs(self, structure):
+        """
+        :param structure: Structure object
+        :return: array of unconstrained DOF IDs
+        """
+        return self.boundaries.partition(len(structure.coordinates)).free
 
     def solver_helper(self, structure):
         """
@@ -193,95 +341,166 @@ class Truss(object):
         :param structure: Structure object
         :return: { known_f_a, known_f_not_zero, known_displacement_a }
         """
-        # Setting known forces
-        known_f_a = []
-        known_f_not_zero = []
-        known_displacement_a = []
-
-        for location in range(len(structure.node) * 3):
-            known_f_a.append(location)
-            if location in [x[0] for x in self.loads.forces]:
-                known_f_not_zero.append(location)
+        partition = self.boundaries.partition(len(structure.coordinates))
+        loaded = numpy.array([x[0] for x in self.loads.forces], dtype=int)
 
-        for constraint in self.boundaries.supports:
-            known_displacement_a.append(constraint[0])
-            if constraint[0] in known_f_a:
-                known_f_a.remove(constraint[0])
+        return {'known_f_a': partition.free.tolist(),
+                'known_f_not_zero': numpy.intersect1d(loaded, partition.free).tolist(),
+                'known_displacement_a': [x[0] for x in self.boundaries.supports]}
 
-            if constraint[0] in known_f_not_zero:
-                known_f_not_zero.remove(constraint[0])
+    def stiffness_matrix(self, structure):
+        """
+        Assembles the global stiffness matrix in the format set by the 'solver' option
 
-        return {'known_f_a': known_f_a,
-                'known_f_not_zero': known_f_not_zero,
-                'known_displacement_a': known_displacement_a}
+        :param structure: Structure object
+        :return: dense numpy array or scipy.sparse.csr_matrix
+        """
+        if self.options['solver'] == 'sparse':
+            return assemble_sparse_stiffness_matrix(*structure_arrays(structure))
+        else:
+            return assemble_stiffness_matrix(*structure_arrays(structure))
 
-    def solve(self, structure, boundaries, loads, label=''):
+    def reduced_stiffness_matrix(self, structure, free_dofs):
         """
-        Main solver. Calculates displacements for a given structure + loads + boundaries combination.
+        Reduced stiffness matrix of a structure. If only the parameters differ from the previously assembled
+        structure, just the blocks of the changed elements are updated.
 
-        :param structure: Structure object pointer. Sets the error of the structure according to self.measurements
-        :param boundaries: Boundaries object
-        :param loads: Loads object
-        :param label: label for solution return value
-        :return: returns an non-standardized array of deformations
+        :param structure: Structure object
+        :param free_dofs: list of unconstrained DOF IDs
+        :return: dense numpy array or scipy.sparse.csr_matrix, owned by self.stiffness
         """
-        if label == '':
-            label = 'result'
+        (coordinates, connectivity, material, section) = structure_arrays(structure)
 
-        # Calculate stiffness-matrix
-        stiffness_matrix = calculate_stiffness_matrix(structure)
+        with self.stats.timer('assembly'):
+            if self.stiffness is not None and self.stiffness.matches(coordinates, connectivity, free_dofs):
+                self.stats.count('changed_elements', self.stiffness.update(material, section))
+            else:
+                self.stiffness = StiffnessMatrix(coordinates, connectivity, material, section, free_dofs,
+                                                 sparse_format=self.options['solver'] == 'sparse')
+                self.stats.count('assemblies')
 
-        dof_number = len(structure.node) * 3
+        return self.stiffness.matrix
 
-        helper = self.solver_helper(structure)
-        known_f_a = helper['known_f_a']
+    def factorization(self, structure, free_dofs, cache=True):
+        """
+        Factorized reduced stiffness matrix of a structure. Unchanged structures reuse their factorization
+        so a new load vector only costs a back-substitution.
 
-        constraints = deepcopy(boundaries.supports)
+        :param structure: Structure object
+        :param free_dofs: list of unconstrained DOF IDs
+        :param cache: store the new factorization for later solves
+        :return: factorization object, see solver.factorize()
+        """
+        def build():
+            matrix = self.reduced_stiffness_matrix(structure, free_dofs)
+            with self.stats.timer('factorization'):
+                self.stats.count('factorizations')
+                return factorize(matrix)
+
+        key = factorization_key(structure_arrays(structure), free_dofs)
+        if cache or key in self.factorizations:
+            return self.factorizations.get(key, build)
+        else:
+            return build()
 
-        forces = [0.0] * dof_number
+    def load_vector(self, structure, loads):
+        """
+        :param structure: Structure object
+        :param loads: Loads object
+        :return: global force vector
+        """
+        forces = numpy.zeros(len(structure.coordinates) * 3)
         for (dof, force) in loads.forces:
             forces[dof] = force
 
-        force_new = [0.0] * (dof_number - len(constraints))
-        for i, dof in enumerate(known_f_a):
-            force_new[i] = forces[dof]
+        return forces
 
-        displacements = [0.0] * dof_number
-        for (dof, displacement) in deepcopy(loads.displacements):
-            displacements[dof] = displacement
+    def perturbation_evaluator(self, structure):
+        """
+        Rank-one evaluator of single-element changes of a structure under the current loads and measurements
 
-        stiff_new = [[0.0] * (dof_number - len(constraints))] * (dof_number - len(constraints))
+        :param structure: Structure object
+        :return: RankOneEvaluator object
+        """
+        known_f_a = self.free_dofs(structure)
 
-        stiffness_increment = [0.0] * (dof_number - len(constraints))
+        return RankOneEvaluator(self.factorization(structure, known_f_a), known_f_a,
+                                self.load_vector(structure, self.loads), *structure_arrays(structure),
+                                measurements=self.measurement.displacements)
 
-        for i, kfai in enumerate(known_f_a):
-            for j, kfaj in enumerate(known_f_a):
-                stiffness_increment[j] = stiffness_matrix[kfai][kfaj]
+    def sensitivity(self, structure):
+        """
+        Adjoint sensitivities of a structure under the current loads and measurements
 
-            stiff_new[i] = [x + y for x, y in zip(stiff_new[i], stiffness_increment)]
+        :param structure: Structure object
+        :return: AdjointSensitivity object
+        """
+        known_f_a = self.free_dofs(structure)
 
-        # SOLVING THE STRUCTURE
-        dis_new = numpy.linalg.solve(numpy.array(stiff_new), numpy.array(force_new))
+        return AdjointSensitivity(self.factorization(structure, known_f_a), known_f_a,
+                                  self.load_vector(structure, self.loads), *structure_arrays(structure),
+                                  measurements=self.measurement.displacements)
 
-        for i, known_f_a in enumerate(known_f_a):
-            displacements[known_f_a] = dis_new[i]
+    def parallel_errors(self, structure, factor_sets):
+        """
+        Evaluates single-element trials of a structure on the worker pool
 
-        node = []
+        :param structure: Structure object
+        :param factor_sets: list of [E] arrays of stiffness multipliers, one trial per element in each
+        :return: list of [E] arrays of errors
+        """
+        (coordinates, connectivity, material, section) = structure_arrays(structure)
 
-        # Deformed shape
-        for i in range(len(structure.node)):
-            node.append([structure.node[i][0] + displacements[i * 3 + 0],
-                         structure.node[i][1] + displacements[i * 3 + 1],
-                         structure.node[i][2] + displacements[i * 3 + 2]])
+        if self.pool is None:
+            self.pool = GuessPool(self.options['workers'], coordinates, connectivity,
+                                  self.free_dofs(structure), self.options['solver'], model_file=self.model_file)
+
+        return self.pool.errors(material, section, self.load_vector(structure, self.loads),
+                                self.measurement.displacements, factor_sets)
+
+    def solve(self, structure, boundaries, loads, label='', cache=True):
+        """
+        Main solver. Calculates displacements for a given structure + loads + boundaries combination.
+
+        :param structure: Structure object pointer. Sets the error of the structure according to self.measurements
+        :param boundaries: Boundaries object
+        :param loads: Loads object
+        :param label: label for solution return value
+        :param cache: keep the factorization of the structure for later solves
+        :return: returns an non-standardized array of deformations
+        """
+        if label == '':
+            label = 'result'
+
+        dof_number = len(structure.coordinates) * 3
+
+        known_f_a = boundaries.partition(len(structure.coordinates)).free
+
+        forces = self.load_vector(structure, loads)
+
+        displacements = numpy.zeros(dof_number)
+        for (dof, displacement) in loads.displacements:
+            displacements[dof] = displacement
+
+        # SOLVING THE STRUCTURE
+        factorization = self.factorization(structure, known_f_a, cache)
+        with self.stats.timer('back_substitution'):
+            dis_new = factorization.solve(forces[known_f_a])
+        self.stats.count('solves')
+
+        displacements[known_f_a] = dis_new
 
         # Calculating the error
         structure.error = error(self.measurement.displacements, displacements)
 
-        deformed = StructuralData(node, [[x.connection, x.material, x.section] for x in structure.element], label)
+        # Deformed shape: shares the topology and the parameters of the structure
+        deformed = structure.copy(label)
+        deformed.node = structure.coordinates + displacements.reshape(-1, 3)
+        deformed.error = structure.error
 
         return deformed
 
-    def start_model_updating(self, max_iteration=0):
+    def start_model_updating(self, max_iteration=0, pause=2, resume=False):
         """
         Starting main model updating process:
             - Read displacements and loads from sensors
@@ -289,42 +508,323 @@ class Truss(object):
             - Check reset condition
 
         :param: max_iteration: Sets the maximum number of updates. If 0, the iteration number is unlimited.
+                               A replayed load series stops the updating at its end.
+        :param pause: seconds to wait before returning, to leave the last figure on the screen
+        :param resume: continue from the checkpoint of an earlier run, max_iteration counts its iterations too
 
-        :return: None
+        :return: number of iterations
         """
         self.logger.info('Start model updating\n')
-        counter = {'total': 0, 'loop': 0}
+        counter = self.resume() if resume else {'total': 0, 'loop': 0}
+
+        try:
+            while not self.measurement.finished and not self.converged and \
+                    (counter['total'] < max_iteration or max_iteration == 0):
+                self.iterate(counter)
+        finally:
+            # An interrupted run keeps its last completed iteration and releases the workers and the renderer
+            self.save_checkpoint()
+            self.finish()
+            self.stats.flush()
+
+        if self.converged:
+            self.logger.info('Converged: %s' % self.convergence.reason)
+        self.logger.info('Exiting...')
+        time.sleep(pause)
 
-        while True and (counter['total'] < max_iteration or max_iteration == 0):
-            self.logger.info('*** %i. loop ***' % counter['loop'])
+        return counter['total']
 
-            # Read sensors
+    def iterate(self, counter):
+        """
+        One model updating loop: read sensors, solve the original and the updated structure, update
+
+        :param counter: {'total': number of loops, 'loop': number of loops since the last reset}, incremented here
+        :return: None
+        """
+        self.logger.info('*** %i. loop ***' % counter['loop'])
+
+        # Read sensors
+        with self.stats.timer('measurement'):
             self.measurement.update(self.loads, title=self.title)
-            self.logger.debug('Loads are mocked: %s' % str(self.measurement.loads))
+        self.records = load_records(self.measurement)
+        self.logger.debug('Loads are mocked: %s' % str(self.measurement.loads))
 
-            # Calculate refreshed and/or updated models
-            self.solve(self.original, self.boundaries, self.loads)
-            deformed = self.solve(self.updated, self.boundaries, self.loads)
+        frame = dict(counter)
+        deformed = self.advance(counter)
 
-            if self.options['graphics']:
-                plot_structure(self.fig, self.ax, self.original, deformed, dof=self.dof(),
-                               counter=counter, title=self.title, show=True)
+        if self.options['graphics']:
+            with self.stats.timer('plot'):
+                self.renderer.draw(self.original, deformed, counter=frame, show=not self.options['headless'])
 
-            counter['loop'] += 1
-            counter['total'] += 1
+        self.end_iteration(counter)
 
-            if self.should_reset() is False:
-                self.updated = deepcopy(self.update())
-            else:
-                self.updated = deepcopy(self.original)
-                self.logger.warn('RESET STRUCTURE')
-                counter['loop'] = 0
+    def advance(self, counter):
+        """
+        Solves the original and the updated structure under the current measurements, then updates or resets
+
+        :param counter: {'total': number of loops, 'loop': number of loops since the last reset}, incremented here
+        :return: deformed shape of the updated structure before the update
+        """
+        # Calculate refreshed and/or updated models
+        self.solve(self.original, self.boundaries, self.loads)
+        deformed = self.solve(self.updated, self.boundaries, self.loads)
+
+        with self.stats.timer('post_process'):
+            self.member_results = element_results(self.updated, deformed)
+
+        counter['loop'] += 1
+        counter['total'] += 1
+
+        if self.should_reset() is False:
+            update = self.update()
+            if self.convergence is not None:
+                self.convergence.check(self.updated.error, update.error, parameter_change(self.updated, update),
+                                       self.step if self.options['method'] == 'adaptive' else None)
+            self.previous = self.updated
+            self.updated = deepcopy(update)
+        elif self.options['method'] == 'adaptive' and self.previous is not None:
+            # Back off: the last step is undone and the next ones are smaller
+            self.updated = deepcopy(self.previous)
+            self.previous = None
+            self.step /= 2
+            self.logger.info('BACK OFF, step: %.3g' % self.step)
+            self.stats.count('backoffs')
+        else:
+            self.updated = deepcopy(self.original)
+            self.logger.warn('RESET STRUCTURE')
+            self.stats.count('resets')
+            counter['loop'] = 0
+
+        return deformed
+
+    def end_iteration(self, counter):
+        """
+        :param counter: see iterate()
+        :return: None
+        """
+        if self.member_results is not None and len(self.member_results['force']):
+            largest_force = float(numpy.abs(self.member_results['force']).max())
+        else:
+            largest_force = 0.0
+
+        self.stats.end_iteration(loop=counter['total'], error=self.updated.error, original_error=self.original.error,
+                                 factorization_cache_hits=self.factorizations.hits,
+                                 factorization_cache_misses=self.factorizations.misses,
+                                 largest_member_force=largest_force)
+
+        self.history.append([float(self.original.error), float(self.updated.error)])
+
+        if self.options['checkpoint_every']:
+            self.checkpoint = self.checkpoint_state(counter)
+            if counter['total'] % self.options['checkpoint_every'] == 0:
+                self.save_checkpoint()
+
+    def checkpoint_state(self, counter):
+        """
+        :param counter: see iterate()
+        :return: updating state, see checkpoint.write_checkpoint()
+        """
+        return {'total': counter['total'], 'loop': counter['loop'], 'records': self.records,
+                'stalls': self.convergence.stalls if self.convergence is not None else 0,
+                'original_error': float(self.original.error), 'error': float(self.updated.error),
+                'damping': self.damping, 'step': self.step,
+                'digest': structure_digest(self.original.coordinates, self.original.connectivity),
+                'material': self.updated.material.copy(), 'section': self.updated.section.copy(),
+                'history': numpy.array(self.history, dtype=float).reshape(-1, 2),
+                'previous': None if self.previous is None else
+                {'material': self.previous.material.copy(), 'section': self.previous.section.copy(),
+                 'error': float(self.previous.error)}}
+
+    def save_checkpoint(self):
+        """
+        Saves the state of the last completed iteration into self.checkpoint_file (if checkpoints are switched on)
 
+        :return: None
+        """
+        if self.options['checkpoint_every'] and self.checkpoint is not None:
+            with self.stats.timer('checkpoint'):
+                write_checkpoint(self.checkpoint_file, self.checkpoint)
+
+    def resume(self, path=''):
+        """
+        Restores the updated structure and the one before the last update, the counters, the step sizes, the error
+        history and the position of a replayed load series from a checkpoint
+
+        :param path: checkpoint file, self.checkpoint_file by default
+        :return: counter, see iterate()
+        """
+        state = read_checkpoint(path or self.checkpoint_file)
+
+        if len(state['material']) != len(self.original.connectivity) or \
+                state['digest'] != structure_digest(self.original.coordinates, self.original.connectivity):
+            raise ValueError('The checkpoint %s belongs to another structure' % (path or self.checkpoint_file))
+
+        self.updated = self.original.copy()
+        self.updated.set_material(slice(None), state['material'])
+        self.updated.set_section(slice(None), state['section'])
+        self.updated.error = state['error']
+        self.original.error = state['original_error']
+        if state['previous'] is not None:
+            self.previous = self.original.copy()
+            self.previous.set_material(slice(None), state['previous']['material'])
+            self.previous.set_section(slice(None), state['previous']['section'])
+            self.previous.error = state['previous']['error']
+        else:
+            self.previous = None
+        self.damping = state['damping']
+        self.step = state['step']
+        if self.convergence is not None:
+            self.convergence.stalls = state['stalls']
+        self.history = state['history'].tolist()
+        self.checkpoint = state
+        self.records = state['records']
+
+        if isinstance(self.measurement.load_source, LoadSeries):
+            self.measurement.load_source.skip(state['records'] - self.measurement.load_source.records)
+
+        self.logger.info('Resumed after %i iterations from %s' % (state['total'], path or self.checkpoint_file))
+
+        return {'total': state['total'], 'loop': state['loop']}
+
+    def start_pipelined_updating(self, max_iteration=0, queue_size=2, sample_interval=0.01,
+                                 acquisition_policy='drop-oldest', render_policy='drop-oldest', resume=False):
+        """
+        Model updating with sensor acquisition, solving and rendering in separate threads joined by bounded queues,
+        so the solver does not wait for the sensors, matplotlib or the disk.
+
+        The figures are only saved: matplotlib figures on screen can only be drawn by the main thread,
+        so the graphics should be headless or rendered in the background.
+
+        :param max_iteration: Sets the maximum number of updates. If 0, the iteration number is unlimited.
+        :param queue_size: capacity of the queues between the stages
+        :param sample_interval: seconds between two sensor readings
+        :param acquisition_policy: 'drop-oldest' (solve the newest measurement) or 'block' (solve every measurement)
+        :param render_policy: 'drop-oldest' (skip frames) or 'block' (render every iteration)
+        :param resume: continue from the checkpoint of an earlier run, see start_model_updating()
+        :return: None
+        """
+        if self.options['graphics'] and not (self.options['headless'] or self.options['background_render']):
+            raise ValueError('Pipelined updating draws in a separate thread, use headless or background rendering')
+
+        self.logger.info('Start pipelined model updating\n')
+        counter = self.resume() if resume else {'total': 0, 'loop': 0}
+
+        samples = BoundedQueue(queue_size, acquisition_policy)
+        frames = BoundedQueue(queue_size, render_policy)
+        pipeline = Pipeline([samples, frames])
+
+        # The acquisition stage owns its copy, the solver stage only sees the queued measurements
+        sensors = copy(self.measurement)
+
+        def acquire(stop):
+            while not stop.is_set() and not sensors.finished:
+                loads = Loads({})
+                with self.stats.timer('measurement'):
+                    sensors.update(loads, title=self.title)
+                samples.put((loads, sensors.displacements, load_records(sensors)))
+
+                if sample_interval > 0:
+                    stop.wait(sample_interval)
+
+            # End of a replayed load series: the queued samples are still solved
+            samples.close()
+
+        def update(stop):
+            try:
+                while not stop.is_set() and not self.converged and \
+                        (counter['total'] < max_iteration or max_iteration == 0):
+                    # The acquisition reads ahead, the checkpoints count the records of the solved samples
+                    (self.loads, self.measurement.displacements, self.records) = samples.get()
+                    self.logger.info('*** %i. loop ***' % counter['loop'])
+
+                    frame = dict(counter)
+                    deformed = self.advance(counter)
+                    if self.options['graphics']:
+                        frames.put((deformed, frame))
+
+                    self.end_iteration(counter)
+            finally:
+                # Let the renderer finish the queued frames
+                stop.set()
+                samples.close()
+                frames.close()
+
+        def render(stop):
+            while True:
+                (deformed, frame) = frames.get()
+                with self.stats.timer('plot'):
+                    self.renderer.draw(self.original, deformed, counter=frame)
+
+        pipeline.add_stage('acquisition', acquire)
+        pipeline.add_stage('update', update)
         if self.options['graphics']:
-            animate(self.title, counter['total'])
+            pipeline.add_stage('render', render)
+
+        try:
+            pipeline.run()
+        finally:
+            if samples.dropped or frames.dropped:
+                self.logger.debug('Dropped measurements: %i, dropped frames: %i' % (samples.dropped, frames.dropped))
+            self.save_checkpoint()
+            self.finish()
+            self.stats.flush()
 
         self.logger.info('Exiting...')
-        time.sleep(2)
+
+    @property
+    def converged(self):
+        """
+        :return: True if the convergence criteria stopped the updating
+        """
+        return self.convergence is not None and self.convergence.converged
+
+    def finish(self):
+        """
+        Releases the workers and the sensors, closes the animation
+
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+        if self.sensor is not None:
+            self.sensor.stop()
+
+        if self.renderer is not None:
+            with self.stats.timer('animate'):
+                self.renderer.close()
+
+    def restart(self, measurements, load_series='', title=None, output_dir=None):
+        """
+        Starts a new updating from the original structure with new measurements. The parsed structure and
+        the cached factorizations are kept, the outputs are reopened for the title and the output folder.
+
+        :param measurements: list of measured degree of freedoms, like ['12X', '15Z']
+        :param load_series: load file replayed record by record, '' to read ./loads/<title>.txt
+        :param title: new title, used by the load file and the output files, the current one by default
+        :param output_dir: new folder of the 'results' and 'logs' output folders, the current one by default
+        :return: None
+        """
+        if title:
+            self.title = title
+        if output_dir is not None:
+            self.options['output_dir'] = output_dir
+
+        self.open_outputs()
+        self.open_renderer()
+
+        self.measurement = ArduinoMeasurements(measurements, load_series=load_series)
+        self.updated = deepcopy(self.original)
+        self.member_results = None
+        self.damping = 1e-2
+        self.step = 0.1
+        self.previous = None
+        self.history = []
+        self.checkpoint = None
+        self.records = 0
+        if self.convergence is not None:
+            self.convergence.reset()
 
     def should_reset(self):
         """
@@ -349,30 +849,134 @@ class Truss(object):
         :return: Structure object
         """
         self.logger.debug('Update')
-        return self.compile(self.guess())
+        if self.options['method'] == 'gradient':
+            with self.stats.timer('gradient'):
+                return self.gradient_update()
+        elif self.options['method'] == 'adaptive':
+            with self.stats.timer('guess'):
+                return self.adaptive_update()
+        else:
+            with self.stats.timer('guess'):
+                guesses = self._guess_factors()
+            with self.stats.timer('compile'):
+                return self._compile_factors(guesses)
 
-    def guess(self):
+    def gradient_update(self, max_attempts=5, max_change=0.5):
         """
-        Returns an array of possible modifications
+        Levenberg-Marquardt step on all materials based on the adjoint sensitivities.
+        The damping is increased until the step decreases the error.
 
-        :return:
+        :param max_attempts: number of damping increases before giving up the iteration
+        :param max_change: largest relative material change of an element in one step
+        :return: Structure object
         """
-        self.logger.debug('Guess')
-        structures = []
-        delta = 0.1
+        self.logger.debug('Gradient')
+        sensitivity = self.sensitivity(self.updated)
 
-        for i in range(len(self.updated.element)):
-            structure = deepcopy(self.updated)
-            structure.element[i].material *= 1 - delta
-            self.solve(structure, self.boundaries, self.loads)
+        # Relative parameterization: x_i = k_i / k_i,current, the same for the Young's modulus and the section
+        jacobian = sensitivity.jacobian() * sensitivity.material[None, :]
+
+        update = deepcopy(self.updated)
+        update.error = sensitivity.error
+
+        for attempt in range(max_attempts):
+            step = levenberg_marquardt_step(jacobian, sensitivity.residual, self.damping)
+            step = numpy.clip(step, -max_change, max_change)
+
+            candidate = deepcopy(self.updated)
+            self.parameterization.apply(self.original, candidate, 1 + step)
+            self.solve(candidate, self.boundaries, self.loads)
+
+            if candidate.error < sensitivity.error:
+                self.damping = max(self.damping / 10, 1e-12)
+                update = candidate
+                break
+
+            self.damping *= 10
+
+        self.logger.info('Delta:\t%7.3f \t(original:\t%7.3f)' % (update.error, self.original.error))
+
+        return update
+
+    def adaptive_update(self, expansions=3):
+        """
+        Guess with an adaptive step size: every element's stiffness is scaled by 1 -/+ step, then the step of the
+        best trial is doubled while the error decreases (line search). Without an improving trial the structure
+        is kept and the step is halved.
+
+        :param expansions: largest number of step doublings in one iteration
+        :return: Structure object
+        """
+        self.logger.debug('Adaptive guess, step: %.3g' % self.step)
+        element_number = len(self.updated.element)
+        factor_sets = self.parameterization.stiffness_factors(
+            self.original, self.updated, numpy.array([numpy.full(element_number, 1 - self.step),
+                                                      numpy.full(element_number, 1 + self.step)]))
+
+        if self.options['workers'] > 1:
+            errors = numpy.vstack(self.parallel_errors(self.updated, list(factor_sets)))
+            evaluator = None
+        else:
+            evaluator = self.perturbation_evaluator(self.updated)
+            errors = evaluator.errors(factor_sets)
+
+        (direction, index) = numpy.unravel_index(numpy.argmin(errors), errors.shape)
+        best_error = float(errors[direction, index])
+        factor = float(factor_sets[direction, index])
+
+        update = deepcopy(self.updated)
+
+        if not best_error < self.updated.error:
+            self.step /= 2
+            self.logger.info('No improving step, step: %.3g' % self.step)
+            return update
+
+        sign = -1 if direction == 0 else 1
+        step = self.step
+        for _ in range(expansions):
+            trial = min(2 * step, self.max_step)
+            if trial == step or 1 + sign * trial <= 0:
+                break
+
+            trial_factor = float(self.parameterization.stiffness_factors(self.original, self.updated,
+                                                                         [1 + sign * trial], [index])[0])
+            if trial_factor == factor:
+                # Bounded parameters
+                break
+
+            if evaluator is not None:
+                trial_error = evaluator.error(index, trial_factor)
+            else:
+                candidate = deepcopy(self.updated)
+                self.parameterization.apply(self.original, candidate, [trial_factor], [index])
+                # Throwaway trial: its factorization would evict a reused one
+                self.solve(candidate, self.boundaries, self.loads, cache=False)
+                trial_error = candidate.error
+
+            if not trial_error < best_error:
+                break
+            (step, factor, best_error) = (trial, trial_factor, trial_error)
 
-            if structure.error > self.original.error:
-                # Modification resulted worse result: turn effect backward
-                # previous_error = structure.error
-                structure.element[i].material *= (1 + delta)/(1 - delta)
-                self.solve(structure, self.boundaries, self.loads)
-                # self.logger.debug('Recounted error: %.6f -> %.6f' % (previous_error, structure.error))
+        # The next iterations start from the accepted step
+        self.step = step
 
+        self.parameterization.apply(self.original, update, [factor], [index])
+        update.error = best_error
+        self.logger.info('Delta:\t%7.3f \t(original:\t%7.3f, step:\t%.3g)' % (update.error, self.original.error, step))
+
+        return update
+
+    def guess(self):
+        """
+        Returns an array of possible modifications, see _guess_factors()
+
+        :return: list of Structure objects, one per element, with their errors
+        """
+        structures = []
+        for (index, factor, guess_error) in self._guess_factors():
+            structure = deepcopy(self.updated)
+            self.parameterization.apply(self.original, structure, [float(factor)], [index])
+            structure.error = float(guess_error)
             structures.append(structure)
 
         return structures
@@ -381,17 +985,56 @@ class Truss(object):
         """
         Compiles the best updated Structure based on the guesses.
 
-        :param guesses:
+        :param guesses: list of Structure objects, see guess()
+        :return: Structure object
+        """
+        self.logger.debug('Compile')
+        update = deepcopy(min(guesses, key=lambda x: x.error))
+        self.logger.info('Delta:\t%7.3f \t(original:\t%7.3f)' % (update.error, self.original.error))
+
+        return update
+
+    def _guess_factors(self):
+        """
+        Possible modifications without building their structures. Every element's stiffness is scaled on its own
+        within the bounds of the parameters, the trials are evaluated together as rank-one updates of the factorized
+        updated structure.
+
+        :return: [[element ID, stiffness factor, error], ...]
+        """
+        self.logger.debug('Guess')
+        delta = 0.1
+
+        element_number = len(self.updated.element)
+        factor_sets = self.parameterization.stiffness_factors(
+            self.original, self.updated, numpy.array([numpy.full(element_number, 1 - delta),
+                                                      numpy.full(element_number, 1 + delta)]))
+
+        if self.options['workers'] > 1:
+            errors = numpy.vstack(self.parallel_errors(self.updated, list(factor_sets)))
+        else:
+            errors = self.perturbation_evaluator(self.updated).errors(factor_sets)
+
+        # Modification resulted worse result: turn effect backward
+        worse = errors[0] > self.original.error
+        factors = numpy.where(worse, factor_sets[1], factor_sets[0])
+        errors = numpy.where(worse, errors[1], errors[0])
+
+        return [[i, factors[i], errors[i]] for i in range(element_number)]
+
+    def _compile_factors(self, guesses):
+        """
+        Compiles the best updated Structure based on the guessed factors.
+
+        :param guesses: [[element ID, stiffness factor, error], ...], see _guess_factors()
         :return: Structure object
         """
         self.logger.debug('Compile')
-        guess_errors = [x.error for x in guesses]
+        (index, factor, guess_error) = min(guesses, key=lambda x: x[2])
 
-        update = None
+        update = deepcopy(self.updated)
+        self.parameterization.apply(self.original, update, [float(factor)], [index])
+        update.error = float(guess_error)
+        self.logger.info('Delta:\t%7.3f \t(original:\t%7.3f)' % (update.error, self.original.error))
 
-        for index, structure in enumerate(guesses):
-            if structure.error == min(guess_errors):
-                update = deepcopy(structure)
-                self.logger.info('Delta:\t%7.3f \t(original:\t%7.3f)' %
-                                 (update.error, self.original.error))
         return update
@@ -6,9 +6,28 @@ Truss framework created by Máté Szedlák.
 Copyright MIT, Máté Szedlák 2016-2018.
 """
 
+import imageio
+import json
+import multiprocessing
 import pytest
+import socket
 
+from animation import AnimationWriter, GifWriter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from checkpoint import read_checkpoint
+from batch import read_manifest, run_batch, truss_options
+from distributed import Coordinator, parse_address, receive_message, send_message, serve, Worker
+from load_source import LoadFile, LoadSeries
+from pipeline import BoundedQueue, QueueClosed
+from model_file import open_model_file, write_model_file
+from read_input_file import evaluate_expression, load_structure, parse_structure_text, read_structure_file
+from sensor_stream import SensorStream
+from post_processing import element_results, relative_ratios
+from truss_graphics import animate, BackgroundRenderer, plot_structure, post_process, stress_colors, StructureRenderer
 from truss_objects import *
+from parameters import Parameterization
+from updating import Convergence
 
 
 class TestClassInitializations(object):
@@ -62,6 +81,71 @@ class TestClassInitializations(object):
         with pytest.raises(TypeError):
             StructuralData(node_list, [1.0])
 
+    def test_structure_copy_on_write(self, node_list, element_list):
+        """Test whether copies share the topology and copy the parameters only when written"""
+        structure = StructuralData(node_list, element_list)
+        trial = deepcopy(structure)
+
+        assert trial.connectivity is structure.connectivity
+        assert numpy.shares_memory(trial.material, structure.material)
+
+        trial.element[1].material *= 2.0
+
+        assert trial.element[1].material == element_list[1][1] * 2.0
+        assert structure.element[1].material == element_list[1][1]
+        assert not numpy.shares_memory(trial.material, structure.material)
+
+        with pytest.raises(ValueError):
+            structure.material[0] = 1.0
+
+    def test_structure_read_only_lists(self, node_list, element_list):
+        """Test that the list copies of the structure can only be replaced, changes in place would be lost"""
+        structure = StructuralData(node_list, element_list)
+        trial = deepcopy(structure)
+
+        with pytest.raises(TypeError):
+            structure.node[0] = [1.0, 1.0, 1.0]
+        with pytest.raises(TypeError):
+            structure.node[0][0] = 1.0
+        with pytest.raises(TypeError):
+            structure.element[0].connection[1] = 2
+        with pytest.raises(TypeError):
+            structure.element.append(structure.element[0])
+
+        structure.node = [[1.0, 1.0, 1.0]] + node_list[1:]
+        assert structure.node[0] == [1.0, 1.0, 1.0]
+        assert trial.node == node_list
+
+    def test_boundaries_partition(self):
+        """Test DOF partition caching and invalidation"""
+        boundaries = Boundaries([[0, 0.0], [2, 0.0], [5, 0.0]])
+        partition = boundaries.partition(2)
+
+        assert boundaries.partition(2) is partition
+        assert partition.free.tolist() == [1, 3, 4]
+        assert partition.reduced_index.tolist() == [-1, 0, -1, 1, 2, -1]
+        assert partition.dimension == 2
+
+        boundaries.supports = [[0, 0.0]]
+        assert boundaries.partition(2) is not partition
+        assert boundaries.partition(2).free.tolist() == [1, 2, 3, 4, 5]
+        assert boundaries.partition(2).dimension == 3
+
+        with pytest.raises(TypeError):
+            boundaries.supports = [[0, 0]]
+
+    def test_boundaries_supports_copy(self):
+        """Test that changing the given or the returned supports in place keeps the partition valid"""
+        supports = [[0, 0.0]]
+        boundaries = Boundaries(supports)
+        partition = boundaries.partition(2)
+
+        supports.append([1, 0.0])
+        boundaries.supports.append([2, 0.0])
+
+        assert boundaries.supports == [[0, 0.0]]
+        assert boundaries.partition(2) is partition
+
 
 class TestStaticCalculations(object):
     def test_element_length(self, bridge):
@@ -107,6 +191,788 @@ class TestBridgeCalculations(object):
 
     def test_update_is_better(self, bridge):
         """Test first update for bridge"""
-        bridge.start_model_updating(1)
+        bridge.start_model_updating(1, pause=0)
         assert bridge.should_reset() is False
         assert bridge.original.error > bridge.updated.error
+
+
+class TestAssembly(object):
+    """Test the array based, sparse and incremental stiffness matrices"""
+    def test_vectorized_assembly(self, bridge, bridge_stiffness_matrix):
+        """Test the array based assembly against the reference stiffness matrix"""
+        stiffness_matrix = assemble_stiffness_matrix(*structure_arrays(bridge.original))
+
+        assert stiffness_matrix.shape == (len(bridge.original.node) * 3, len(bridge.original.node) * 3)
+        assert numpy.array_equal(stiffness_matrix, numpy.array(bridge_stiffness_matrix))
+
+    def test_sparse_assembly(self, bridge, bridge_stiffness_matrix):
+        """Test the sparse assembly against the reference stiffness matrix"""
+        stiffness_matrix = assemble_sparse_stiffness_matrix(*structure_arrays(bridge.original))
+
+        assert numpy.allclose(stiffness_matrix.toarray(), numpy.array(bridge_stiffness_matrix))
+
+    @pytest.mark.parametrize('sparse_format', [False, True])
+    def test_incremental_stiffness_matrix(self, bridge, sparse_format):
+        """Test block updates of the stiffness matrix against full assembly"""
+        free_dofs = bridge.free_dofs(bridge.original)
+        structure = deepcopy(bridge.original)
+        structure.element[3].material = 2500.0
+        structure.element[7].section = 50.0
+        reference = reduce_matrix(assemble_stiffness_matrix(*structure_arrays(structure)), free_dofs)
+
+        stiffness = StiffnessMatrix(*structure_arrays(bridge.original), free_dofs=free_dofs,
+                                    sparse_format=sparse_format)
+        stiffness.set_material(3, 2500.0)
+        stiffness.set_section(7, 50.0)
+        matrix = stiffness.matrix.toarray() if sparse_format else stiffness.matrix
+
+        assert numpy.allclose(matrix, reference)
+
+        stiffness.update(bridge.original.material, bridge.original.section)
+        matrix = stiffness.matrix.toarray() if sparse_format else stiffness.matrix
+
+        assert numpy.allclose(matrix, reduce_matrix(assemble_stiffness_matrix(*structure_arrays(bridge.original)),
+                                                    free_dofs))
+
+
+class TestSolver(object):
+    """Test the linear solvers and the reuse of factorizations"""
+    def test_sparse_solver(self, make_bridge):
+        """Test whether the sparse solver gives the same deformations as the dense one"""
+        bridge = make_bridge()
+        sparse_bridge = make_bridge(solver='sparse')
+        deformed = bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+        sparse_deformed = sparse_bridge.solve(sparse_bridge.original, sparse_bridge.boundaries, bridge.loads)
+
+        assert numpy.allclose(deformed.node, sparse_deformed.node)
+
+    def test_factorization_cache(self, make_bridge):
+        """Test whether an unchanged structure is factorized only once for different loads"""
+        bridge = make_bridge()
+        bridge.solve(bridge.original, bridge.boundaries, Loads({'forces': [[25, -9.8]]}))
+        deformed = bridge.solve(bridge.original, bridge.boundaries, Loads({'forces': [[25, -19.6]]}))
+
+        assert bridge.factorizations.misses == 1
+        assert bridge.factorizations.hits == 1
+
+        bridge.factorizations.clear()
+        reference = bridge.solve(bridge.original, bridge.boundaries, Loads({'forces': [[25, -19.6]]}))
+        assert numpy.allclose(deformed.node, reference.node)
+
+
+class TestSensitivity(object):
+    """Test rank-one trials and adjoint gradients"""
+    def test_rank_one_evaluator(self, make_bridge):
+        """Test rank-one trials against full solves of the modified structure"""
+        bridge = make_bridge(measurements=['11Y', '5X'])
+        bridge.measurement.displacements = [[34, -5.0], [15, 0.1]]
+        evaluator = bridge.perturbation_evaluator(bridge.original)
+
+        factors = numpy.linspace(0.5, 1.5, len(bridge.original.element))
+        errors = evaluator.errors(factors)
+
+        for index in [0, 7, len(factors) - 1]:
+            structure = deepcopy(bridge.original)
+            structure.element[index].material *= float(factors[index])
+            deformed = bridge.solve(structure, bridge.boundaries, bridge.loads, cache=False)
+
+            assert errors[index] == pytest.approx(structure.error)
+            assert numpy.allclose(evaluator.displacements(index, factors[index]),
+                                  (numpy.array(deformed.node) - numpy.array(structure.node)).ravel())
+
+    def test_batched_trials(self, make_bridge):
+        """Test that several trials per element are evaluated on the same back-substitutions"""
+        bridge = make_bridge()
+        bridge.measurement.update(bridge.loads, title=bridge.title)
+        evaluator = bridge.perturbation_evaluator(bridge.original)
+        factor_sets = numpy.array([numpy.full(len(bridge.original.element), x) for x in [0.9, 1.1, 1.3]])
+
+        assert numpy.allclose(evaluator.errors(factor_sets), [evaluator.errors(x) for x in factor_sets])
+
+    def test_adjoint_sensitivity(self, make_bridge):
+        """Test adjoint gradient and Jacobian against finite differences"""
+        bridge = make_bridge(measurements=['11Y', '5X'])
+        bridge.measurement.displacements = [[34, -5.0], [15, 0.1]]
+        sensitivity = bridge.sensitivity(bridge.original)
+        gradient = sensitivity.gradient()
+
+        assert numpy.allclose(gradient, sensitivity.jacobian().T.dot(sensitivity.residual) / sensitivity.error)
+
+        for index in [0, 12]:
+            step = bridge.original.element[index].material * 1e-6
+            structure = deepcopy(bridge.original)
+            structure.element[index].material += step
+            bridge.solve(structure, bridge.boundaries, bridge.loads, cache=False)
+            difference = (structure.error - sensitivity.error) / step
+
+            assert gradient[index] == pytest.approx(difference, rel=1e-3)
+
+
+class TestUpdatingMethods(object):
+    """Test the guess, gradient and adaptive updating methods"""
+    def test_gradient_update_is_better(self, make_bridge):
+        """Test first gradient based update for bridge"""
+        bridge = make_bridge(method='gradient')
+        bridge.start_model_updating(1, pause=0)
+        assert bridge.original.error > bridge.updated.error
+
+    def test_parallel_guess(self, make_bridge):
+        """Test whether the worker pool gives the same guesses as the serial evaluation"""
+        bridge = make_bridge(workers=2)
+        bridge.measurement.displacements = [[34, -5.0]]
+        bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+        try:
+            parallel_guesses = bridge.guess()
+        finally:
+            bridge.pool.close()
+
+        bridge.options['workers'] = 1
+        serial_guesses = bridge.guess()
+
+        assert numpy.allclose([x.error for x in parallel_guesses], [x.error for x in serial_guesses])
+        assert numpy.allclose([x.material for x in parallel_guesses], [x.material for x in serial_guesses])
+
+    def test_compile_guesses(self, make_bridge):
+        """Test whether the guessed structures compile to the update of the guess method"""
+        bridge = make_bridge()
+        bridge.measurement.displacements = [[34, -5.0]]
+        bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+        compiled = bridge.compile(bridge.guess())
+
+        assert numpy.allclose(compiled.material, bridge.update().material)
+        assert compiled.error == pytest.approx(bridge.update().error)
+
+    def test_interrupted_updating(self, make_bridge):
+        """Test that a failing updating still releases the worker pool"""
+        bridge = make_bridge(workers=2)
+        bridge.measurement.displacements = [[34, -5.0]]
+        bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+        bridge.guess()
+        pool = bridge.pool
+
+        def interrupt(counter):
+            raise KeyboardInterrupt
+
+        bridge.iterate = interrupt
+        with pytest.raises(KeyboardInterrupt):
+            bridge.start_model_updating(1, pause=0)
+
+        assert bridge.pool is None
+        with pytest.raises(ValueError):
+            pool.pool.apply(len, ([], ))
+
+    def test_convergence(self):
+        """Test the stall count and the step size limit"""
+        convergence = Convergence(error_tolerance=0.01, parameter_tolerance=0.001, stall_limit=2, min_step=0.01)
+        assert convergence.check(10.0, 9.0, 0.1) is False
+        assert convergence.check(9.0, 8.99, 0.1) is False and convergence.stalls == 1
+        assert convergence.check(8.99, 8.0, 0.1) is False and convergence.stalls == 0
+        assert convergence.check(8.0, 7.0, 0.0001) is False
+        assert convergence.check(7.0, 7.0, 0.0) is True
+        assert 'no progress' in convergence.reason
+
+        convergence.reset()
+        assert convergence.check(10.0, 9.0, 0.1, step=0.005) is True
+        assert 'step size' in convergence.reason
+
+    def test_adaptive_update(self, make_bridge):
+        """Test that the adaptive method stops when the error does not decrease any more"""
+        bridge = make_bridge(method='adaptive')
+        iterations = bridge.start_model_updating(300, pause=0)
+
+        assert bridge.converged and iterations < 300
+        errors = [x[1] for x in bridge.history]
+        assert all(later <= earlier + 1e-9 for (earlier, later) in zip(errors, errors[1:]))
+        assert bridge.updated.error < 0.01 * bridge.original.error
+
+    def test_adaptive_line_search(self, make_bridge):
+        """Test that a single element step is doubled when it decreases the error further"""
+        bridge = make_bridge(method='adaptive')
+        bridge.measurement.update(bridge.loads, title=bridge.title)
+        bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+        bridge.solve(bridge.updated, bridge.boundaries, bridge.loads)
+        update = bridge.adaptive_update()
+
+        assert bridge.step > 0.1
+        assert parameter_change(bridge.updated, update) == pytest.approx(bridge.step)
+
+
+class TestParameterization(object):
+    """Test the material and cross-section parameterizations"""
+    def test_bounded_split(self, bridge):
+        """Test that EA factors are split between the bounded material and section"""
+        parameterization = Parameterization('EA', material_bounds=(0.8, 1.2), section_bounds=(0.5, 1.5))
+        (material, section) = parameterization.split(bridge.original, deepcopy(bridge.original),
+                                                     [[0.9, 1.5, 2.0, 0.1]], [0, 1, 2, 3])
+
+        assert numpy.allclose(material, [[0.9 ** 0.5, 1.2, 1.2, 0.8]])
+        assert numpy.allclose(material * section, [[0.9, 1.5, 1.8, 0.4]])
+
+    def test_unbounded_split(self, bridge):
+        """Test that without bounds both parameters change"""
+        (material, section) = Parameterization('EA').split(bridge.original, deepcopy(bridge.original),
+                                                           [[0.25, 4.0]], [0, 1])
+        assert numpy.allclose(material, [[0.5, 2.0]]) and numpy.allclose(section, [[0.5, 2.0]])
+
+        structure = deepcopy(bridge.original)
+        Parameterization('EA').apply(bridge.original, structure, [4.0], [5])
+        assert structure.section[5] == pytest.approx(2.0 * bridge.original.section[5])
+        assert structure.material[5] == pytest.approx(2.0 * bridge.original.material[5])
+
+    def test_bounded_apply(self, bridge):
+        """Test that the applied parameters stay within their bounds"""
+        parameterization = Parameterization('EA', material_bounds=(0.8, 1.2), section_bounds=(0.5, 1.5))
+        structure = deepcopy(bridge.original)
+        parameterization.apply(bridge.original, structure, [2.0], [2])
+
+        assert structure.material[2] == pytest.approx(1.2 * bridge.original.material[2])
+        assert structure.section[2] == pytest.approx(1.5 * bridge.original.section[2])
+        assert numpy.allclose(parameterization.stiffness_factors(bridge.original, structure, [2.0], [2]), 1.0)
+
+        with pytest.raises(ValueError):
+            Parameterization('E', material_bounds=(1.1, 2.0))
+
+    def test_section_updating(self, make_bridge):
+        """Test that only E*A is identified: updating E, A or EA gives the same errors and stiffnesses"""
+        runs = {}
+        for (name, parameterization) in [('E', Parameterization('E')), ('A', Parameterization('A')),
+                                         ('EA', Parameterization('EA', material_bounds=(0.95, 1.05)))]:
+            truss = make_bridge(name, parameterization=parameterization)
+            truss.start_model_updating(5, pause=0)
+            runs[name] = truss
+
+        assert numpy.allclose(runs['A'].updated.material, runs['A'].original.material)
+        assert numpy.allclose(runs['E'].updated.section, runs['E'].original.section)
+        assert not numpy.allclose(runs['EA'].updated.section, runs['EA'].original.section)
+        assert runs['EA'].updated.material.max() <= 1.05 * runs['EA'].original.material.max()
+
+        for name in ['A', 'EA']:
+            assert numpy.allclose(runs[name].history, runs['E'].history)
+            assert numpy.allclose(runs[name].updated.material * runs[name].updated.section,
+                                  runs['E'].updated.material * runs['E'].updated.section)
+
+
+class TestInstrumentation(object):
+    """Test the per-iteration statistics"""
+    def test_iteration_records(self, make_bridge, tmpdir):
+        """Test per-iteration statistics export"""
+        bridge = make_bridge()
+        bridge.stats = Instrumentation(enabled=True, label='bridge', jsonl_file=str(tmpdir.join('stats.jsonl')),
+                                       prometheus_file=str(tmpdir.join('stats.prom')))
+        counter = {'total': 0, 'loop': 0}
+        bridge.iterate(counter)
+        bridge.iterate(counter)
+
+        records = [json.loads(x) for x in tmpdir.join('stats.jsonl').readlines()]
+        assert [x['iteration'] for x in records] == [1, 2]
+        assert records[0]['calls']['measurement'] == 1
+        assert records[1]['counters']['solves'] == 2
+        assert records[0]['counters']['factorizations'] == 1
+        assert 'truss_iterations_total{structure="bridge"} 2' in tmpdir.join('stats.prom').read()
+
+    def test_flush(self, tmpdir):
+        """Test that phases after the last iteration are exported once"""
+        stats = Instrumentation(enabled=True, label='bridge', jsonl_file=str(tmpdir.join('stats.jsonl')),
+                                prometheus_file=str(tmpdir.join('stats.prom')))
+        stats.end_iteration(error=1.0)
+        with stats.timer('animate'):
+            pass
+
+        assert stats.flush()['calls'] == {'animate': 1}
+        assert stats.flush() is None
+        assert len(tmpdir.join('stats.jsonl').readlines()) == 2
+        assert 'phase="animate"' in tmpdir.join('stats.prom').read()
+        assert 'truss_error{structure="bridge"}' in tmpdir.join('stats.prom').read()
+
+    def test_updating_statistics(self, make_bridge, tmpdir):
+        """Test that the final checkpoint of the model updating is exported"""
+        bridge = make_bridge(stats=True, checkpoint_every=5)
+        bridge.start_model_updating(2, pause=0)
+
+        records = [json.loads(x) for x in tmpdir.join('logs', 'bridge.stats.jsonl').readlines()]
+        assert [x['iteration'] for x in records] == [1, 2, 2]
+        assert records[-1]['final'] and records[-1]['calls'] == {'checkpoint': 1}
+
+    def test_disabled(self):
+        """Test that disabled statistics share a no-op timer"""
+        assert Instrumentation().timer('solve') is Instrumentation().timer('guess')
+
+
+class TestSensorStream(object):
+    """Test asynchronous sensor frames"""
+    def test_sensor_stream(self, tmpdir):
+        """Test asynchronous frame ingestion from a FIFO"""
+        fifo = str(tmpdir.join('sensor'))
+        os.mkfifo(fifo)
+        stream = SensorStream(2, fifo).start()
+        try:
+            with open(fifo, 'wb', buffering=0) as writer:
+                writer.write(b'1.0 0.5 -0.5\n2.0 0.25\n3.0 1.5 ')
+                assert stream.wait_snapshot().values == (0.5, -0.5)
+
+                writer.write(b'-1.5\n')
+                for _ in range(100):
+                    if stream.snapshot().sequence == 1:
+                        break
+                    time.sleep(0.01)
+
+            assert stream.snapshot().values == (1.5, -1.5)
+            assert stream.snapshot().timestamp == 3.0
+            assert stream.dropped == 1
+        finally:
+            stream.stop()
+
+        measurement = ArduinoMeasurements(['1X', '2Y'], stream=stream)
+        measurement.update(Loads({}), title='bridge')
+        assert measurement.initial_measurements == [1.5, -1.5]
+        assert measurement.displacements == [[3, 0.0], [7, 0.0]]
+
+
+class TestPipeline(object):
+    """Test the pipelined model updating"""
+    def test_bounded_queue(self):
+        """Test bounded queue policies"""
+        queue = BoundedQueue(2, 'drop-oldest')
+        for i in range(3):
+            queue.put(i)
+        queue.close()
+        assert queue.dropped == 1
+        assert [queue.get(), queue.get()] == [1, 2]
+        with pytest.raises(QueueClosed):
+            queue.get()
+
+        with pytest.raises(ValueError):
+            BoundedQueue(2, 'drop-newest')
+
+    def test_pipelined_updating(self, make_bridge):
+        """Test that the pipelined updating gives the same results as the serial one"""
+        serial = make_bridge('serial')
+        serial.start_model_updating(3, pause=0)
+        pipelined = make_bridge('pipelined')
+        pipelined.start_pipelined_updating(3, acquisition_policy='block', sample_interval=0)
+
+        assert pipelined.updated.error == pytest.approx(serial.updated.error)
+        assert pipelined.updated.material.tolist() == pytest.approx(serial.updated.material.tolist())
+
+    def test_on_screen_graphics(self, make_bridge):
+        """Test that on-screen figures, drawn only by the main thread, are rejected before any renderer is used"""
+        bridge = make_bridge()
+        bridge.options['graphics'] = True
+        with pytest.raises(ValueError):
+            bridge.start_pipelined_updating(1)
+
+
+class TestLoadSource(object):
+    """Test load files and replayed load series"""
+    def test_load_file(self, tmpdir):
+        """Test that the load file is parsed only when it changes"""
+        path = str(tmpdir.join('loads.txt'))
+        with open(path, 'w') as target:
+            target.write('25 -9.8\n')
+
+        source = LoadFile(path)
+        assert source.forces() == [[25, -9.8]]
+        assert source.forces() == [[25, -9.8]]
+        assert source.parses == 1
+
+        with open(path, 'w') as target:
+            target.write('# changed\n25 -19.6 31 -4.9\n')
+        assert source.forces() == [[25, -19.6], [31, -4.9]]
+        assert source.parses == 2
+
+    def test_load_series(self, tmpdir):
+        """Test that the last sample of a replayed series is kept"""
+        path = str(tmpdir.join('loads.txt'))
+        with open(path, 'w') as target:
+            target.write('0.0 25 -9.8\n\n1.0 25 -14.7\n2.0 25 -19.6\n')
+
+        series = LoadSeries(path)
+        assert [series.forces()[0][1] for _ in range(2)] == [-9.8, -14.7]
+        assert series.finished is False
+        assert series.forces() == [[25, -19.6]] and series.timestamp == 2.0
+        assert series.finished is True
+        assert series.forces() == [[25, -19.6]]
+
+    def test_load_series_updating(self, make_bridge, load_series):
+        """Test that the model updating stops at the end of the load series"""
+        bridge = make_bridge(load_series=load_series)
+        bridge.start_model_updating(10, pause=0)
+
+        assert bridge.measurement.load_source.records == 6
+        assert bridge.loads.forces == [[25, -29.4]]
+
+
+class TestInputFiles(object):
+    """Test the structure input files"""
+    def test_evaluate_expression(self):
+        """Test safe expression evaluation"""
+        assert evaluate_expression('5.0*(10**(-4))') == pytest.approx(0.0005)
+        assert evaluate_expression('-(3 + 1) / 2') == -2.0
+        for expression in ['__import__("os").getcwd()', '[1]', '10**10**10', '1/0']:
+            with pytest.raises(ValueError):
+                evaluate_expression(expression)
+
+    def test_structure_parser(self):
+        """Test parsing the structure text into arrays"""
+        arrays = parse_structure_text('ELEMENTS\n0, 1|1; 2|\nCOORDINATES\n0, 0|1, 1|2, 0|\nMATERIALS\n2*10**3, 1800\n'
+                                      'CROSS-SECTIONS\n36; 6**2\nSUPPORTS\n0, 0.0|1, 0.0|\nEOF')
+        assert arrays['connectivity'].tolist() == [[0, 1], [1, 2]]
+        assert arrays['coordinates'][:, 2].tolist() == [0.0, 0.0, 0.0]
+        assert arrays['material'].tolist() == [2000.0, 1800.0]
+        assert arrays['section'].tolist() == [36.0, 36.0]
+        assert arrays['supports'][:, 0].tolist() == [0, 1, 2, 5, 8]
+
+        with pytest.raises(Exception):
+            parse_structure_text('ELEMENTS\n0, 1|\nEOF')
+
+    def test_structure_cache(self, tmpdir):
+        """Test the compiled structure cache"""
+        with tmpdir.as_cwd():
+            os.makedirs('structures')
+            with open('structures/bar.str', 'w') as target:
+                target.write('ELEMENTS\n0,1|\nCOORDINATES\n0,0,0|1,0,0|\nCROSS-SECTIONS\n1\nMATERIALS\n2\n'
+                             'SUPPORTS\n0, 0.0|\n')
+            parsed = read_structure_file('bar.str')
+            assert len(os.listdir('structures/.cache')) == 1
+            assert read_structure_file('bar.str') == parsed == read_structure_file('bar.str', cache=False)
+            assert parsed[1] == [[[0, 1], 2.0, 1.0]]
+
+            with open('structures/bar.str', 'a') as target:
+                target.write('MATERIALS\n3\n')
+            assert read_structure_file('bar.str')[1] == [[[0, 1], 3.0, 1.0]]
+            assert len(os.listdir('structures/.cache')) == 1
+
+    def test_model_file(self, tmpdir):
+        """Test the memory-mapped binary structure format"""
+        arrays = load_structure('bridge.str')
+        path = str(tmpdir.join('bridge.trb'))
+        write_model_file(path, arrays)
+
+        mapped = open_model_file(path)
+        for name in arrays:
+            assert numpy.array_equal(mapped[name], arrays[name])
+            assert mapped[name].flags.writeable is False
+
+        structure = StructuralData.from_arrays(mapped['coordinates'], mapped['connectivity'], mapped['material'],
+                                               mapped['section'], copy_parameters=False)
+        assert numpy.shares_memory(structure.material, mapped['material'])
+        structure.set_material(0, 1.0)
+        assert structure.material[0] == 1.0
+        assert open_model_file(path)['material'][0] == arrays['material'][0]
+
+        with open(path, 'r+b') as target:
+            target.write(b'NOTTRUSS')
+        with pytest.raises(ValueError):
+            open_model_file(path)
+
+
+class TestPostProcessing(object):
+    """Test member strains, forces and stresses"""
+    def test_element_results(self):
+        """Test vectorized member strains, forces and stresses"""
+        rod = StructuralData([[0.0, 0.0, 0.0], [3.0, 4.0, 0.0]], [[[0, 1], 200.0, 2.0]])
+        stretched = rod.copy()
+        stretched.node = [[0.0, 0.0, 0.0], [3.0 * 1.001, 4.0 * 1.001, 0.0]]
+
+        results = element_results(rod, stretched, allowable_stress=0.4)
+        assert results['strain'].tolist() == pytest.approx([0.001])
+        assert results['stress'].tolist() == pytest.approx([0.2])
+        assert results['force'].tolist() == pytest.approx([0.4])
+        assert results['utilization'].tolist() == pytest.approx([0.5])
+
+    def test_bridge_results(self, make_bridge):
+        """Test the member forces against the element by element reference of the former post-processing"""
+        bridge = make_bridge()
+        bridge.measurement.update(bridge.loads, title='bridge')
+        deformed = bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+        results = element_results(bridge.original, deformed)
+
+        reference = [-(element_length(deformed, i) - element_length(bridge.original, i)) /
+                     element_length(bridge.original, i) * bridge.original.element[i].material *
+                     bridge.original.element[i].section for i in range(len(bridge.original.element))]
+        assert (-results['force']).tolist() == pytest.approx(reference, rel=1e-6)
+        assert results['utilization'].max() == 1.0
+
+        bridge.iterate({'total': 0, 'loop': 0})
+        assert len(bridge.member_results['stress']) == len(bridge.original.element)
+
+    def test_relative_ratios(self):
+        """Test ratios relative to the largest magnitude"""
+        assert relative_ratios([2.0, -1.0, -4.0, 0.0]).tolist() == [1.0, -0.25, -1.0, 0.0]
+        assert relative_ratios([-2.0, 0.0]).tolist() == [0.0, 0.0]
+
+
+class TestGraphics(object):
+    """Test the offscreen renderers and the animation output"""
+    def test_stress_colors(self, make_bridge):
+        """Test the colors of the former post-processing"""
+        bridge = make_bridge()
+        bridge.measurement.update(bridge.loads, title='bridge')
+        deformed = bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+
+        reference = post_process(bridge.original, deformed)
+        assert numpy.allclose(stress_colors(reference['stress']),
+                              [[x, 0.3, 0] if x > 0 else [0, 0.3, abs(x)] for x in reference['ratio']])
+
+    def test_structure_renderer(self, make_bridge, tmpdir):
+        """Test the incremental offscreen renderer"""
+        bridge = make_bridge('model')
+        deformed = bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+
+        with tmpdir.as_cwd():
+            os.makedirs('results')
+            renderer = StructureRenderer(dof=bridge.dof(), title='bridge', every=2)
+            drawn = [renderer.draw(bridge.original, deformed, counter={'total': i}) for i in range(4)]
+            collection = renderer.collection
+            assert renderer.draw(bridge.original, counter={'total': 4}) is True
+            assert renderer.collection is collection
+
+            assert drawn == [True, False, True, False]
+            assert (renderer.frames, renderer.skipped) == (3, 2)
+            assert sorted(os.listdir('results')) == ['bridge - 0.png', 'bridge - 2.png', 'bridge - 4.png']
+
+    def test_gif_writer(self, tmpdir):
+        """Test streaming GIF output"""
+        frames = [numpy.full((24, 32, 3), 60 * i, dtype=numpy.uint8) for i in range(3)]
+        frames[1][:12] = [255, 0, 0]
+
+        path = str(tmpdir.join('test.gif'))
+        writer = GifWriter(path, duration=0.5)
+        for frame in frames:
+            writer.append_data(frame)
+        writer.close()
+
+        written = imageio.mimread(path)
+        assert len(written) == 3
+        for (frame, image) in zip(frames, written):
+            assert numpy.array_equal(image[:, :, :3], frame)
+
+        with pytest.raises(ValueError):
+            writer = GifWriter(str(tmpdir.join('size.gif')))
+            writer.append_data(frames[0])
+            writer.append_data(frames[0][:10])
+
+        # The file is created by the first frame
+        GifWriter(str(tmpdir.join('empty.gif'))).close()
+        assert not tmpdir.join('empty.gif').exists()
+
+    def test_animation_writer(self, make_bridge, tmpdir):
+        """Test the renderer writing into an animation without saving the frames"""
+        bridge = make_bridge('model')
+        with tmpdir.as_cwd():
+            os.makedirs('results')
+            renderer = StructureRenderer(title='bridge', sink=AnimationWriter('results/bridge.gif'),
+                                         save_frames=False)
+            for i in range(2):
+                renderer.draw(bridge.original, counter={'total': i})
+            renderer.close()
+
+            assert os.listdir('results') == ['bridge.gif']
+            assert len(imageio.mimread('results/bridge.gif')) == 2
+
+    def test_plot_structure(self, make_bridge, tmpdir):
+        """Test the figure and GIF helpers over the renderer"""
+        bridge = make_bridge()
+        deformed = bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        with tmpdir.as_cwd():
+            for i in range(2):
+                plot_structure(fig, ax, bridge.original, deformed, counter={'total': i}, title='bridge',
+                               node_number=True)
+            animate('bridge', 3)
+
+            assert sorted(os.listdir('results')) == ['bridge - 0.png', 'bridge - 1.png', 'bridge.gif']
+            assert len(imageio.mimread('results/bridge.gif')) == 2
+
+    def test_background_renderer(self, make_bridge, tmpdir):
+        """Test rendering in a separate process"""
+        bridge = make_bridge('model')
+        bridge.measurement.update(bridge.loads, title='bridge')
+        deformed = bridge.solve(bridge.original, bridge.boundaries, bridge.loads)
+
+        with tmpdir.as_cwd():
+            os.makedirs('results')
+            renderer = BackgroundRenderer(bridge.original.connectivity, dof=bridge.dof(), title='bridge', every=2,
+                                          animation='results/bridge.gif', save_frames=True, size=1)
+            sent = [renderer.draw(bridge.original, deformed, counter={'total': i}) for i in range(20)]
+            renderer.close()
+
+            assert renderer.skipped == 10
+            assert renderer.submitted + renderer.dropped == 10
+            assert sent.count(True) == renderer.submitted
+
+            frames = sorted(os.listdir('results'))
+            assert 'bridge - 18.png' in frames
+            assert len(imageio.mimread('results/bridge.gif')) == len(frames) - 1
+
+    def test_background_renderer_failure(self, make_bridge, tmpdir):
+        """Test that a failed render process is reported instead of waited for"""
+        bridge = make_bridge()
+
+        renderer = BackgroundRenderer(bridge.original.connectivity, dof=bridge.dof(), title='bridge', size=1,
+                                      animation=str(tmpdir.join('missing', 'bridge.gif')))
+        for i in range(5):
+            renderer.draw(bridge.original, counter={'total': i})
+
+        with pytest.raises(RuntimeError):
+            renderer.close()
+
+
+class TestBatch(object):
+    """Test batch jobs"""
+    @pytest.fixture()
+    def jobs(self, tmpdir):
+        manifest = str(tmpdir.join('jobs.json'))
+        with open(manifest, 'w') as target:
+            json.dump([{'structure': 'bridge', 'measurements': ['11Y'], 'iterations': 2, 'stats': True},
+                       {'structure': 'bridge.str', 'iterations': 1, 'solver': 'sparse'},
+                       {'structure': 'missing.str'},
+                       {'structure': 'bridge', 'measurements': ['11Y'], 'iterations': 2, 'parameters': 'A',
+                        'section_bounds': [1, 1]}], target)
+
+        return read_manifest(manifest, measurements=['13X'], iterations=3,
+                             defaults={'parameters': 'E', 'stall_limit': 5})
+
+    def test_read_manifest(self, jobs):
+        """Test the job defaults of the manifest"""
+        assert [x['title'] for x in jobs] == ['bridge', 'bridge', 'missing', 'bridge']
+        assert jobs[1]['measurements'] == ['13X'] and jobs[2]['iterations'] == 3
+        assert jobs[0]['parameters'] == 'E' and jobs[3]['parameters'] == 'A' and jobs[1]['stall_limit'] == 5
+        assert 'rod.str' in [x['structure'] for x in read_manifest('./structures', ['3X'])]
+
+    def test_truss_options(self, jobs):
+        """Test the Truss options built from a job"""
+        options = truss_options(dict(jobs[0], method='adaptive', parameters='EA', tolerance=0.5))
+        assert options['headless'] and options['method'] == 'adaptive'
+        assert options['parameterization'].parameters == 'EA'
+        assert options['convergence'].error_tolerance == 0.5 and options['convergence'].stall_limit == 5
+        assert 'convergence' not in truss_options({'method': 'guess'})
+
+    def test_run_batch(self, jobs, tmpdir):
+        """Test batch jobs with isolated outputs and a common summary"""
+        output = str(tmpdir.join('batch'))
+        summaries = run_batch(jobs, workers=2, output_dir=output)
+
+        assert [x['status'] for x in summaries] == ['ok', 'ok', 'failed', 'ok']
+        assert [x['iterations'] for x in summaries[:2]] == [2, 1]
+
+        # Fixed cross-sectional areas: nothing to update
+        assert summaries[3]['updated_error'] == pytest.approx(summaries[3]['original_error'])
+        assert summaries[0]['output_dir'] != summaries[1]['output_dir']
+        assert os.path.exists(os.path.join(summaries[0]['output_dir'], 'logs', 'bridge.stats.jsonl'))
+        assert os.path.exists(os.path.join(summaries[2]['output_dir'], 'error.txt'))
+
+        with open(os.path.join(output, 'summary.json')) as source:
+            assert json.load(source)['jobs'] == summaries
+
+
+class TestDistributed(object):
+    """Test the coordinator and its workers"""
+    job = {'structure': 'bridge.str', 'title': 'bridge', 'measurements': ['11Y'], 'iterations': 2, 'stats': True}
+
+    def test_distributed(self, tmpdir):
+        """Test coordinator and local worker processes, including a lost worker"""
+        jobs = [dict(self.job) for _ in range(3)] + [dict(self.job, structure='missing.str', title='missing')]
+        coordinator = Coordinator('tcp://127.0.0.1:0', jobs).start()
+        assert parse_address(coordinator.address)[1][1] > 0
+
+        # Worker lost while running its job
+        lost = socket.create_connection(parse_address(coordinator.address)[1])
+        with lost.makefile('rb') as reader, lost.makefile('wb') as writer:
+            send_message(writer, {'type': 'ready', 'worker': 'lost'})
+            assert receive_message(reader)['id'] == 0
+        lost.close()
+
+        workers = [multiprocessing.Process(target=serve, args=(coordinator.address, 'worker-%i' % i,
+                                                               str(tmpdir.join('worker-%i' % i))))
+                   for i in range(2)]
+        for worker in workers:
+            worker.start()
+
+        results = coordinator.wait(timeout=120)
+        coordinator.close()
+        for worker in workers:
+            worker.join(10)
+            assert worker.exitcode == 0
+
+        assert [x['status'] for x in results] == ['ok', 'ok', 'ok', 'failed']
+        assert coordinator.attempts[0] == 2
+        assert any(x['warm'] for x in results[:3])
+        assert set(x['worker'] for x in results) <= {'worker-0', 'worker-1'}
+
+        # Same jobs, same result: the warm models restart from the original structure
+        for result in results[:3]:
+            assert len(result['history']) == 2
+            assert numpy.allclose(result['material'], results[0]['material'])
+            assert numpy.allclose(result['history'], results[0]['history'])
+
+        # Every job writes into its own folder, warm ones too
+        assert len(set(x['output_dir'] for x in results[:3])) == 3
+        for result in results[:3]:
+            assert os.path.exists(os.path.join(result['output_dir'], 'logs', 'bridge.stats.jsonl'))
+
+    def test_failed_job_model(self, tmpdir):
+        """Test that the model of a failed job is dropped"""
+        worker = Worker(output_dir=str(tmpdir))
+        try:
+            assert worker.run_job(dict(self.job, output_dir='first'))['status'] == 'ok'
+            assert worker.run_job(dict(self.job, measurements=['999Y'], output_dir='failed'))['status'] == 'failed'
+            assert not worker.models
+            assert worker.run_job(dict(self.job, output_dir='second'))['warm'] is False
+        finally:
+            worker.close()
+
+
+class TestCheckpoint(object):
+    """Test resuming the model updating from checkpoints"""
+    def test_resume(self, make_bridge, load_series):
+        """Test that a resumed run continues like an uninterrupted one"""
+        full = make_bridge('full', load_series=load_series)
+        assert full.start_model_updating(0, pause=0) == 6
+
+        first = make_bridge('resumed', load_series=load_series, checkpoint_every=2)
+        assert first.start_model_updating(3, pause=0) == 3
+        assert os.path.exists(first.checkpoint_file)
+
+        second = make_bridge('resumed', load_series=load_series, checkpoint_every=2)
+        assert second.start_model_updating(0, pause=0, resume=True) == 6
+
+        assert second.measurement.load_source.records == 6
+        assert numpy.allclose(second.history, full.history)
+        assert numpy.allclose(second.updated.material, full.updated.material)
+        assert second.updated.error == pytest.approx(full.updated.error)
+
+    def test_other_structure(self, make_bridge, tmpdir):
+        """Test that the checkpoint of an other structure is rejected"""
+        make_bridge(checkpoint_every=1).start_model_updating(1, pause=0)
+
+        with pytest.raises(ValueError):
+            Truss('3d_truss.str', 'bridge', ['11Y'], output_dir=str(tmpdir)).resume()
+
+    def test_pipelined_records(self, make_bridge, load_series):
+        """Test that only the records of the solved samples are passed, the pipeline reads ahead"""
+        pipelined = make_bridge(load_series=load_series, checkpoint_every=1)
+        pipelined.start_pipelined_updating(2, acquisition_policy='block', sample_interval=0)
+
+        assert read_checkpoint(pipelined.checkpoint_file)['records'] == 2
+
+    def test_adaptive_previous(self, make_bridge, load_series):
+        """Test that the adaptive method keeps the structure before the last update for its back-offs"""
+        options = {'load_series': load_series, 'method': 'adaptive', 'checkpoint_every': 1}
+        full = make_bridge('full', **options)
+        full.start_model_updating(6, pause=0)
+
+        first = make_bridge('resumed', **options)
+        first.start_model_updating(3, pause=0)
+        assert numpy.allclose(read_checkpoint(first.checkpoint_file)['previous']['material'], first.previous.material)
+
+        second = make_bridge('resumed', **options)
+        second.resume()
+        assert numpy.allclose(second.previous.material, first.previous.material)
+        assert second.previous.error == first.previous.error
+
+        second.start_model_updating(6, pause=0, resume=True)
+        assert numpy.allclose(second.history, full.history)
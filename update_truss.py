@@ -6,8 +6,14 @@ Created on September 1 15:38 2018
 Copyright MIT, Máté Szedlák 2016-2018.
 """
 
+from batch import read_manifest, run_batch, write_summary
+from distributed import Coordinator, serve
+from logger import start_logging
+from parameters import Parameterization
 from truss_objects import Truss
+from updating import Convergence
 import argparse
+import time
 
 
 # Setup console run
@@ -17,10 +23,10 @@ if __name__ == '__main__':
                         help="Manually label project. By default it comes from the input file's name.", default='')
 
     parser.add_argument("-s", "--structure", metavar='str', type=str, default="",
-                        help="Input file, stored in the ./Structure folder [*.str]", required=True)
+                        help="Input file, stored in the ./Structure folder [*.str or binary *.trb]", required=False)
 
     parser.add_argument('-m', '--measurements', nargs='+',
-                        help='Enlist the measured nodes like: 12X 14Z', required=True)
+                        help='Enlist the measured nodes like: 12X 14Z', required=False)
 
     parser.add_argument('-i', '--iteration', metavar='int', type=int, default=10,
                         help='Iteration number (default: 10)', required=False)
@@ -28,16 +34,170 @@ if __name__ == '__main__':
     parser.add_argument('-g', action='store_true',
                         help='Turns on graphical features', required=False)
 
+    parser.add_argument('--headless', action='store_true',
+                        help='Render the frames offscreen without a window (with -g)', required=False)
+
+    parser.add_argument('--background-render', action='store_true',
+                        help='Render the frames offscreen in a separate process, frames are skipped while it is busy',
+                        required=False)
+
+    parser.add_argument('--render-every', metavar='int', type=int, default=1,
+                        help='Draw only every n-th iteration (default: 1)', required=False)
+
+    parser.add_argument('--animation', choices=['gif', 'mp4', 'none'], default='gif',
+                        help='Animation streamed into ./results during the run, mp4 needs imageio-ffmpeg '
+                             '(default: gif)', required=False)
+
+    parser.add_argument('--save-frames', action='store_true',
+                        help='Save every drawn frame as a PNG into ./results', required=False)
+
     parser.add_argument('-l', action='store_true',
                         help='Save log', required=False)
 
+    parser.add_argument('--solver', choices=['dense', 'sparse'], default='dense',
+                        help='Stiffness matrix format and factorization (default: dense)', required=False)
+
+    parser.add_argument('--method', choices=['guess', 'adaptive', 'gradient'], default='guess',
+                        help='Updating method: element-wise guess, element-wise guess with an adaptive step size or '
+                             'adjoint gradient (default: guess)', required=False)
+
+    parser.add_argument('--parameters', choices=['E', 'A', 'EA'], default='E',
+                        help='Updated element parameters: Young\'s modulus, cross-sectional area or both '
+                             '(default: E)', required=False)
+
+    parser.add_argument('--material-bounds', metavar='float', type=float, nargs=2, default=[0.0, float('inf')],
+                        help='Lower and upper bound of the Young\'s moduli relative to the original ones '
+                             '(default: unbounded)', required=False)
+
+    parser.add_argument('--section-bounds', metavar='float', type=float, nargs=2, default=[0.0, float('inf')],
+                        help='Lower and upper bound of the cross-sectional areas relative to the original ones '
+                             '(default: unbounded)', required=False)
+
+    parser.add_argument('--tolerance', metavar='float', type=float, default=None,
+                        help='Stop when the updates decrease the error by less than this relative amount '
+                             '(default: 1e-4 with --method adaptive, off otherwise)', required=False)
+
+    parser.add_argument('--parameter-tolerance', metavar='float', type=float, default=None,
+                        help='Stop when the updates change the parameters by less than this relative amount '
+                             '(default: 1e-4 with --method adaptive, off otherwise)', required=False)
+
+    parser.add_argument('--stall-limit', metavar='int', type=int, default=3,
+                        help='Number of updates in a row without progress before stopping (default: 3)',
+                        required=False)
+
+    parser.add_argument('-w', '--workers', metavar='int', type=int, default=1,
+                        help='Number of processes evaluating the guesses (default: 1)', required=False)
+
+    parser.add_argument('--stats', action='store_true',
+                        help='Save per-iteration timing statistics to ./logs (JSON lines and Prometheus text)',
+                        required=False)
+
+    parser.add_argument('--sensor', metavar='str', type=str, default='',
+                        help='Sensor stream: tcp://host:port, unix:///path or a device/FIFO path (default: mocked)',
+                        required=False)
+
+    parser.add_argument('--load-series', metavar='str', type=str, default='',
+                        help='Replay a load file record by record, one record per iteration '
+                             '(default: ./loads/<title>.txt in every iteration)', required=False)
+
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Run sensor reading, solving and rendering in parallel stages', required=False)
+
+    parser.add_argument('--backpressure', choices=['drop-oldest', 'block'], default='drop-oldest',
+                        help='Full stage queue policy of the pipeline: skip old measurements and frames or wait '
+                             '(default: drop-oldest)', required=False)
+
+    parser.add_argument('--checkpoint-every', metavar='int', type=int, default=0,
+                        help='Save the updating state into ./results/<title>.checkpoint every n-th iteration and '
+                             'at exit (default: 0, off)', required=False)
+
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint of an earlier run, -i counts its iterations too',
+                        required=False)
+
+    parser.add_argument('--batch', metavar='str', type=str, default='',
+                        help='Run the jobs of a JSON manifest or every structure of a folder (like ./structures) '
+                             'instead of a single structure, -m, -i and the updating flags (--method, --parameters, '
+                             'the bounds and the tolerances) are the defaults of the jobs', required=False)
+
+    parser.add_argument('-j', '--jobs', metavar='int', type=int, default=1,
+                        help='Number of parallel batch jobs (default: 1)', required=False)
+
+    parser.add_argument('--batch-output', metavar='str', type=str, default='./batch',
+                        help='Output folder of the batch, one subfolder per job and summary.json (default: ./batch)',
+                        required=False)
+
+    parser.add_argument('--serve', metavar='str', type=str, default='',
+                        help='Hand out the batch jobs to remote workers listening on tcp://host:port or '
+                             'unix:///path instead of running them locally (with --batch)', required=False)
+
+    parser.add_argument('--worker', metavar='str', type=str, default='',
+                        help='Run jobs of the coordinator at tcp://host:port or unix:///path until it is done',
+                        required=False)
+
     # parser.add_argument("-s", "--simulation", metavar='int', type=int,
     # choices=range(2), default=0, help="0: No|1: Yes")
 
     args = parser.parse_args()
 
+    if args.worker:
+        serve(args.worker)
+        parser.exit()
+
+    # Updating flags of the batch jobs without their own
+    defaults = {'method': args.method, 'parameters': args.parameters, 'material_bounds': args.material_bounds,
+                'section_bounds': args.section_bounds, 'tolerance': args.tolerance,
+                'parameter_tolerance': args.parameter_tolerance, 'stall_limit': args.stall_limit}
+
+    if args.batch and args.serve:
+        logger = start_logging(label='batch')
+        coordinator = Coordinator(args.serve, read_manifest(args.batch, args.measurements, args.iteration,
+                                                            defaults)).start()
+        logger.info('Waiting for workers at %s' % coordinator.address)
+        start = time.time()
+        try:
+            results = coordinator.wait()
+        finally:
+            coordinator.close()
+        write_summary(results, args.batch_output, len(set(x['worker'] for x in results)), time.time() - start, logger)
+        parser.exit()
+
+    if args.batch:
+        run_batch(read_manifest(args.batch, args.measurements, args.iteration, defaults), workers=args.jobs,
+                  output_dir=args.batch_output, logger=start_logging(label='batch'))
+        parser.exit()
+
+    if not args.structure or not args.measurements:
+        parser.error('the following arguments are required: -s/--structure, -m/--measurements')
+
+    if args.pipeline and args.g and not (args.headless or args.background_render):
+        parser.error('--pipeline draws in a separate thread, use -g with --headless or --background-render')
+
+    if args.method == 'adaptive' or args.tolerance is not None or args.parameter_tolerance is not None:
+        convergence = Convergence(error_tolerance=1e-4 if args.tolerance is None else args.tolerance,
+                                  parameter_tolerance=1e-4 if args.parameter_tolerance is None
+                                  else args.parameter_tolerance, stall_limit=args.stall_limit)
+    else:
+        convergence = None
+
     # Define new structure
-    Truss = Truss(input_file='%s.str' % args.structure.replace('.str', ''), title=args.title.replace('.str', ''),
-                  measurements=args.measurements, graphics=args.g, log=args.l)
+    if args.structure.endswith('.trb'):
+        input_file = args.structure
+    else:
+        input_file = '%s.str' % args.structure.replace('.str', '')
+
+    Truss = Truss(input_file=input_file, title=args.title.replace('.str', ''),
+                  measurements=args.measurements, graphics=args.g, log=args.l, solver=args.solver,
+                  method=args.method, workers=args.workers, stats=args.stats, sensor=args.sensor,
+                  load_series=args.load_series,
+                  headless=args.headless, render_every=args.render_every,
+                  animation='' if args.animation == 'none' else args.animation, save_frames=args.save_frames,
+                  background_render=args.background_render, checkpoint_every=args.checkpoint_every,
+                  convergence=convergence,
+                  parameterization=Parameterization(args.parameters, args.material_bounds, args.section_bounds))
 
-    Truss.start_model_updating(args.iteration)
+    if args.pipeline:
+        Truss.start_pipelined_updating(args.iteration, acquisition_policy=args.backpressure,
+                                       render_policy=args.backpressure, resume=args.resume)
+    else:
+        Truss.start_model_updating(args.iteration, resume=args.resume)
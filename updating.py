@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Rank-one trials, adjoint sensitivities, Levenberg-Marquardt steps and the convergence criteria of the model updating.
+"""
+
+import math
+import numpy
+from scipy import sparse
+
+from stiffness import element_dofs, element_geometry
+
+
+def reduced_index(dof_number, free_dofs):
+    """
+    Maps global DOF IDs to positions in the reduced system
+
+    :param dof_number: number of DOFs of the structure
+    :param free_dofs: list of unconstrained DOF IDs
+    :return: array of reduced indices, -1 for constrained DOFs
+    """
+    index = numpy.full(dof_number, -1, dtype=int)
+    index[numpy.asarray(free_dofs, dtype=int)] = numpy.arange(len(free_dofs))
+
+    return index
+
+
+def element_directions(coordinates, connectivity, free_dofs):
+    """
+    Sparse matrix of the element direction vectors in the reduced system.
+    The stiffness matrix of element i is k_i * b_i * b_i^T where b_i is the i-th column.
+
+    :param coordinates: [N x 3] array of nodal coordinates
+    :param connectivity: [E x 2] array of end-node IDs
+    :param free_dofs: list of unconstrained DOF IDs
+    :return: (lengths [E], B [n_free x E] scipy.sparse.csc_matrix)
+    """
+    lengths, cosines = element_geometry(coordinates, connectivity)
+    rows = reduced_index(len(coordinates) * 3, free_dofs)[element_dofs(connectivity)]
+    values = numpy.hstack([cosines, -cosines])
+    cols = numpy.repeat(numpy.arange(len(lengths)), 6).reshape(-1, 6)
+
+    kept = rows >= 0
+    directions = sparse.csc_matrix((values[kept], (rows[kept], cols[kept])), shape=(len(free_dofs), len(lengths)))
+
+    return lengths, directions
+
+
+class RankOneEvaluator(object):
+    def __init__(self, factorization, free_dofs, forces, coordinates, connectivity, material, section, measurements,
+                 chunk=256, elements=None):
+        """
+        Evaluates single-element stiffness changes with the Sherman-Morrison formula on a factorized base system
+
+        :param factorization: factorized reduced stiffness matrix of the base structure
+        :param free_dofs: list of unconstrained DOF IDs
+        :param forces: global load vector
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param material: [E] array of Young's moduli of the base structure
+        :param section: [E] array of cross-sectional areas of the base structure
+        :param measurements: [[DOF ID, displacement], ...]
+        :param chunk: number of elements back-substituted together
+        :param elements: IDs of the evaluated elements (default: all), the trials are indexed in this order
+        """
+        self.dof_number = len(coordinates) * 3
+        self.free_dofs = numpy.asarray(free_dofs, dtype=int)
+        self.factorization = factorization
+
+        lengths, self.directions = element_directions(coordinates, connectivity, free_dofs)
+        self.element_stiffness = numpy.asarray(material, dtype=float) * numpy.asarray(section, dtype=float) / lengths
+
+        if elements is not None:
+            self.directions = self.directions[:, elements]
+            self.element_stiffness = self.element_stiffness[elements]
+
+        self.measured_dofs = numpy.array([x[0] for x in measurements], dtype=int)
+        self.measured_values = numpy.array([x[1] for x in measurements], dtype=float)
+        measured_rows = reduced_index(self.dof_number, free_dofs)[self.measured_dofs]
+
+        # Base solution and its projections
+        self.base = factorization.solve(numpy.asarray(forces, dtype=float)[self.free_dofs])
+        self.projection = self.directions.T.dot(self.base)
+        self.base_measured = numpy.where(measured_rows >= 0, self.base[measured_rows], 0.0)
+
+        # Influence of a unit element stiffness: b_i^T K^-1 b_i and (K^-1 b_i) on the measured DOFs
+        element_number = len(self.element_stiffness)
+        self.flexibility = numpy.zeros(element_number)
+        self.influence = numpy.zeros((len(self.measured_dofs), element_number))
+        for start in range(0, element_number, chunk):
+            block = self.directions[:, start:start + chunk].toarray()
+            solution = factorization.solve(block)
+            self.flexibility[start:start + chunk] = (block * solution).sum(axis=0)
+            self.influence[:, start:start + chunk] = numpy.where((measured_rows >= 0)[:, None],
+                                                                 solution[measured_rows], 0.0)
+
+    def coefficients(self, factors):
+        """
+        Sherman-Morrison coefficients of the scaled elements
+
+        :param factors: [E] or [K x E] array, the i-th element's stiffness is multiplied by factors[..., i]
+        :return: array like the factors, the displacement change of element i is -coefficient_i * K^-1 b_i
+        """
+        alpha = (numpy.asarray(factors, dtype=float) - 1) * self.element_stiffness
+        return alpha * self.projection / (1 + alpha * self.flexibility)
+
+    def measured_displacements(self, factors):
+        """
+        :param factors: [E] array of stiffness multipliers, one trial per element
+        :return: [M x E] array: displacements of the measured DOFs for each trial
+        """
+        return self.base_measured[:, None] - self.influence * self.coefficients(factors)[None, :]
+
+    def errors(self, factors):
+        """
+        Errors of the single-element trials, see truss_objects.error()
+        Several factor vectors are evaluated together on the same back-substitutions.
+
+        :param factors: [E] array of stiffness multipliers, one trial per element, or [K x E] for K trials per element
+        :return: array of errors like the factors
+        """
+        coefficients = self.coefficients(factors)
+        residual = (self.measured_values - self.base_measured)[:, None] + self.influence * coefficients[..., None, :]
+
+        return numpy.sqrt((residual ** 2).sum(axis=-2))
+
+    def error(self, index, factor):
+        """
+        Error of one trial, without evaluating the other elements
+
+        :param index: position of the trial, the element ID when all elements are evaluated
+        :param factor: stiffness multiplier of the element
+        :return: float
+        """
+        alpha = (factor - 1) * self.element_stiffness[index]
+        coefficient = alpha * self.projection[index] / (1 + alpha * self.flexibility[index])
+        residual = self.measured_values - (self.base_measured - self.influence[:, index] * coefficient)
+
+        return math.sqrt((residual ** 2).sum())
+
+    def displacements(self, index, factor):
+        """
+        Global displacement vector of one trial
+
+        :param index: position of the trial, the element ID when all elements are evaluated
+        :param factor: stiffness multiplier of the element
+        :return: [3N] array of displacements
+        """
+        direction = self.directions[:, index].toarray().ravel()
+        alpha = (factor - 1) * self.element_stiffness[index]
+        coefficient = alpha * self.projection[index] / (1 + alpha * self.flexibility[index])
+
+        displacements = numpy.zeros(self.dof_number)
+        displacements[self.free_dofs] = self.base - coefficient * self.factorization.solve(direction)
+
+        return displacements
+
+
+class AdjointSensitivity(object):
+    def __init__(self, factorization, free_dofs, forces, coordinates, connectivity, material, section, measurements):
+        """
+        Analytic sensitivities of the measured displacements and the error with respect to the materials
+
+        :param factorization: factorized reduced stiffness matrix of the structure
+        :param free_dofs: list of unconstrained DOF IDs
+        :param forces: global load vector
+        :param coordinates: [N x 3] array of nodal coordinates
+        :param connectivity: [E x 2] array of end-node IDs
+        :param material: [E] array of Young's moduli
+        :param section: [E] array of cross-sectional areas
+        :param measurements: [[DOF ID, displacement], ...]
+        """
+        self.factorization = factorization
+
+        lengths, self.directions = element_directions(coordinates, connectivity, free_dofs)
+        self.material = numpy.asarray(material, dtype=float)
+        self.section = numpy.asarray(section, dtype=float)
+
+        # dK/dE_i = (A_i / L_i) * b_i * b_i^T
+        self.unit_stiffness = self.section / lengths
+
+        measured_dofs = numpy.array([x[0] for x in measurements], dtype=int)
+        measured_rows = reduced_index(len(coordinates) * 3, free_dofs)[measured_dofs]
+        self.measured_rows = measured_rows
+
+        self.displacements = factorization.solve(numpy.asarray(forces, dtype=float)[numpy.asarray(free_dofs)])
+        self.projection = self.directions.T.dot(self.displacements)
+
+        # Residual: calculated - measured
+        calculated = numpy.where(measured_rows >= 0, self.displacements[measured_rows], 0.0)
+        self.residual = calculated - numpy.array([x[1] for x in measurements], dtype=float)
+        self.error = math.sqrt((self.residual ** 2).sum())
+
+    def selection(self):
+        """
+        :return: [n_free x M] array selecting the measured DOFs from the reduced displacement vector
+        """
+        selection = numpy.zeros((len(self.displacements), len(self.measured_rows)))
+        measured = numpy.nonzero(self.measured_rows >= 0)[0]
+        selection[self.measured_rows[measured], measured] = 1.0
+
+        return selection
+
+    def gradient(self):
+        """
+        d(error)/d(E_i) of all elements from one adjoint solve
+
+        :return: [E] array
+        """
+        if self.error == 0:
+            return numpy.zeros(len(self.material))
+
+        adjoint = self.factorization.solve(self.selection().dot(self.residual))
+
+        return -self.unit_stiffness * self.projection * self.directions.T.dot(adjoint) / self.error
+
+    def jacobian(self):
+        """
+        d(u_m)/d(E_i) of the measured displacements, one adjoint solve per measurement
+
+        :return: [M x E] array
+        """
+        adjoint = self.factorization.solve(self.selection())
+
+        return -(self.unit_stiffness * self.projection)[None, :] * self.directions.T.dot(adjoint).T
+
+
+def levenberg_marquardt_step(jacobian, residual, damping):
+    """
+    Damped Gauss-Newton step minimizing |residual + jacobian * step|^2 + damping * |step|^2.
+    The normal equations are solved in the measurement space, so the cost does not depend on
+    the number of parameters.
+
+    :param jacobian: [M x P] array
+    :param residual: [M] array: calculated - measured
+    :param damping: Levenberg-Marquardt damping, relative to the mean diagonal of J*J^T
+    :return: [P] array
+    """
+    normal = jacobian.dot(jacobian.T)
+    scale = numpy.trace(normal) / max(len(normal), 1)
+    if scale == 0:
+        return numpy.zeros(jacobian.shape[1])
+
+    normal[numpy.diag_indices_from(normal)] += damping * scale
+
+    return -jacobian.T.dot(numpy.linalg.solve(normal, residual))
+
+
+class Convergence(object):
+    def __init__(self, error_tolerance=1e-4, parameter_tolerance=1e-4, stall_limit=3, min_step=1e-3,
+                 error_target=0.0):
+        """
+        Termination criteria of the model updating
+
+        An update stalls if it decreases the error by less than error_tolerance (relative) or changes no parameter
+        by more than parameter_tolerance (relative). The updating converges after stall_limit stalls in a row,
+        when the step size of the adaptive method falls below min_step or when the error reaches error_target.
+
+        :param error_tolerance: smallest relative error decrease of a useful update
+        :param parameter_tolerance: smallest relative parameter change of a useful update
+        :param stall_limit: number of stalled updates in a row before stopping
+        :param min_step: smallest relative step size of the adaptive method
+        :param error_target: error small enough to stop
+        """
+        self.error_tolerance = error_tolerance
+        self.parameter_tolerance = parameter_tolerance
+        self.stall_limit = stall_limit
+        self.min_step = min_step
+        self.error_target = error_target
+
+        self.stalls = 0
+        self.reason = ''
+
+    @property
+    def converged(self):
+        return bool(self.reason)
+
+    def check(self, error, new_error, parameter_change, step=None):
+        """
+        :param error: error before the update
+        :param new_error: error of the updated structure
+        :param parameter_change: largest relative parameter change of the update
+        :param step: step size of the adaptive method, None for the other methods
+        :return: True if the updating converged
+        """
+        error_change = (error - new_error) / error if error > 0 else 0.0
+
+        if error_change < self.error_tolerance or parameter_change < self.parameter_tolerance:
+            self.stalls += 1
+        else:
+            self.stalls = 0
+
+        if new_error <= self.error_target:
+            self.reason = 'error %.3g reached the target %.3g' % (new_error, self.error_target)
+        elif self.stalls >= self.stall_limit:
+            self.reason = 'no progress in %i updates' % self.stalls
+        elif step is not None and step < self.min_step:
+            self.reason = 'step size %.3g is below %.3g' % (step, self.min_step)
+
+        return self.converged
+
+    def reset(self):
+        """
+        :return: None
+        """
+        self.stalls = 0
+        self.reason = ''